@@ -12,7 +12,15 @@ import pytz
 import json
 import os
 import math
+import copy
+import pickle
+import sqlite3
+import hashlib
+import itertools
+import sys
+import argparse
 import time as time_module
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, date, time, timedelta
 from typing import Dict, List, Optional, Tuple
 
@@ -20,12 +28,7 @@ from typing import Dict, List, Optional, Tuple
 # MATH FUNCTIONS
 # ═══════════════════════════════════════════════════════════════════════════════
 def norm_cdf(x):
-    a1,a2,a3,a4,a5=0.254829592,-0.284496736,1.421413741,-1.453152027,1.061405429
-    p,sign=0.3275911,1 if x>=0 else -1
-    x=abs(x)/math.sqrt(2)
-    t=1.0/(1.0+p*x)
-    y=1.0-(((((a5*t+a4)*t)+a3)*t+a2)*t+a1)*t*math.exp(-x*x)
-    return 0.5*(1.0+sign*y)
+    return 0.5*math.erfc(-x/math.sqrt(2))
 
 def black_scholes(S,K,T,r,sigma,opt_type):
     if T<=0:return max(0,S-K) if opt_type=="CALL" else max(0,K-S)
@@ -34,6 +37,74 @@ def black_scholes(S,K,T,r,sigma,opt_type):
     if opt_type=="CALL":return S*norm_cdf(d1)-K*math.exp(-r*T)*norm_cdf(d2)
     return K*math.exp(-r*T)*norm_cdf(-d2)-S*norm_cdf(-d1)
 
+# Chebyshev fit of erfc(z)·exp(z²) for z ≥ 0 (Numerical Recipes 3rd ed. §6.2.2):
+# relative error ~1e-15 from the center deep into the tail, where the old
+# Abramowitz-Stegun 7.1.26 fit (absolute error ~1e-7) had none left
+ERFC_CHEB=np.array([
+    -1.3026537197817094,6.4196979235649026e-1,1.9476473204185836e-2,-9.561514786808631e-3,
+    -9.46595344482036e-4,3.66839497852761e-4,4.2523324806907e-5,-2.0278578112534e-5,
+    -1.624290004647e-6,1.303655835580e-6,1.5626441722e-8,-8.5238095915e-8,
+    6.529054439e-9,5.059343495e-9,-9.91364156e-10,-2.27365122e-10,
+    9.6467911e-11,2.394038e-12,-6.886027e-12,8.94487e-13,
+    3.13092e-13,-1.12708e-13,3.81e-16,7.106e-15,
+    -1.523e-15,-9.4e-17,1.21e-16,-2.8e-17])
+
+def _erfc_block(x):
+    z=np.minimum(np.abs(x),30.0)  # erfc(30) underflows to 0 anyway; keeps inf out of the split
+    t=2.0/(2.0+z)
+    ty=4.0*t-2.0
+    d=np.zeros_like(z)
+    dd=np.zeros_like(z)
+    for c in ERFC_CHEB[:0:-1]:
+        d,dd=ty*d-dd+c,d
+    # exp(-z²) with z² split so the large exponent is exact (keeps the tail relative error flat)
+    zh=np.round(z*4096)/4096
+    r=t*np.exp(-zh*zh)*np.exp(-(z-zh)*(z+zh)+0.5*(ERFC_CHEB[0]+ty*d)-dd)
+    return np.where(x>=0,r,2.0-r)
+
+def erfc_array(x, block=65536):
+    """math.erfc() over an array, evaluated in cache-sized blocks (the recurrence is memory bound)"""
+    x=np.asarray(x,dtype=float)
+    flat=x.ravel()
+    out=np.empty_like(flat)
+    for i in range(0,len(flat),block):
+        out[i:i+block]=_erfc_block(flat[i:i+block])
+    return out.reshape(x.shape)
+
+def norm_cdf_array(x):
+    """norm_cdf() over an array"""
+    return 0.5*erfc_array(-np.asarray(x,dtype=float)/math.sqrt(2))
+
+def norm_pdf_array(x):
+    x=np.asarray(x,dtype=float)
+    return np.exp(-0.5*x*x)/math.sqrt(2*math.pi)
+
+def black_scholes_array(S,K,T,r,sigma,is_call):
+    """
+    black_scholes() broadcast over arrays of any compatible shapes
+    is_call is a bool array or "CALL"/"PUT" strings. Agrees with the scalar
+    function to ~1e-12; scalar inputs give a 0-d array.
+    """
+    S,K,T,r,sigma=[np.asarray(a,dtype=float) for a in (S,K,T,r,sigma)]
+    is_call=np.asarray(is_call)
+    if is_call.dtype.kind in "UO":
+        is_call=is_call=="CALL"
+    live=T>0
+    Tl=np.where(live,T,0.0)
+    sq=np.sqrt(np.where(live,T,1.0))
+    with np.errstate(divide="ignore",invalid="ignore"):
+        d1=(np.log(S/K)+(r+0.5*sigma**2)*Tl)/(sigma*sq)
+    d2=d1-sigma*sq
+    disc=K*np.exp(-r*Tl)
+    call=S*norm_cdf_array(d1)-disc*norm_cdf_array(d2)
+    put=disc*norm_cdf_array(-d2)-S*norm_cdf_array(-d1)
+    return np.where(live,np.where(is_call,call,put),np.where(is_call,np.maximum(S-K,0),np.maximum(K-S,0)))
+
+def black_scholes_grid(S,K,T,sigma,r=0.05,is_call=True):
+    """Prices over the full grid of 1-D S × K × T × sigma, shape (len(S),len(K),len(T),len(sigma))"""
+    S,K,T,sigma=np.ix_(*[np.atleast_1d(np.asarray(a,dtype=float)) for a in (S,K,T,sigma)])
+    return black_scholes_array(S,K,T,r,sigma,is_call)
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # CONFIG
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -45,6 +116,22 @@ BREAK_THRESHOLD=6.0
 POLYGON_KEY="DCWuTS1R_fukpfjgf7QnXrLTEOS_giq6"
 POLYGON_BASE="https://api.polygon.io"
 SAVE_FILE="spx_prophet_v6_inputs.json"
+RESULTS_DB="spx_prophet_results.db"
+STRATEGY_VERSION="6.1"
+INTRABAR_DIR="intrabar_store"  # ES_<interval>_<YYYY-MM-DD>.csv, finer bars for outcome resolution
+INTRABAR_INTERVALS=("1m","5m")  # tried finest first
+ES_HISTORY_FILE="es_30m_history.csv"  # local multi-month 30m ES store the indicators warm up from
+ES_HISTORY_DAYS=180
+INDICATOR_STATE_FILE="indicator_engine.pkl"
+IV_CALIBRATION_FILE="iv_calibration.json"  # written by calibrate-iv, read lazily by odte_iv()
+FLOW_FEATURES_FILE="flow_features.csv"  # daily flow pillars by date, see build_flow_features()
+FLOW_TICKERS=["^VVIX","^VIX","^VIX3M","SPY","RSP","XLK","XLU"]
+
+# Maintenance breaks as (start, end) hours from Monday 00:00 CT:
+# Mon-Thu 4-5 PM, plus the weekend from Fri 4 PM to Sun 5 PM
+WEEKLY_BREAKS=np.array([(16,17),(40,41),(64,65),(88,89),(112,161)],dtype=np.int64)
+HOUR_NS=3_600_000_000_000
+CLOCK_EPOCH=pd.Timestamp("2000-01-03").value  # a Monday
 
 VIX_ZONES={"EXTREME_LOW":(0,12),"LOW":(12,16),"NORMAL":(16,20),"ELEVATED":(20,25),"HIGH":(25,35),"EXTREME":(35,100)}
 
@@ -1498,6 +1585,45 @@ def blocks_between(start,end):
     
     return max(0,raw_blocks-maintenance_blocks-weekend_adjustment)
 
+def block_clock(times):
+    """
+    Vectorized companion to blocks_between().
+    Maps timestamps onto a continuous 30-min block clock with every maintenance
+    break cut out, so for bar-aligned times:
+        blocks_between(a,b) == block_clock(b) - block_clock(a)
+    One call handles any number of anchors - no per-anchor Python loops.
+
+    Works on CT wall-clock time: DST shifts happen inside the weekend break,
+    which is cut out entirely, so trading time is identical to elapsed time.
+    """
+    if isinstance(times,pd.DatetimeIndex):
+        idx=times
+    else:
+        idx=pd.DatetimeIndex(pd.to_datetime(np.atleast_1d(times)))
+    if idx.tz is None:
+        idx=idx.tz_localize(CT)
+    else:
+        idx=idx.tz_convert(CT)
+    if len(idx)==0:
+        return np.zeros(0)
+    wall=idx.tz_localize(None).as_unit("ns").asi8-CLOCK_EPOCH
+    week=168*HOUR_NS
+    weeks=np.floor_divide(wall,week)
+    into_week=wall-weeks*week
+    starts=WEEKLY_BREAKS[:,0]*HOUR_NS
+    lengths=(WEEKLY_BREAKS[:,1]-WEEKLY_BREAKS[:,0])*HOUR_NS
+    cut=np.clip(into_week[:,None]-starts,0,lengths).sum(axis=1)
+    return (wall-weeks*lengths.sum()-cut)/1.8e12
+
+def candles_to_ct(es_candles):
+    """Copy of the candle frame with its index in CT (Yahoo naive index is ET)"""
+    df=es_candles.copy()
+    if df.index.tz is None:
+        df.index=df.index.tz_localize(ET).tz_convert(CT)
+    else:
+        df.index=df.index.tz_convert(CT)
+    return df
+
 def get_vix_zone(vix):
     for z,(lo,hi) in VIX_ZONES.items():
         if lo<=vix<hi:return z
@@ -1606,6 +1732,63 @@ def fetch_es_candles(days=7, offset=18.0):
     
     return None
 
+@st.cache_data(ttl=3600,show_spinner=False)
+def load_intrabar_csv(trading_date, interval="5m", directory=INTRABAR_DIR):
+    """ES intrabar candles for one trading date from the local store (CT index), None if missing"""
+    path=os.path.join(directory,f"ES_{interval}_{trading_date.isoformat()}.csv")
+    if not os.path.exists(path):
+        return None
+    try:
+        df=pd.read_csv(path,index_col=0)
+        try:
+            idx=pd.DatetimeIndex(pd.to_datetime(df.index))
+        except ValueError:  # mixed UTC offsets
+            idx=pd.DatetimeIndex(pd.to_datetime(df.index,utc=True))
+        # Naive timestamps are CT wall clock (the store's convention); only tz-aware ones get converted
+        df.index=idx.tz_localize(CT) if idx.tz is None else idx.tz_convert(CT)
+        return df[['Open','High','Low','Close']].sort_index()
+    except Exception:
+        return None
+
+@st.cache_data(ttl=3600,show_spinner=False)
+def fetch_es_intrabar(trading_date, interval="5m"):
+    """ES intrabar candles for one trading date from yfinance (CT index), None if unavailable"""
+    try:
+        data=yf.Ticker("ES=F").history(start=trading_date,end=trading_date+timedelta(days=1),interval=interval)
+        if data is not None and not data.empty:
+            return candles_to_ct(data)[['Open','High','Low','Close']]
+    except Exception:
+        pass
+    return None
+
+def get_intrabar_loader(source="auto", intervals=INTRABAR_INTERVALS, directory=INTRABAR_DIR):
+    """
+    Build a loader(start, end) → intrabar ES candles in [start, end) (CT), or None
+    
+    source: "local" (INTRABAR_DIR store), "yfinance", or "auto" (local, then yfinance).
+    Whole days are fetched once and cached; windows are sliced from them, so
+    only days that actually need resolving are ever loaded.
+    """
+    sources=[]
+    if source in ("auto","local"):
+        sources.append(lambda d,iv: load_intrabar_csv(d,iv,directory))
+    if source in ("auto","yfinance"):
+        sources.append(fetch_es_intrabar)
+    
+    def loader(start, end):
+        for fetch in sources:
+            for interval in intervals:
+                day=fetch(start.astimezone(CT).date(),interval)
+                if day is None or day.empty:
+                    continue
+                window=day[(day.index>=start)&(day.index<end)]
+                if not window.empty:
+                    window.attrs["interval"]=interval
+                    return window
+        return None
+    
+    return loader
+
 @st.cache_data(ttl=60,show_spinner=False)
 def fetch_spx_polygon():
     try:
@@ -1732,13 +1915,8 @@ def extract_historical_data(es_candles,trading_date,offset=18.0):
     
     # Convert index to CT
     # Yahoo Finance returns data in ET (Eastern Time), not UTC
-    df=es_candles.copy()
-    ET=pytz.timezone("America/New_York")
-    if df.index.tz is None:
-        df.index=df.index.tz_localize(ET).tz_convert(CT)
-    else:
-        df.index=df.index.tz_convert(CT)
-    
+    df=candles_to_ct(es_candles)
+
     # ─────────────────────────────────────────────────────────────────────────
     # SESSION TIMES (CT)
     # For Monday: overnight starts Sunday 5 PM, but prior RTH is Friday
@@ -1928,11 +2106,12 @@ def determine_channel(sydney_high,sydney_low,tokyo_high,tokyo_low):
     # Both highs and lows equal = truly flat, default to FALLING (conservative)
     return "FALLING","Flat overnight - defaulting to FALLING (conservative)"
 
-def calculate_channel_levels(on_high,on_high_time,on_low,on_low_time,ref_time):
+def calculate_channel_levels(on_high,on_high_time,on_low,on_low_time,ref_time,slope=None):
+    slope=SLOPE if slope is None else slope
     blocks_high=blocks_between(on_high_time,ref_time)
     blocks_low=blocks_between(on_low_time,ref_time)
-    exp_high=SLOPE*blocks_high
-    exp_low=SLOPE*blocks_low
+    exp_high=slope*blocks_high
+    exp_low=slope*blocks_low
     
     return {
         "ceiling_rising":{"level":round(on_high+exp_high,2),"anchor":on_high,"blocks":blocks_high},
@@ -1970,20 +2149,21 @@ def assess_position(price,ceiling,floor):
 # CONES
 # ═══════════════════════════════════════════════════════════════════════════════
 def calculate_cones(prior_high_wick,prior_high_wick_time,prior_high_close,prior_high_close_time,
-                   prior_low_close,prior_low_close_time,prior_close,prior_close_time,ref_time):
+                   prior_low_close,prior_low_close_time,prior_close,prior_close_time,ref_time,slope=None):
     """
     Calculate cone rails with correct anchors:
     - HIGH: Ascending from highest wick, Descending from highest close
     - LOW: Both from lowest close
     - CLOSE: Both from last RTH close
     """
+    slope=SLOPE if slope is None else slope
     cones={}
     
     # HIGH cone - different anchors for asc vs desc
     blocks_high_wick=blocks_between(prior_high_wick_time,ref_time)
     blocks_high_close=blocks_between(prior_high_close_time,ref_time)
-    exp_high_wick=SLOPE*blocks_high_wick
-    exp_high_close=SLOPE*blocks_high_close
+    exp_high_wick=slope*blocks_high_wick
+    exp_high_close=slope*blocks_high_close
     cones["HIGH"]={
         "anchor_asc":prior_high_wick,
         "anchor_desc":prior_high_close,
@@ -1995,7 +2175,7 @@ def calculate_cones(prior_high_wick,prior_high_wick_time,prior_high_close,prior_
     
     # LOW cone - both from lowest close
     blocks_low=blocks_between(prior_low_close_time,ref_time)
-    exp_low=SLOPE*blocks_low
+    exp_low=slope*blocks_low
     cones["LOW"]={
         "anchor_asc":prior_low_close,
         "anchor_desc":prior_low_close,
@@ -2007,7 +2187,7 @@ def calculate_cones(prior_high_wick,prior_high_wick_time,prior_high_close,prior_
     
     # CLOSE cone - both from last RTH close
     blocks_close=blocks_between(prior_close_time,ref_time)
-    exp_close=SLOPE*blocks_close
+    exp_close=slope*blocks_close
     cones["CLOSE"]={
         "anchor_asc":prior_close,
         "anchor_desc":prior_close,
@@ -2035,6 +2215,222 @@ def find_targets(entry_level,cones,direction):
         targets.sort(key=lambda x:x["level"],reverse=True)
     return targets
 
+# ═══════════════════════════════════════════════════════════════════════════════
+# MULTI-ANCHOR LEVELS - Rails from every swing pivot
+# ═══════════════════════════════════════════════════════════════════════════════
+def find_swing_pivots(es_candles,window=2):
+    """
+    Detect every swing high/low in one rolling-window pass.
+    A swing high is a bar whose High is the highest of the `window` bars on
+    each side (ties resolve to the leftmost bar); swing lows mirror on Low.
+    Returns a dict of parallel arrays: time, price, kind (+1 high / -1 low).
+    """
+    empty={"time":pd.DatetimeIndex([],tz=CT),"price":np.zeros(0),"kind":np.zeros(0,dtype=np.int8)}
+    if es_candles is None or es_candles.empty:
+        return empty
+
+    df=candles_to_ct(es_candles)
+    span=2*window+1
+    if len(df)<span:
+        return empty
+
+    high=df["High"].to_numpy(dtype=float)
+    low=df["Low"].to_numpy(dtype=float)
+    is_high=np.zeros(len(df),dtype=bool)
+    is_low=np.zeros(len(df),dtype=bool)
+    is_high[window:len(df)-window]=np.lib.stride_tricks.sliding_window_view(high,span).argmax(axis=1)==window
+    is_low[window:len(df)-window]=np.lib.stride_tricks.sliding_window_view(low,span).argmin(axis=1)==window
+
+    hi_idx=np.flatnonzero(is_high)
+    lo_idx=np.flatnonzero(is_low)
+    idx=np.concatenate([hi_idx,lo_idx])
+    order=np.argsort(idx,kind="stable")
+    return {
+        "time":df.index[idx[order]],
+        "price":np.concatenate([high[hi_idx],low[lo_idx]])[order],
+        "kind":np.concatenate([np.ones(len(hi_idx),dtype=np.int8),-np.ones(len(lo_idx),dtype=np.int8)])[order],
+    }
+
+def build_pivot_levels(es_candles,ref_time,window=2,slope=None):
+    """
+    Project ascending and descending rails from every swing pivot to ref_time.
+
+    Only bars before ref_time are used, so a pivot needs its `window` right-hand
+    bars to have closed by then (no lookahead in historical mode).
+    All anchors are projected in bulk via block_clock(), and the result is a
+    level set sorted by price - query it with query_levels() in O(log n).
+    Prices are in ES terms like the channel and cone anchors.
+    """
+    slope=SLOPE if slope is None else slope
+    if es_candles is not None and not es_candles.empty:
+        df=candles_to_ct(es_candles)
+        df=df[df.index<ref_time]
+    else:
+        df=None
+    piv=find_swing_pivots(df,window)
+
+    n=len(piv["price"])
+    blocks=np.floor(block_clock(ref_time)[0]-block_clock(piv["time"])).clip(0) if n else np.zeros(0)
+    level=np.concatenate([piv["price"]+slope*blocks,piv["price"]-slope*blocks])
+    order=np.argsort(level,kind="stable")
+    return {
+        "level":level[order],
+        "anchor":np.concatenate([piv["price"],piv["price"]])[order],
+        "anchor_time":piv["time"].append(piv["time"])[order] if n else piv["time"],
+        "kind":np.concatenate([piv["kind"],piv["kind"]])[order],
+        "rail":np.concatenate([np.ones(n,dtype=np.int8),-np.ones(n,dtype=np.int8)])[order],
+        "blocks":np.concatenate([blocks,blocks])[order],
+        "ref_time":ref_time,
+        "slope":slope,
+    }
+
+def query_levels(level_set,lo,hi):
+    """Return every rail in a level set whose projected level lies in [lo, hi]"""
+    i=np.searchsorted(level_set["level"],lo,side="left")
+    j=np.searchsorted(level_set["level"],hi,side="right")
+    out=[]
+    for k in range(i,j):
+        kind="High" if level_set["kind"][k]>0 else "Low"
+        rail="Asc" if level_set["rail"][k]>0 else "Desc"
+        out.append({
+            "name":f"Swing {kind} {rail}",
+            "level":round(float(level_set["level"][k]),2),
+            "anchor":round(float(level_set["anchor"][k]),2),
+            "anchor_time":level_set["anchor_time"][k],
+            "blocks":int(level_set["blocks"][k])
+        })
+    return out
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# LEVEL CONFLUENCE
+# ═══════════════════════════════════════════════════════════════════════════════
+CONFLUENCE_WEIGHTS={"channel":3.0,"cone":2.0,"session":1.0,"pivot":1.0}
+
+def collect_active_levels(channel_type,on_high,on_high_time,on_low,on_low_time,
+                          prior_high_wick,prior_high_wick_time,prior_high_close,prior_high_close_time,
+                          prior_low_close,prior_low_close_time,prior_close,prior_close_time,pivot_levels=None):
+    """
+    Every level the page shows, described by its anchor instead of its value:
+    rail +1 ascends, -1 descends, 0 is flat. Projecting to a reference time is
+    then a single array op, which is what makes ref-time updates cheap.
+    """
+    ch_rail=1 if channel_type=="RISING" else -1
+    levels=[
+        {"name":"Ceiling","group":"channel","anchor":on_high,"anchor_time":on_high_time,"rail":ch_rail},
+        {"name":"Floor","group":"channel","anchor":on_low,"anchor_time":on_low_time,"rail":ch_rail},
+        {"name":"HIGH Asc","group":"cone","anchor":prior_high_wick,"anchor_time":prior_high_wick_time,"rail":1},
+        {"name":"HIGH Desc","group":"cone","anchor":prior_high_close,"anchor_time":prior_high_close_time,"rail":-1},
+        {"name":"LOW Asc","group":"cone","anchor":prior_low_close,"anchor_time":prior_low_close_time,"rail":1},
+        {"name":"LOW Desc","group":"cone","anchor":prior_low_close,"anchor_time":prior_low_close_time,"rail":-1},
+        {"name":"CLOSE Asc","group":"cone","anchor":prior_close,"anchor_time":prior_close_time,"rail":1},
+        {"name":"CLOSE Desc","group":"cone","anchor":prior_close,"anchor_time":prior_close_time,"rail":-1},
+        {"name":"O/N High","group":"session","anchor":on_high,"anchor_time":on_high_time,"rail":0},
+        {"name":"O/N Low","group":"session","anchor":on_low,"anchor_time":on_low_time,"rail":0},
+        {"name":"Prior Close","group":"session","anchor":prior_close,"anchor_time":prior_close_time,"rail":0},
+    ]
+    if pivot_levels is not None:
+        for k in range(len(pivot_levels["level"])):
+            kind="High" if pivot_levels["kind"][k]>0 else "Low"
+            rail=int(pivot_levels["rail"][k])
+            levels.append({"name":f"Swing {kind} {'Asc' if rail>0 else 'Desc'}","group":"pivot",
+                           "anchor":float(pivot_levels["anchor"][k]),"anchor_time":pivot_levels["anchor_time"][k],"rail":rail})
+    return [l for l in levels if l["anchor"] is not None and l["anchor_time"] is not None]
+
+def build_confluence_index(levels,ref_time,tolerance=3.0,slope=None):
+    """
+    Build a confluence index over a list from collect_active_levels().
+    Anchor clocks are computed once here; update_confluence_ref_time() then
+    only re-projects and re-sweeps when the reference time moves.
+    """
+    index={
+        "names":np.array([l["name"] for l in levels],dtype=object),
+        "groups":np.array([l["group"] for l in levels],dtype=object),
+        "anchor":np.array([l["anchor"] for l in levels],dtype=float),
+        "rail":np.array([l["rail"] for l in levels],dtype=float),
+        "anchor_clock":block_clock([l["anchor_time"] for l in levels]) if levels else np.zeros(0),
+        "weight":np.array([CONFLUENCE_WEIGHTS.get(l["group"],1.0) for l in levels],dtype=float),
+        "tolerance":tolerance,
+        "slope":SLOPE if slope is None else slope,
+        "ref_time":None,
+    }
+    return update_confluence_ref_time(index,ref_time)
+
+def update_confluence_ref_time(index,ref_time):
+    """
+    Re-project every level to a new reference time and regroup.
+    No-op if the time is unchanged. Grouping is one sort plus one linear sweep:
+    consecutive levels within `tolerance` of each other share a cluster.
+
+    Cluster score = total level weight (channel 3, cone 2, session/pivot 1),
+    discounted by how spread out the cluster is relative to the tolerance.
+    """
+    if index["ref_time"]==ref_time:
+        return index
+    tol=index["tolerance"]
+    n=len(index["anchor"])
+    if n:
+        blocks=np.floor(block_clock(ref_time)[0]-index["anchor_clock"]).clip(0)
+    else:
+        blocks=np.zeros(0)
+    level=index["anchor"]+index["rail"]*index["slope"]*blocks
+
+    order=np.argsort(level,kind="stable")
+    lv=level[order]
+    w=index["weight"][order]
+    starts=np.flatnonzero(np.concatenate([[True],np.diff(lv)>tol])) if n else np.zeros(0,dtype=int)
+    ends=np.append(starts[1:],n)
+    count=ends-starts
+    lo=lv[starts] if n else np.zeros(0)
+    hi=lv[ends-1] if n else np.zeros(0)
+    wsum=np.add.reduceat(w,starts) if n else np.zeros(0)
+    center=np.add.reduceat(lv*w,starts)/wsum if n else np.zeros(0)
+    spread=hi-lo
+
+    index.update({
+        "ref_time":ref_time,
+        "level":level,
+        "order":order,
+        "cluster_start":starts,
+        "cluster_end":ends,
+        "cluster_count":count,
+        "cluster_lo":lo,
+        "cluster_hi":hi,
+        "cluster_center":center,
+        "cluster_score":wsum*tol/(tol+spread),
+        "multi":np.flatnonzero(count>1),
+    })
+    return index
+
+def confluence_cluster(index,k):
+    """Materialize cluster k as a display dict"""
+    members=index["order"][index["cluster_start"][k]:index["cluster_end"][k]]
+    return {
+        "center":round(float(index["cluster_center"][k]),2),
+        "lo":round(float(index["cluster_lo"][k]),2),
+        "hi":round(float(index["cluster_hi"][k]),2),
+        "count":int(index["cluster_count"][k]),
+        "score":round(float(index["cluster_score"][k]),1),
+        "members":[(index["names"][m],round(float(index["level"][m]),2)) for m in members],
+    }
+
+def find_confluence(index,price,min_count=2):
+    """
+    Nearest cluster with at least min_count levels - O(log k), cheap enough
+    to call on every tick. Returns the cluster dict plus signed distance
+    (price - center), or None if there are no such clusters.
+    """
+    ks=index["multi"] if min_count==2 else np.flatnonzero(index["cluster_count"]>=min_count)
+    if len(ks)==0:
+        return None
+    centers=index["cluster_center"][ks]
+    i=int(np.searchsorted(centers,price))
+    cand=[j for j in (i-1,i) if 0<=j<len(ks)]
+    best=min(cand,key=lambda j:abs(centers[j]-price))
+    out=confluence_cluster(index,ks[best])
+    out["distance"]=round(float(price-centers[best]),2)
+    out["inside"]=bool(index["cluster_lo"][ks[best]]-index["tolerance"]<=price<=index["cluster_hi"][ks[best]]+index["tolerance"])
+    return out
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # 8:30 VALIDATION
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -2123,7 +2519,7 @@ def validate_830_candle(candle,ceiling,floor):
 # ═══════════════════════════════════════════════════════════════════════════════
 # ENTRY CONFIRMATION - Complete Logic
 # ═══════════════════════════════════════════════════════════════════════════════
-def check_entry_confirmation(candle, entry_level, direction, break_threshold=6.0):
+def check_entry_confirmation(candle, entry_level, direction, break_threshold=6.0, touch_tolerance=2.0):
     """
     Check if a candle is a valid SETUP candle for entry.
     
@@ -2158,6 +2554,8 @@ def check_entry_confirmation(candle, entry_level, direction, break_threshold=6.0
     - Next candle will likely CONTINUE in the breakout direction
     - DO NOT fade this move!
     
+    touch_tolerance: how close (pts) the wick must come to count as a touch
+    
     Returns: dict with confirmed status, message, and details
     """
     if candle is None or entry_level is None:
@@ -2169,7 +2567,7 @@ def check_entry_confirmation(candle, entry_level, direction, break_threshold=6.0
     
     if direction == "PUTS":
         # PUTS setup: BULLISH candle touches entry and closes BELOW
-        touched_entry = h >= entry_level - 2  # Allow 2 pts tolerance
+        touched_entry = h >= entry_level - touch_tolerance  # Allow 2 pts tolerance by default
         closed_below = c < entry_level
         break_beyond = h - entry_level if h > entry_level else 0
         
@@ -2199,7 +2597,7 @@ def check_entry_confirmation(candle, entry_level, direction, break_threshold=6.0
     
     elif direction == "CALLS":
         # CALLS setup: BEARISH candle touches entry and closes ABOVE
-        touched_entry = l <= entry_level + 2  # Allow 2 pts tolerance
+        touched_entry = l <= entry_level + touch_tolerance  # Allow 2 pts tolerance by default
         closed_above = c > entry_level
         break_beyond = entry_level - l if l < entry_level else 0
         
@@ -2242,7 +2640,8 @@ def get_next_candle_time(current_time):
     return None
 
 
-def find_entry_confirmation(day_candles, entry_level, direction, offset, break_threshold=6.0, start_time="08:00", slope=0.48):
+def find_entry_confirmation(day_candles, entry_level, direction, offset, break_threshold=6.0, start_time="08:00", slope=0.48,
+                            touch_tolerance=2.0, setup_cutoff="10:30"):
     """
     Scan through candles to find the setup candle.
     
@@ -2266,6 +2665,8 @@ def find_entry_confirmation(day_candles, entry_level, direction, offset, break_t
     | 10:00 AM    | 10:30 AM   |
     | 10:30 AM    | 11:00 AM   | ← Latest possible entry
     
+    setup_cutoff moves the last setup candle (default 10:30).
+    
     Returns the confirmation details with setup_time and entry_time.
     """
     if day_candles is None or day_candles.empty:
@@ -2299,7 +2700,7 @@ def find_entry_confirmation(day_candles, entry_level, direction, offset, break_t
             continue
         
         # Stop checking after 10:30 AM (latest setup for 11:00 AM entry)
-        if candle_time > "10:30":
+        if candle_time > setup_cutoff:
             break
         
         candle = {
@@ -2313,7 +2714,7 @@ def find_entry_confirmation(day_candles, entry_level, direction, offset, break_t
         blocks_from_ref = time_to_blocks.get(candle_time, 0)
         entry_level_at_time = base_entry_level_spx + (blocks_from_ref * slope)
         
-        confirmation = check_entry_confirmation(candle, entry_level_at_time, direction, break_threshold)
+        confirmation = check_entry_confirmation(candle, entry_level_at_time, direction, break_threshold, touch_tolerance)
         
         # Store debug info
         debug_info.append({
@@ -2343,12 +2744,153 @@ def find_entry_confirmation(day_candles, entry_level, direction, offset, break_t
             confirmation["debug"] = debug_info
             return confirmation
     
-    return {"confirmed": False, "message": "No setup candle found by 10:30 AM", "reason": "NOT_FOUND", "debug": debug_info}
+    return {"confirmed": False, "message": f"No setup candle found by {setup_cutoff} AM", "reason": "NOT_FOUND", "debug": debug_info}
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# BATCH ENTRY SCANNER - find_entry_confirmation over many days with array ops
+# ═══════════════════════════════════════════════════════════════════════════════
+def stack_day_candles(day_candles_list):
+    """
+    Pack a list of per-day candle frames (e.g. hist_data["day_candles"]) into
+    NaN-padded (n_days, n_bars) OHLC arrays plus minute-of-day (-1 = padding).
+    """
+    n_days=len(day_candles_list)
+    n_bars=max([len(d) for d in day_candles_list if d is not None]+[1])
+    bars={k:np.full((n_days,n_bars),np.nan) for k in ["open","high","low","close"]}
+    bars["minute"]=np.full((n_days,n_bars),-1,dtype=np.int32)
+    bars["index"]=[]
+    for i,d in enumerate(day_candles_list):
+        if d is None or d.empty:
+            bars["index"].append(None)
+            continue
+        n=len(d)
+        bars["open"][i,:n]=d["Open"].to_numpy(dtype=float)
+        bars["high"][i,:n]=d["High"].to_numpy(dtype=float)
+        bars["low"][i,:n]=d["Low"].to_numpy(dtype=float)
+        bars["close"][i,:n]=d["Close"].to_numpy(dtype=float)
+        bars["minute"][i,:n]=d.index.hour*60+d.index.minute
+        bars["index"].append(d.index)
+    return bars
+
+def _hhmm_to_minute(s):
+    h,m=s.split(":")
+    return int(h)*60+int(m)
+
+def _minute_to_hhmm(m):
+    return f"{m//60:02d}:{m%60:02d}"
+
+def direction_sign(directions):
+    """CALLS → +1, PUTS → -1, anything else → 0 (vectorized)"""
+    d=np.asarray(directions)
+    if d.dtype.kind in "iuf":
+        return np.sign(d).astype(np.int8)
+    return np.where(d=="CALLS",1,np.where(d=="PUTS",-1,0)).astype(np.int8)
+
+def batch_find_entry_confirmation(bars, entry_levels, directions, offset, break_threshold=6.0, start_time="08:00", slope=0.48,
+                                  touch_tolerance=2.0, setup_cutoff="10:30"):
+    """
+    Vectorized find_entry_confirmation() for many days at once.
+
+    bars: dict from stack_day_candles() (ES prices)
+    entry_levels: (n_days,) 9:00 AM entry levels in ES
+    directions: (n_days,) "CALLS"/"PUTS" (or +1/-1)
+
+    Every predicate of check_entry_confirmation() - touch within touch_tolerance,
+    candle color, close through the level, momentum probe - is evaluated for
+    every bar of every day, and the first bar that confirms or probes ends the
+    scan, exactly like the scalar loop. Use entry_scan_result() to turn one
+    day back into the scalar result dict.
+    """
+    n_days=bars["high"].shape[0]
+    sign=direction_sign(directions)[:,None]
+    base=np.asarray(entry_levels,dtype=float)[:,None]-offset
+    minute=bars["minute"]
+
+    # Entry level at each candle's time - off-grid times fall back to 0 blocks like the dict lookup
+    on_grid=np.isin(minute,[480,510,540,570,600,630,660])
+    blocks=np.where(on_grid,(minute-540)//30,0)
+    level=base+blocks*slope
+
+    o=bars["open"]-offset
+    h=bars["high"]-offset
+    l=bars["low"]-offset
+    c=bars["close"]-offset
+
+    puts=sign==-1
+    calls=sign==1
+    touched=np.where(puts,h>=level-touch_tolerance,l<=level+touch_tolerance)
+    right_color=np.where(puts,c>o,c<o)
+    rejected=np.where(puts,c<level,c>level)
+    beyond=np.where(puts,np.where(h>level,h-level,0),np.where(l<level,level-l,0))
+    probe=beyond>break_threshold
+
+    in_window=(minute>=_hhmm_to_minute(start_time))&(minute<=_hhmm_to_minute(setup_cutoff))
+    stop=in_window&touched&right_color&rejected&(puts|calls)
+
+    found=stop.any(axis=1)
+    first=np.where(found,stop.argmax(axis=1),-1)
+    rows=np.arange(n_days)
+    at=np.where(found,first,0)
+    first_probe=found&probe[rows,at]
+
+    reason=np.where(~found,"NOT_FOUND",np.where(first_probe,"MOMENTUM_PROBE","CONFIRMED"))
+    setup_minute=np.where(found,minute[rows,at],-1)
+    return {
+        "confirmed":found&~first_probe,
+        "reason":reason,
+        "setup_idx":first,
+        "setup_minute":setup_minute,
+        "entry_minute":np.where(found&~first_probe,setup_minute+30,-1),
+        "entry_level_at_time":np.where(found,np.round(level[rows,at],2),np.nan),
+        "wick_beyond":np.where(found,np.round(beyond[rows,at],2),np.nan),
+        "direction":np.where(sign[:,0]==1,"CALLS",np.where(sign[:,0]==-1,"PUTS","")),
+        "level":level,
+        "offset":offset,
+        "break_threshold":break_threshold,
+        "touch_tolerance":touch_tolerance,
+        "setup_cutoff":setup_cutoff,
+    }
+
+def entry_scan_result(scan, bars, i):
+    """
+    Materialize day i of a batch scan as the dict find_entry_confirmation()
+    returns (without the per-candle "debug" list).
+    """
+    if bars["index"][i] is None:
+        return {"confirmed": False, "message": "No candle data available", "reason": "NO_DATA"}
+    if scan["reason"][i]=="NOT_FOUND":
+        return {"confirmed": False, "message": f"No setup candle found by {scan['setup_cutoff']} AM", "reason": "NOT_FOUND"}
+
+    k=scan["setup_idx"][i]
+    offset=scan["offset"]
+    candle={
+        "open": bars["open"][i,k] - offset,
+        "high": bars["high"][i,k] - offset,
+        "low": bars["low"][i,k] - offset,
+        "close": bars["close"][i,k] - offset
+    }
+    candle_time=_minute_to_hhmm(int(scan["setup_minute"][i]))
+    level=scan["level"][i,k]
+    confirmation=check_entry_confirmation(candle, level, scan["direction"][i], scan["break_threshold"], scan["touch_tolerance"])
+    if confirmation["confirmed"]:
+        entry_time=get_next_candle_time(candle_time)
+        confirmation["setup_time"]=candle_time
+        confirmation["entry_time"]=entry_time
+        confirmation["time"]=entry_time
+        confirmation["candle"]=candle
+        confirmation["entry_level_at_time"]=round(level, 2)
+        confirmation["message"]=f"✅ {candle_time} setup → Enter at {entry_time}"
+    else:
+        confirmation["setup_time"]=candle_time
+        confirmation["time"]=candle_time
+    return confirmation
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # HISTORICAL OUTCOME ANALYSIS
 # ═══════════════════════════════════════════════════════════════════════════════
-def analyze_historical_outcome(hist_data, validation, ceiling_es, floor_es, targets, direction, entry_level_es, offset):
+def analyze_historical_outcome(hist_data, validation, ceiling_es, floor_es, targets, direction, entry_level_es, offset,
+                               intrabar_loader=None, adverse_limit=None, slope=None, break_threshold=None, entry_conf=None,
+                               touch_tolerance=2.0, setup_cutoff="10:30", partial_threshold=10):
     """
     Analyze what actually happened on a historical date
     All prices displayed in SPX (converted from ES candles)
@@ -2357,7 +2899,20 @@ def analyze_historical_outcome(hist_data, validation, ceiling_es, floor_es, targ
     - PUTS: Bullish candle touches entry, closes BELOW, break <6pts
     - CALLS: Bearish candle touches entry, closes ABOVE, break <6pts
     - If break >6pts but closes inside = MOMENTUM PROBE, don't enter!
+    
+    Intrabar mode (intrabar_loader, see get_intrabar_loader()):
+    - Entry is at the entry candle's open, so that candle is tracked too
+    - Candles where a target AND a new adverse extreme happen together are
+      re-read from finer bars to order them; hits get exact times
+    - adverse_limit (SPX pts) stops the trade out; targets after it don't count
+    
+    slope/break_threshold default to SLOPE/BREAK_THRESHOLD. entry_conf takes a
+    precomputed find_entry_confirmation() result (backtest stage cache).
+    touch_tolerance/setup_cutoff go to find_entry_confirmation(); a move of more
+    than partial_threshold pts without a target is a PARTIAL.
     """
+    slope = SLOPE if slope is None else slope
+    break_threshold = BREAK_THRESHOLD if break_threshold is None else break_threshold
     if "day_candles" not in hist_data:
         return None
     
@@ -2387,9 +2942,11 @@ def analyze_historical_outcome(hist_data, validation, ceiling_es, floor_es, targ
     # Find setup candle - start from 8:00 AM (can set up for 8:30 entry)
     # Setup candle does rejection work → Enter at NEXT candle's open
     # IMPORTANT: Pass slope so entry level can be calculated at each candle's time
-    entry_conf = find_entry_confirmation(
-        day_candles, entry_level_es, direction, offset, BREAK_THRESHOLD, "08:00", SLOPE
-    )
+    if entry_conf is None:
+        entry_conf = find_entry_confirmation(
+            day_candles, entry_level_es, direction, offset, break_threshold, "08:00", slope,
+            touch_tolerance, setup_cutoff
+        )
     result["entry_confirmation"] = entry_conf
     
     if not entry_conf.get("confirmed"):
@@ -2413,7 +2970,7 @@ def analyze_historical_outcome(hist_data, validation, ceiling_es, floor_es, targ
         "10:00": 2, "10:30": 3, "11:00": 4
     }
     blocks_from_ref = time_to_blocks.get(entry_time, 0)
-    entry_price_spx = entry_level_spx + (blocks_from_ref * SLOPE)
+    entry_price_spx = entry_level_spx + (blocks_from_ref * slope)
     
     result["entry_level_at_time"] = round(entry_price_spx, 2)
     result["timeline"].append({
@@ -2422,58 +2979,526 @@ def analyze_historical_outcome(hist_data, validation, ceiling_es, floor_es, targ
         "price": round(entry_price_spx, 2)
     })
     
-    # Track price movement after entry
-    tracking_started=False
-    for idx,row in day_candles.iterrows():
-        candle_time=idx.strftime("%H:%M")
-        
-        # Start tracking after entry confirmation time
-        if candle_time<entry_time:
-            continue
-        if candle_time==entry_time:
-            tracking_started=True
-            continue
-        if not tracking_started:
-            continue
-        
-        # Convert ES candle to SPX
-        candle_high_spx=row['High']-offset
-        candle_low_spx=row['Low']-offset
-        
-        # Track movement (in SPX terms)
-        if direction=="PUTS":
-            favorable=entry_price_spx-candle_low_spx
-            adverse=candle_high_spx-entry_price_spx
-        else:
-            favorable=candle_high_spx-entry_price_spx
-            adverse=entry_price_spx-candle_low_spx
-        
-        result["max_favorable"]=max(result["max_favorable"],favorable)
-        result["max_adverse"]=max(result["max_adverse"],adverse)
-        
-        # Check targets (targets are already in SPX)
-        for tgt in targets:
-            if tgt["name"] not in [t["name"] for t in result["targets_hit"]]:
-                if direction=="PUTS" and candle_low_spx<=tgt["level"]:
-                    result["targets_hit"].append({"name":tgt["name"],"level":tgt["level"],"time":candle_time})
-                    result["timeline"].append({"time":candle_time,"event":f"TARGET: {tgt['name']}","price":tgt["level"]})
-                elif direction=="CALLS" and candle_high_spx>=tgt["level"]:
-                    result["targets_hit"].append({"name":tgt["name"],"level":tgt["level"],"time":candle_time})
-                    result["timeline"].append({"time":candle_time,"event":f"TARGET: {tgt['name']}","price":tgt["level"]})
+    # Track price movement after entry - starts on the candle AFTER the entry candle
+    times = [idx.strftime("%H:%M") for idx in day_candles.index]
+    entry_idx = times.index(entry_time) if entry_time in times else -1
+    tracked = track_outcome_arrays(
+        day_candles["High"].to_numpy(dtype=float)[None, :],
+        day_candles["Low"].to_numpy(dtype=float)[None, :],
+        [entry_idx], [entry_price_spx], [direction],
+        [[tgt["level"] for tgt in targets]], offset,
+        include_entry=intrabar_loader is not None
+    )
+    result["max_favorable"] = float(tracked["max_favorable"][0])
+    result["max_adverse"] = float(tracked["max_adverse"][0])
+    
+    if intrabar_loader is not None or adverse_limit is not None:
+        resolved = resolve_outcome_order(
+            day_candles.index, tracked, 0, entry_price_spx, direction, targets, offset,
+            intrabar_loader, adverse_limit
+        )
+        result["intrabar"] = resolved
+        result["targets_hit"] = resolved["targets_hit"]
+        for hit in resolved["targets_hit"]:
+            result["timeline"].append({"time": hit["time"], "event": f"TARGET: {hit['name']}", "price": hit["level"]})
+        if resolved["stop"]:
+            result["timeline"].append({"time": resolved["stop"]["time"], "event": f"STOP (-{adverse_limit:g})", "price": resolved["stop"]["price"]})
+            result["timeline"].sort(key=lambda e: e["time"])
+    else:
+        # Targets in hit order: by candle, then by target list order within a candle
+        first_hit = tracked["first_hit"][0]
+        hit = np.flatnonzero(first_hit >= 0)
+        for k in hit[np.argsort(first_hit[hit], kind="stable")]:
+            tgt = targets[k]
+            candle_time = times[first_hit[k]]
+            result["targets_hit"].append({"name": tgt["name"], "level": tgt["level"], "time": candle_time})
+            result["timeline"].append({"time": candle_time, "event": f"TARGET: {tgt['name']}", "price": tgt["level"]})
     
     # Determine outcome
-    if len(result["targets_hit"])>0:
-        result["outcome"]="WIN"
-        result["message"]=f"Hit {len(result['targets_hit'])} target(s): {', '.join([t['name'] for t in result['targets_hit']])}"
-    elif result["max_favorable"]>10:
-        result["outcome"]="PARTIAL"
-        result["message"]=f"Moved {result['max_favorable']:.0f} pts favorable but missed targets"
+    result["outcome"] = str(classify_outcomes(tracked["first_hit"], tracked["max_favorable"], partial_threshold)[0])
+    if result["targets_hit"]:
+        result["outcome"] = "WIN"
+        result["message"] = f"Hit {len(result['targets_hit'])} target(s): {', '.join([t['name'] for t in result['targets_hit']])}"
+    elif result.get("intrabar", {}).get("stop"):
+        result["outcome"] = "LOSS"
+        result["message"] = f"Stopped out at {result['intrabar']['stop']['time']}: -{adverse_limit:g} pts before any target"
+    elif result["outcome"] == "PARTIAL":
+        result["message"] = f"Moved {result['max_favorable']:.0f} pts favorable but missed targets"
     else:
-        result["outcome"]="LOSS"
-        result["message"]=f"Max adverse: {result['max_adverse']:.0f} pts"
+        result["message"] = f"Max adverse: {result['max_adverse']:.0f} pts"
     
     return result
 
+def track_outcome_arrays(highs, lows, entry_idx, entry_prices, directions, target_levels, offset, include_entry=False):
+    """
+    Array core of the post-entry tracking in analyze_historical_outcome()
+    
+    highs/lows: (n_days, n_bars) ES candles, NaN padded
+    entry_idx: (n_days,) index of the entry candle, -1 = never entered
+    entry_prices: (n_days,) SPX entry level at entry time
+    directions: "CALLS"/"PUTS" per day
+    target_levels: per-day lists of SPX target levels (ragged, NaN padded here)
+    
+    Tracking starts on the candle AFTER the entry candle (on the entry candle
+    itself with include_entry, i.e. entry at its open). Max favorable/adverse
+    are running maxima (floored at 0); each target's first-hit candle comes from
+    one broadcast comparison + argmax instead of a per-candle loop.
+    """
+    highs = np.asarray(highs, dtype=float)
+    lows = np.asarray(lows, dtype=float)
+    n_days, n_bars = highs.shape
+    entry_idx = np.asarray(entry_idx)[:, None]
+    entry = np.asarray(entry_prices, dtype=float)[:, None]
+    puts = (direction_sign(directions) == -1)[:, None]
+    
+    n_targets = max([len(t) for t in target_levels] + [0])
+    levels = np.full((n_days, n_targets), np.nan)
+    for i, t in enumerate(target_levels):
+        levels[i, :len(t)] = t
+    
+    # ES → SPX
+    h = highs - offset
+    l = lows - offset
+    start = entry_idx if include_entry else entry_idx + 1
+    tracking = (np.arange(n_bars)[None, :] >= start) & (entry_idx >= 0) & ~np.isnan(h)
+    
+    favorable = np.where(tracking, np.maximum(np.where(puts, entry - l, h - entry), 0), 0)
+    adverse = np.where(tracking, np.maximum(np.where(puts, h - entry, entry - l), 0), 0)
+    running_favorable = np.maximum.accumulate(favorable, axis=1) if n_bars else favorable
+    running_adverse = np.maximum.accumulate(adverse, axis=1) if n_bars else adverse
+    
+    hits = np.where(puts[:, :, None], l[:, None, :] <= levels[:, :, None], h[:, None, :] >= levels[:, :, None])
+    hits &= tracking[:, None, :]
+    first_hit = np.where(hits.any(axis=2), hits.argmax(axis=2), -1)
+    
+    return {
+        "running_favorable": running_favorable,
+        "running_adverse": running_adverse,
+        "max_favorable": running_favorable[:, -1] if n_bars else np.zeros(n_days),
+        "max_adverse": running_adverse[:, -1] if n_bars else np.zeros(n_days),
+        "first_hit": first_hit
+    }
+
+def classify_outcomes(first_hit, max_favorable, partial_threshold=10):
+    """WIN if any target was hit, PARTIAL if it moved > partial_threshold pts favorable, else LOSS"""
+    first_hit = np.asarray(first_hit)
+    max_favorable = np.asarray(max_favorable, dtype=float)
+    won = (first_hit >= 0).any(axis=1) if first_hit.size else np.zeros(len(max_favorable), dtype=bool)
+    return np.where(won, "WIN", np.where(max_favorable > partial_threshold, "PARTIAL", "LOSS"))
+
+def batch_analyze_outcomes(bars, scan, entry_levels, targets_list, offset, slope=None, partial_threshold=10,
+                           intrabar_loader=None, adverse_limit=None):
+    """
+    analyze_historical_outcome() for many days at once
+    
+    bars: dict from stack_day_candles() (ES prices)
+    scan: dict from batch_find_entry_confirmation() on the same bars
+    entry_levels: (n_days,) ES entry levels
+    targets_list: per-day target lists (SPX, dicts with "level")
+    
+    Returns arrays: outcome (WIN/PARTIAL/LOSS/NO_ENTRY/MOMENTUM_PROBE),
+    max_favorable, max_adverse, entry_idx, entry_price and first_hit
+    (n_days, n_targets) as candle indices into bars (-1 = not hit).
+    Days whose setup was not valid (NO_SETUP) are left for the caller to mask.
+    With intrabar_loader/adverse_limit, only days that have an ambiguous candle
+    or a stop go through resolve_outcome_order(); the rest stay vectorized.
+    """
+    slope = SLOPE if slope is None else slope
+    n_days, n_bars = bars["high"].shape
+    rows = np.arange(n_days)
+    confirmed = scan["confirmed"]
+    
+    # Entry candle = the candle stamped at the entry time (the one after the setup)
+    nxt = np.clip(scan["setup_idx"] + 1, 0, max(n_bars - 1, 0))
+    entry_idx = np.where(confirmed & (bars["minute"][rows, nxt] == scan["entry_minute"]), nxt, -1)
+    
+    # Entry level at the entry time (blocks from 9:00 AM, 8:00-11:00 only)
+    on_grid = np.isin(scan["entry_minute"], [480, 510, 540, 570, 600, 630, 660])
+    blocks = np.where(on_grid, (scan["entry_minute"] - 540) // 30, 0)
+    entry_price = np.round(np.asarray(entry_levels, dtype=float) - offset, 2) + blocks * slope
+    
+    tracked = track_outcome_arrays(
+        bars["high"], bars["low"], entry_idx, entry_price, scan["direction"],
+        [[tgt["level"] for tgt in targets] for targets in targets_list], offset,
+        include_entry=intrabar_loader is not None
+    )
+    first_hit = tracked["first_hit"].copy()
+    outcome = classify_outcomes(first_hit, tracked["max_favorable"], partial_threshold)
+    stops = stop_index(tracked, adverse_limit)
+    
+    if intrabar_loader is not None or adverse_limit is not None:
+        refine = confirmed & (intrabar_ambiguity(tracked, adverse_limit).any(axis=1) | (stops >= 0))
+        for i in np.flatnonzero(refine):
+            resolved = resolve_outcome_order(
+                bars["index"][i], tracked, i, entry_price[i], scan["direction"][i], targets_list[i], offset,
+                intrabar_loader, adverse_limit
+            )
+            kept = {hit["name"] for hit in resolved["targets_hit"]}
+            for t, tgt in enumerate(targets_list[i]):
+                if tgt["name"] not in kept:
+                    first_hit[i, t] = -1
+            if resolved["targets_hit"]:
+                outcome[i] = "WIN"
+            elif resolved["stop"]:
+                outcome[i] = "LOSS"
+    
+    outcome = np.where(confirmed, outcome, np.where(scan["reason"] == "MOMENTUM_PROBE", "MOMENTUM_PROBE", "NO_ENTRY"))
+    
+    return {
+        "outcome": outcome,
+        "max_favorable": np.where(confirmed, tracked["max_favorable"], 0.0),
+        "max_adverse": np.where(confirmed, tracked["max_adverse"], 0.0),
+        "entry_idx": entry_idx,
+        "entry_price": np.where(confirmed, np.round(entry_price, 2), np.nan),
+        "first_hit": first_hit,
+        "stop_idx": np.where(confirmed, stops, -1),
+        "running_favorable": tracked["running_favorable"],
+        "running_adverse": tracked["running_adverse"]
+    }
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# INTRABAR RESOLUTION - order target touches vs adverse moves inside a candle
+# ═══════════════════════════════════════════════════════════════════════════════
+def intrabar_ambiguity(tracked, adverse_limit=None):
+    """
+    (n_days, n_bars) mask of candles whose internal order is unknown and matters:
+    a target is first touched in the candle AND the candle also sets a new
+    adverse extreme (which includes reaching adverse_limit for the first time).
+    Everything else is already exact at candle resolution.
+    """
+    ra = tracked["running_adverse"]
+    first_hit = tracked["first_hit"]
+    n_days, n_bars = ra.shape
+    prev = np.concatenate([np.zeros((n_days, 1)), ra[:, :-1]], axis=1)
+    new_extreme = ra > prev
+    
+    target_bar = np.zeros((n_days, n_bars), dtype=bool)
+    rows, cols = np.nonzero(first_hit >= 0)
+    target_bar[rows, first_hit[rows, cols]] = True
+    return new_extreme & target_bar
+
+def stop_index(tracked, adverse_limit):
+    """(n_days,) first candle where adverse reaches adverse_limit, -1 = never"""
+    ra = tracked["running_adverse"]
+    if adverse_limit is None or ra.shape[1] == 0:
+        return np.full(ra.shape[0], -1)
+    stopped = ra >= adverse_limit
+    return np.where(stopped.any(axis=1), stopped.argmax(axis=1), -1)
+
+def resolve_intrabar_window(fine, entry_price, direction, levels, offset, prior_adverse, adverse_limit=None):
+    """
+    Order events inside one candle from its finer bars
+    Returns per-target fine index of first touch (-1 = none), the running adverse
+    at each touch, and the fine index of the stop (-1 = none). Touch and adverse
+    extreme inside the same fine bar are ordered pessimistically (adverse first).
+    """
+    tracked = track_outcome_arrays(
+        fine["High"].to_numpy(dtype=float)[None, :], fine["Low"].to_numpy(dtype=float)[None, :],
+        [0], [entry_price], [direction], [levels], offset, include_entry=True
+    )
+    running_adverse = np.maximum(tracked["running_adverse"][0], prior_adverse)
+    first_hit = tracked["first_hit"][0]
+    stop = -1
+    if adverse_limit is not None and (running_adverse >= adverse_limit).any():
+        stop = int((running_adverse >= adverse_limit).argmax())
+    return {
+        "first_hit": first_hit,
+        "adverse_at_hit": np.where(first_hit >= 0, running_adverse[np.maximum(first_hit, 0)], np.nan),
+        "stop": stop,
+        "times": fine.index,
+        "interval": fine.attrs.get("interval", "")
+    }
+
+def resolve_outcome_order(times, tracked, row, entry_price, direction, targets, offset, loader=None, adverse_limit=None):
+    """
+    Time-ordered target hits (and stop) for one day of track_outcome_arrays() output
+    
+    Only ambiguous candles (intrabar_ambiguity) are sent to the loader, once
+    each. Without a loader, or when no finer bars exist for a candle, ties in
+    that candle are ordered pessimistically (stop before targets).
+    Targets touched after the stop are dropped.
+    """
+    bar_minutes = 30
+    levels = [tgt["level"] for tgt in targets]
+    first_hit = tracked["first_hit"][row]
+    running_adverse = tracked["running_adverse"][row]
+    ambiguous = intrabar_ambiguity({k: tracked[k][row:row + 1] for k in ["running_adverse", "first_hit"]}, adverse_limit)[0]
+    stop_bar = int(stop_index({"running_adverse": running_adverse[None, :]}, adverse_limit)[0])
+    
+    windows = {}
+    def window(k):
+        # Memoized per candle; None when there are no finer bars
+        if k not in windows:
+            fine = None
+            if loader is not None and ambiguous[k]:
+                start = times[k]
+                fine = loader(start, start + timedelta(minutes=bar_minutes))
+            prior = running_adverse[k - 1] if k > 0 else 0.0
+            windows[k] = None if fine is None or fine.empty else resolve_intrabar_window(
+                fine, entry_price, direction, levels, offset, prior, adverse_limit
+            )
+        return windows[k]
+    
+    # Sort keys: (candle, fine bar, stop-before-target, target order)
+    # Coarse events sort after fine ones in the same candle
+    events = []
+    for t in np.flatnonzero(first_hit >= 0):
+        k = int(first_hit[t])
+        w = window(k)
+        if w is not None and w["first_hit"][t] >= 0:
+            j = int(w["first_hit"][t])
+            events.append(((k, j, 1, t), {
+                "name": targets[t]["name"], "level": targets[t]["level"], "time": w["times"][j].strftime("%H:%M"),
+                "adverse_before": round(float(w["adverse_at_hit"][t]), 2), "resolution": w["interval"]
+            }))
+        else:
+            events.append(((k, math.inf, 1, t), {
+                "name": targets[t]["name"], "level": targets[t]["level"], "time": times[k].strftime("%H:%M"),
+                "adverse_before": round(float(running_adverse[k]), 2), "resolution": f"{bar_minutes}m"
+            }))
+    
+    stop = None
+    stop_key = (math.inf,)
+    if stop_bar >= 0:
+        w = window(stop_bar)
+        sign = -1 if direction == "PUTS" else 1
+        stop = {"price": round(entry_price - sign * adverse_limit, 2), "resolution": f"{bar_minutes}m",
+                "time": times[stop_bar].strftime("%H:%M")}
+        stop_key = (stop_bar, math.inf, 0)
+        if w is not None and w["stop"] >= 0:
+            stop_key = (stop_bar, w["stop"], 0)
+            stop.update({"time": w["times"][w["stop"]].strftime("%H:%M"), "resolution": w["interval"]})
+    
+    events.sort(key=lambda e: e[0])
+    return {
+        "targets_hit": [hit for key, hit in events if key < stop_key],
+        "stop": stop,
+        "ambiguous_candles": [times[k].strftime("%H:%M") for k in np.flatnonzero(ambiguous)],
+        "resolved_candles": [times[k].strftime("%H:%M") for k, w in windows.items() if w is not None]
+    }
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# LIVE SETUP STATE MACHINE - advanced once per closed 30m bar
+# ═══════════════════════════════════════════════════════════════════════════════
+# AWAITING → VALIDATED / TREND_DAY / WAIT_9AM → SETUP_CONFIRMED → ENTERED → TARGET_HIT
+# Terminal without a trade: NO_SETUP, MOMENTUM_PROBE
+SETUP_STATES=["AWAITING","VALIDATED","TREND_DAY","WAIT_9AM","SETUP_CONFIRMED","ENTERED","TARGET_HIT","NO_SETUP","MOMENTUM_PROBE"]
+
+def new_setup_machine(trading_date, ceiling_es, floor_es, channel_type, cones_spx, offset, ref_time,
+                      slope=None, break_threshold=None):
+    """
+    Per-day setup state (plain dict, safe to keep in st.session_state)
+    
+    Same rules as the historical pipeline: 8:30 candle (8:00 + 8:30 bars) →
+    validate_830_candle(), setup candles from 8:00 to 10:30 →
+    check_entry_confirmation(), entry at the next bar, targets from find_targets().
+    WAIT_9AM is re-evaluated on the 9:00 candle against edges slid to 9:00.
+    Structure only - the EMA conflict filter in main() is not applied here.
+    """
+    return {
+        "date": trading_date,
+        "state": "AWAITING",
+        "ceiling": ceiling_es,
+        "floor": floor_es,
+        "rail": 1 if channel_type == "RISING" else -1,  # UNDETERMINED trades the falling channel
+        "cones": cones_spx,
+        "offset": offset,
+        "ref_time": ref_time,
+        "slope": SLOPE if slope is None else slope,
+        "break_threshold": BREAK_THRESHOLD if break_threshold is None else break_threshold,
+        "last_bar": None,
+        "pending": [],  # closed bars 8:00-10:30 before a direction is known
+        "validation": None,
+        "direction": None,
+        "entry_level_es": None,
+        "targets": [],
+        "setup": None,
+        "entry": None,
+        "targets_hit": [],
+        "max_favorable": 0.0,
+        "max_adverse": 0.0,
+        "events": [],
+        "subscribers": []
+    }
+
+def subscribe_setup_machine(machine, callback):
+    """callback(event) is called for every event the machine emits"""
+    machine["subscribers"].append(callback)
+
+def _emit(machine, events, event_type, bar_time, **fields):
+    event = {"type": event_type, "time": bar_time.strftime("%H:%M"), "state": machine["state"], **fields}
+    machine["events"].append(event)
+    events.append(event)
+    for callback in machine["subscribers"]:
+        callback(event)
+
+def _transition(machine, events, bar_time, state, message):
+    previous = machine["state"]
+    machine["state"] = state
+    _emit(machine, events, "STATE", bar_time, previous=previous, message=message)
+
+def _arm_direction(machine, events, bar_time, validation, since=None):
+    """
+    Validated: fix direction, entry edge and targets, then scan bars already closed
+    (only those from `since` on - a 9:00 re-evaluation must not enter off 8:00/8:30)
+    """
+    machine["validation"] = validation
+    machine["direction"] = validation["setup"]
+    machine["entry_level_es"] = validation["edge"]
+    edge_spx = round(validation["edge"] - machine["offset"], 2)
+    machine["targets"] = find_targets(edge_spx, machine["cones"], validation["setup"])
+    state = "TREND_DAY" if validation["status"] == "TREND_DAY" else "VALIDATED"
+    _transition(machine, events, bar_time, state, validation["message"])
+    pending, machine["pending"] = machine["pending"], []
+    for t, candle in pending:
+        if since is None or t >= since:
+            _advance_armed(machine, events, t, candle)
+
+def _validate(machine, events, bar_time, candle, shift=0.0, since=None):
+    validation = validate_830_candle(candle, machine["ceiling"] + shift, machine["floor"] + shift)
+    if "edge" in validation:
+        validation["edge"] = round(validation["edge"] - shift, 2)  # entry levels slide from the ref-time edge
+    _emit(machine, events, "VALIDATION", bar_time, status=validation["status"], message=validation["message"])
+    if validation["status"] in ("VALID", "TREND_DAY"):
+        _arm_direction(machine, events, bar_time, validation, since)
+    elif validation["status"] == "WAIT_9AM" and machine["state"] == "AWAITING":
+        machine["validation"] = validation
+        _transition(machine, events, bar_time, "WAIT_9AM", validation["message"])
+    else:
+        machine["validation"] = validation
+        _transition(machine, events, bar_time, "NO_SETUP", validation["message"])
+
+def _check_setup_bar(machine, events, bar_time, candle):
+    """One bar through check_entry_confirmation(), entry level slid to the bar's time"""
+    minute = bar_time.hour * 60 + bar_time.minute
+    if minute > 630:
+        _transition(machine, events, bar_time, "NO_SETUP", "No setup candle found by 10:30 AM")
+        return
+    off = machine["offset"]
+    spx = {k: candle[k] - off for k in ["open", "high", "low", "close"]}
+    blocks = (minute - 540) // 30 if minute in (480, 510, 540, 570, 600, 630) else 0
+    level = machine["entry_level_es"] - off + blocks * machine["slope"]
+    confirmation = check_entry_confirmation(spx, level, machine["direction"], machine["break_threshold"])
+    
+    if confirmation["confirmed"]:
+        entry_time = get_next_candle_time(bar_time.strftime("%H:%M"))
+        machine["setup"] = {**confirmation, "setup_time": bar_time.strftime("%H:%M"), "entry_time": entry_time,
+                            "entry_level_at_time": round(level, 2)}
+        _transition(machine, events, bar_time, "SETUP_CONFIRMED", f"✅ {bar_time.strftime('%H:%M')} setup → Enter at {entry_time}")
+        _emit(machine, events, "SETUP_CONFIRMED", bar_time, direction=machine["direction"], entry_time=entry_time,
+              level=round(level, 2), message=confirmation["message"])
+    elif confirmation.get("reason") == "MOMENTUM_PROBE":
+        _transition(machine, events, bar_time, "MOMENTUM_PROBE", confirmation["message"])
+
+def _track_bar(machine, events, bar_time, candle):
+    """Post-entry bar: running excursion and target touches (SPX)"""
+    entry = machine["entry"]["price"]
+    h = candle["high"] - machine["offset"]
+    l = candle["low"] - machine["offset"]
+    puts = machine["direction"] == "PUTS"
+    machine["max_favorable"] = max(machine["max_favorable"], entry - l if puts else h - entry)
+    machine["max_adverse"] = max(machine["max_adverse"], h - entry if puts else entry - l)
+    hit_names = {t["name"] for t in machine["targets_hit"]}
+    for tgt in machine["targets"]:
+        if tgt["name"] not in hit_names and (l <= tgt["level"] if puts else h >= tgt["level"]):
+            machine["targets_hit"].append({"name": tgt["name"], "level": tgt["level"], "time": bar_time.strftime("%H:%M")})
+            if machine["state"] != "TARGET_HIT":
+                _transition(machine, events, bar_time, "TARGET_HIT", f"🎯 {tgt['name']} hit")
+            _emit(machine, events, "TARGET_HIT", bar_time, name=tgt["name"], level=tgt["level"])
+
+def _advance_armed(machine, events, bar_time, candle):
+    """One bar once the direction is known (also replays bars closed before validation)"""
+    state = machine["state"]
+    if state in ("VALIDATED", "TREND_DAY"):
+        _check_setup_bar(machine, events, bar_time, candle)
+    elif state == "SETUP_CONFIRMED":
+        entry_time = machine["setup"]["entry_time"]
+        if bar_time.strftime("%H:%M") != entry_time:
+            _transition(machine, events, bar_time, "NO_SETUP", f"Entry candle {entry_time} missing")
+            return
+        blocks = {"08:00": -2, "08:30": -1, "09:00": 0, "09:30": 1, "10:00": 2, "10:30": 3, "11:00": 4}.get(entry_time, 0)
+        price = round(machine["entry_level_es"] - machine["offset"], 2) + blocks * machine["slope"]
+        machine["entry"] = {"time": entry_time, "price": round(price, 2)}
+        _transition(machine, events, bar_time, "ENTERED", f"Entered {machine['direction']} at {entry_time} @ {price:.2f}")
+        _emit(machine, events, "ENTERED", bar_time, direction=machine["direction"], price=round(price, 2))
+    elif state in ("ENTERED", "TARGET_HIT"):
+        _track_bar(machine, events, bar_time, candle)
+
+def on_bar_close(machine, bar_time, candle):
+    """
+    Advance the machine by one closed 30m ES bar (bar_time = bar start, CT;
+    candle = ES open/high/low/close). Bars already seen or from another day
+    are ignored, so feeding the same bar twice is harmless.
+    Returns the events emitted for this bar.
+    """
+    events = []
+    if bar_time.date() != machine["date"] or (machine["last_bar"] is not None and bar_time <= machine["last_bar"]):
+        return events
+    machine["last_bar"] = bar_time
+    minute = bar_time.hour * 60 + bar_time.minute
+    if minute < 480 or minute > 900:  # the day's candles run 8:00-15:00, as in extract_historical_data()
+        return events
+    state = machine["state"]
+    
+    if state in ("AWAITING", "WAIT_9AM") and minute <= 630:
+        machine["pending"].append((bar_time, candle))
+    
+    if state == "AWAITING":
+        if minute == 480:
+            machine["c830"] = dict(candle)  # first half of the 8:30 candle
+            return events
+        part = machine.pop("c830", None)
+        if minute == 510:
+            c830 = candle if part is None else {
+                "open": part["open"], "high": max(part["high"], candle["high"]),
+                "low": min(part["low"], candle["low"]), "close": candle["close"]
+            }
+        elif part is not None:
+            c830 = part  # 8:30 bar missing - validate what closed before 9:00
+        else:
+            _transition(machine, events, bar_time, "NO_SETUP", "No 8:30 candle")
+            return events
+        _validate(machine, events, bar_time, {k: round(v, 2) for k, v in c830.items()})
+        # A late first bar was already scanned from pending; only WAIT_9AM still needs it
+        if minute == 510 or machine["state"] != "WAIT_9AM":
+            return events
+        state = machine["state"]
+    
+    if state == "WAIT_9AM":
+        if minute == 540:
+            # Signed: a ref time after 9:00 slides the edges back
+            blocks = float(np.diff(block_clock([machine["ref_time"], bar_time]))[0])
+            shift = machine["rail"] * machine["slope"] * blocks
+            _validate(machine, events, bar_time, {k: round(v, 2) for k, v in candle.items()}, shift, since=bar_time)
+        else:
+            _transition(machine, events, bar_time, "NO_SETUP", "No 9:00 candle to re-evaluate")
+    else:
+        _advance_armed(machine, events, bar_time, candle)
+    return events
+
+def notify_setup_event(event):
+    """Default subscriber: toast every non-STATE event in the app"""
+    if event["type"] != "STATE":
+        st.toast(f"{event['time']} · {event['type'].replace('_', ' ')}: {event.get('message', event.get('name', ''))}")
+
+def feed_closed_bars(machine, es_candles, now=None):
+    """
+    Push every newly closed bar of the machine's day into on_bar_close()
+    Bars up to machine["last_bar"] are skipped with a searchsorted, so each
+    refresh only pays for the bars that closed since the previous one.
+    """
+    if es_candles is None or es_candles.empty:
+        return []
+    df = candles_to_ct(es_candles)
+    start = 0 if machine["last_bar"] is None else df.index.searchsorted(machine["last_bar"], side="right")
+    now = now or now_ct()
+    events = []
+    for bar_time, row in zip(df.index[start:], df.iloc[start:].itertuples()):
+        if bar_time + timedelta(minutes=30) > now:
+            break
+        events += on_bar_close(machine, bar_time, {"open": row.Open, "high": row.High, "low": row.Low, "close": row.Close})
+    return events
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # ENHANCED FLOW BIAS - Real Market Data Integration
 # Uses: VVIX, VIX Term Structure, Put/Call Ratio, Breadth, Risk On/Off
@@ -2584,8 +3609,228 @@ def fetch_market_flow_data():
     
     return flow_data
 
+# ─────────────────────────────────────────────────────────────────────────────
+# Flow history - the same features per date, built once from daily closes
+# ─────────────────────────────────────────────────────────────────────────────
+def flow_features_from_closes(closes):
+    """
+    fetch_market_flow_data() features for every row of a daily close table
+    (columns = FLOW_TICKERS). Put/call has no free daily history and stays empty.
+    """
+    c=closes.sort_index()
+    rsp_spy=c["RSP"]/c["SPY"]
+    features=pd.DataFrame({
+        "vvix":c["^VVIX"].round(2),
+        "vvix_change":c["^VVIX"].diff().round(2),
+        "vix_term_structure":(c["^VIX3M"]-c["^VIX"]).round(2),
+        "put_call_ratio":np.nan,
+        "breadth_ratio":((rsp_spy/rsp_spy.shift(1)-1)*100).round(3),
+        "risk_on_off":((c["XLK"].pct_change()-c["XLU"].pct_change())*100).round(2)
+    },index=c.index)
+    features.index.name="date"
+    return features
+
+def build_flow_features(start, end=None, path=FLOW_FEATURES_FILE):
+    """
+    Download daily closes for FLOW_TICKERS and write the per-date flow table
+    An existing table is extended from its last date (a week of overlap for
+    the day-over-day changes), so reruns only fetch what is new.
+    Returns the full table.
+    """
+    end=end or date.today()
+    existing=load_flow_features_table(path)
+    if existing is not None and len(existing):
+        start=max(start,existing.index[-1].date()-timedelta(days=7))
+    closes={}
+    for ticker in FLOW_TICKERS:
+        try:
+            hist=yf.Ticker(ticker).history(start=start-timedelta(days=7),end=end+timedelta(days=1),interval="1d")
+            if hist is not None and not hist.empty:
+                closes[ticker]=pd.Series(hist["Close"].to_numpy(),index=pd.DatetimeIndex(hist.index.date))
+        except Exception:
+            pass
+    if not closes:
+        return existing
+    features=flow_features_from_closes(pd.DataFrame(closes).reindex(columns=FLOW_TICKERS))
+    features=features[features.index>=pd.Timestamp(start)]
+    if existing is not None and len(existing):
+        features=pd.concat([existing[existing.index<features.index[0]],features]) if len(features) else existing
+    features.to_csv(path)
+    return features
+
+def load_flow_features_table(path=FLOW_FEATURES_FILE):
+    """The stored flow table (DatetimeIndex, sorted) or None"""
+    if not os.path.exists(path):
+        return None
+    try:
+        df=pd.read_csv(path,index_col=0,parse_dates=True)
+        return df[~df.index.duplicated(keep="last")].sort_index()
+    except Exception:
+        return None
+
+@st.cache_data(ttl=3600,show_spinner=False)
+def load_flow_features(path=FLOW_FEATURES_FILE):
+    return load_flow_features_table(path)
+
+def flow_features_asof(features, as_of, max_age_days=5):
+    """
+    Flow features known before the open of `as_of`: the last stored session
+    strictly before it (searchsorted on the date index). None when the table
+    has no session within max_age_days.
+    """
+    if features is None or features.empty:
+        return None
+    i=features.index.searchsorted(pd.Timestamp(as_of),side="left")-1
+    if i<0 or (pd.Timestamp(as_of)-features.index[i]).days>max_age_days:
+        return None
+    row=features.iloc[i]
+    flow_data={k:(None if pd.isna(row.get(k)) else float(row[k]))
+               for k in ["vvix","vvix_change","vix_term_structure","put_call_ratio","breadth_ratio","risk_on_off"]}
+    flow_data["data_fresh"]=sum(1 for k in ["vvix","vix_term_structure","breadth_ratio","risk_on_off"] if flow_data[k] is not None)>=2
+    flow_data["as_of"]=features.index[i].date()
+    return flow_data
+
 
-def calculate_flow_bias(price, on_high, on_low, vix, vix_high, vix_low, prior_close, es_candles=None):
+# ─────────────────────────────────────────────────────────────────────────────
+# Flow scoring tables - one entry per pillar, rules tried top to bottom
+# Each rule: (conditions ANDed as (feature, op, threshold), points, label)
+# Points > 0 → CALLS, < 0 → PUTS; no rule → NEUTRAL with the default label.
+# A pillar only scores where its "requires" feature is present (not NaN);
+# "detail" is (details key, feature, format) for the card's detail line.
+# ─────────────────────────────────────────────────────────────────────────────
+FLOW_PILLARS=[
+    {"name":"O/N Position","requires":"price_pos","detail":("price_pos","price_pos","{:.0f}%"),"rules":[
+        ([("on_above",">",0)],20,"Above High (+{on_above:.0f})"),
+        ([("on_below","<",0)],-20,"Below Low ({on_below:.0f})"),
+        ([("price_pos",">",75)],12,"Upper 25% ({price_pos:.0f}%)"),
+        ([("price_pos","<",25)],-12,"Lower 25% ({price_pos:.0f}%)"),
+    ],"default":"Mid-Range ({price_pos:.0f}%)"},
+    {"name":"VIX Level","requires":"vix_pos","detail":("vix_pos","vix_pos","{:.0f}%"),"rules":[
+        ([("vix_above",">",0)],-15,"Elevated ({vix:.1f})"),
+        ([("vix_below","<",0)],15,"Compressed ({vix:.1f})"),
+        ([("vix_pos",">",70)],-8,"High ({vix:.1f})"),
+        ([("vix_pos","<",30)],8,"Low ({vix:.1f})"),
+    ],"default":"Normal ({vix:.1f})"},
+    {"name":"Gap","requires":None,"detail":("gap","gap","{:+.1f}"),"rules":[
+        ([("gap",">",20)],15,"Large Gap Up (+{gap:.0f})"),
+        ([("gap",">",10)],10,"Gap Up (+{gap:.0f})"),
+        ([("gap",">",5)],5,"Small Gap Up (+{gap:.0f})"),
+        ([("gap","<",-20)],-15,"Large Gap Down ({gap:.0f})"),
+        ([("gap","<",-10)],-10,"Gap Down ({gap:.0f})"),
+        ([("gap","<",-5)],-5,"Small Gap Down ({gap:.0f})"),
+    ],"default":"Flat ({gap:+.0f})"},
+    {"name":"VVIX","requires":"vvix","detail":("vvix","vvix","{:.1f}"),"rules":[
+        ([("vvix",">",110),("vvix_change",">",3)],-10,"Spiking ({vvix:.0f}, +{vvix_change:.1f})"),
+        ([("vvix",">",100)],-5,"Elevated ({vvix:.0f})"),
+        ([("vvix","<",85),("vvix_change","<",-2)],8,"Calm ({vvix:.0f}, {vvix_change:.1f})"),
+        ([("vvix","<",90)],5,"Low ({vvix:.0f})"),
+    ],"default":"Normal ({vvix:.0f})"},
+    {"name":"Term Structure","requires":"term","detail":("term_structure","term","{:+.2f}"),"rules":[
+        ([("term",">",3)],15,"Steep Contango (+{term:.1f})"),
+        ([("term",">",0)],8,"Contango (+{term:.1f})"),
+        ([("term","<",-2)],-15,"Backwardation ({term:.1f})"),
+        ([("term","<",0)],-8,"Slight Inversion ({term:.1f})"),
+    ],"default":"Flat ({term:.1f})"},
+    {"name":"Breadth","requires":"breadth","detail":("breadth","breadth","{:+.2f}%"),"rules":[
+        ([("breadth",">",0.3)],10,"Improving (+{breadth:.2f}%)"),
+        ([("breadth",">",0.1)],5,"Positive (+{breadth:.2f}%)"),
+        ([("breadth","<",-0.3)],-10,"Deteriorating ({breadth:.2f}%)"),
+        ([("breadth","<",-0.1)],-5,"Negative ({breadth:.2f}%)"),
+    ],"default":"Flat ({breadth:+.2f}%)"},
+    {"name":"Risk Rotation","requires":"risk","detail":("risk_rotation","risk","{:+.2f}%"),"rules":[
+        ([("risk",">",1.0)],10,"Risk ON (+{risk:.1f}%)"),
+        ([("risk",">",0.3)],5,"Slight Risk ON (+{risk:.1f}%)"),
+        ([("risk","<",-1.0)],-10,"Risk OFF ({risk:.1f}%)"),
+        ([("risk","<",-0.3)],-5,"Slight Risk OFF ({risk:.1f}%)"),
+    ],"default":"Balanced ({risk:+.1f}%)"},
+    {"name":"Put/Call","requires":"pc","detail":("put_call","pc","{:.2f}"),"rules":[
+        ([("pc",">",1.2)],10,"High Fear ({pc:.2f}) - Contrarian Bull"),  # contrarian
+        ([("pc",">",1.0)],5,"Elevated ({pc:.2f})"),
+        ([("pc","<",0.6)],-10,"Complacency ({pc:.2f}) - Contrarian Bear"),
+        ([("pc","<",0.75)],-5,"Low ({pc:.2f})"),
+    ],"default":"Normal ({pc:.2f})"},
+]
+FLOW_BIAS_LEVELS=[(40,"STRONG_CALLS"),(20,"CALLS"),(-40,"STRONG_PUTS"),(-20,"PUTS")]  # score >= / <= level, in order
+
+def flow_feature_arrays(price, on_high, on_low, vix, vix_high, vix_low, prior_close, flow_data=None):
+    """
+    The features FLOW_PILLARS reads, as float arrays (scalars → length 1).
+    flow_data is a fetch_market_flow_data() dict or a frame/dict of arrays with
+    the same keys; None/NaN marks a pillar as unavailable.
+    """
+    def arr(x):
+        return np.atleast_1d(np.asarray(np.nan if x is None else x,dtype=float))
+    price,on_high,on_low,vix,vix_high,vix_low,prior_close=[arr(x) for x in (price,on_high,on_low,vix,vix_high,vix_low,prior_close)]
+    flow_data=flow_data if flow_data is not None else {}
+    flow=lambda k: arr(flow_data.get(k)) if hasattr(flow_data,"get") else arr(None)
+    on_range=on_high-on_low
+    has_vix_range=(np.nan_to_num(vix_high)!=0)&(np.nan_to_num(vix_low)!=0)
+    vix_range=np.where(has_vix_range,vix_high-vix_low,0.0)
+    with np.errstate(invalid="ignore",divide="ignore"):
+        feats={
+            "on_above":price-on_high,
+            "on_below":price-on_low,
+            "price_pos":np.where(on_range>0,(price-on_low)/np.where(on_range>0,on_range,1.0)*100,np.nan),
+            "vix":vix,
+            "vix_above":vix-vix_high,
+            "vix_below":vix-vix_low,
+            "vix_pos":np.where(vix_range>0,(vix-vix_low)/np.where(vix_range>0,vix_range,1.0)*100,np.nan),
+            "gap":np.where(np.nan_to_num(prior_close)!=0,price-prior_close,0.0),
+            "vvix":flow("vvix"),
+            "vvix_change":np.nan_to_num(flow("vvix_change")),
+            "term":flow("vix_term_structure"),
+            "breadth":flow("breadth_ratio"),
+            "risk":flow("risk_on_off"),
+            "pc":flow("put_call_ratio"),
+        }
+    n=max(len(v) for v in feats.values())
+    return {k:np.broadcast_to(v,(n,)) for k,v in feats.items()}
+
+def score_flow_bias(feats):
+    """
+    Every FLOW_PILLARS pillar over all rows at once with np.select
+    Returns {"<pillar>": points array, "<pillar>_rule": matched rule index
+    (-1 = default, -2 = pillar unavailable), "score", "bias"}.
+    """
+    ops={">":np.greater,"<":np.less}
+    out={}
+    total=0
+    for pillar in FLOW_PILLARS:
+        conds=[np.logical_and.reduce([ops[op](feats[f],th) for f,op,th in rule[0]]) for rule in pillar["rules"]]
+        rule=np.select(conds,np.arange(len(conds)),-1)
+        pts=np.select(conds,[r[1] for r in pillar["rules"]],0)
+        if pillar["requires"]:
+            present=~np.isnan(feats[pillar["requires"]])
+            rule=np.where(present,rule,-2)
+            pts=np.where(present,pts,0)
+        out[pillar["name"]]=pts
+        out[pillar["name"]+"_rule"]=rule
+        total=total+pts
+    score=np.clip(total,-100,100).astype(int)
+    out["score"]=score
+    out["bias"]=np.select([score>=lvl if lvl>0 else score<=lvl for lvl,_ in FLOW_BIAS_LEVELS],
+                          [b for _,b in FLOW_BIAS_LEVELS],"NEUTRAL")
+    return out
+
+def flow_signal_breakdown(feats, scored, i=0):
+    """(signals, details) for row i, in the format the Flow Bias card shows"""
+    values={k:v[i] for k,v in feats.items()}
+    signals,details=[],{}
+    for pillar in FLOW_PILLARS:
+        rule=int(scored[pillar["name"]+"_rule"][i])
+        if rule==-2:
+            continue
+        key,feature,fmt=pillar["detail"]
+        details[key]=fmt.format(values[feature])
+        if rule==-1:
+            signals.append((pillar["name"],"NEUTRAL",pillar["default"].format(**values),0))
+        else:
+            pts=pillar["rules"][rule][1]
+            signals.append((pillar["name"],"CALLS" if pts>0 else "PUTS",pillar["rules"][rule][2].format(**values),pts))
+    return signals,details
+
+
+def calculate_flow_bias(price, on_high, on_low, vix, vix_high, vix_low, prior_close, es_candles=None, as_of=None):
     """
     Enhanced Flow Bias calculation using multiple data sources.
     
@@ -2602,275 +3847,44 @@ def calculate_flow_bias(price, on_high, on_low, vix, vix_high, vix_low, prior_cl
     6. Market Breadth (±10 pts)
     7. Risk On/Off Rotation (±10 pts)
     8. Put/Call Ratio (±10 pts) - contrarian
-    """
-    signals = []
-    score = 0
-    details = {}
-    
-    # Fetch real market flow data
-    flow_data = fetch_market_flow_data()
-    
-    # ═══════════════════════════════════════════════════════════════════════════
-    # PILLAR 1: Price Position in Overnight Range (±20 pts)
-    # ═══════════════════════════════════════════════════════════════════════════
-    on_range = on_high - on_low
-    if on_range > 0:
-        price_pos = (price - on_low) / on_range * 100
-        details["price_pos"] = f"{price_pos:.0f}%"
-        
-        if price > on_high:
-            pts = 20
-            score += pts
-            signals.append(("O/N Position", "CALLS", f"Above High (+{price-on_high:.0f})", pts))
-        elif price < on_low:
-            pts = -20
-            score += pts
-            signals.append(("O/N Position", "PUTS", f"Below Low ({price-on_low:.0f})", pts))
-        elif price_pos > 75:
-            pts = 12
-            score += pts
-            signals.append(("O/N Position", "CALLS", f"Upper 25% ({price_pos:.0f}%)", pts))
-        elif price_pos < 25:
-            pts = -12
-            score += pts
-            signals.append(("O/N Position", "PUTS", f"Lower 25% ({price_pos:.0f}%)", pts))
-        else:
-            signals.append(("O/N Position", "NEUTRAL", f"Mid-Range ({price_pos:.0f}%)", 0))
-    
-    # ═══════════════════════════════════════════════════════════════════════════
-    # PILLAR 2: VIX Level (±15 pts)
-    # ═══════════════════════════════════════════════════════════════════════════
-    vix_range = vix_high - vix_low if vix_high and vix_low else 0
-    if vix_range > 0:
-        vix_pos = (vix - vix_low) / vix_range * 100
-        details["vix_pos"] = f"{vix_pos:.0f}%"
-        
-        if vix > vix_high:
-            pts = -15
-            score += pts
-            signals.append(("VIX Level", "PUTS", f"Elevated ({vix:.1f})", pts))
-        elif vix < vix_low:
-            pts = 15
-            score += pts
-            signals.append(("VIX Level", "CALLS", f"Compressed ({vix:.1f})", pts))
-        elif vix_pos > 70:
-            pts = -8
-            score += pts
-            signals.append(("VIX Level", "PUTS", f"High ({vix:.1f})", pts))
-        elif vix_pos < 30:
-            pts = 8
-            score += pts
-            signals.append(("VIX Level", "CALLS", f"Low ({vix:.1f})", pts))
-        else:
-            signals.append(("VIX Level", "NEUTRAL", f"Normal ({vix:.1f})", 0))
     
-    # ═══════════════════════════════════════════════════════════════════════════
-    # PILLAR 3: Gap from Prior Close (±15 pts)
-    # Gap = Current Price - Prior RTH Close
-    # This is the classic "gap up" or "gap down" measure
-    # ═══════════════════════════════════════════════════════════════════════════
+    as_of (a trading date) scores pillars 4-8 from the stored flow history
+    (prior session, see flow_features_asof()) instead of today's market.
+    Past dates never hit the network; today/future dates fall back to a live
+    fetch when the table doesn't cover them yet.
     
-    gap = price - prior_close if prior_close else 0
-    details["gap"] = f"{gap:+.1f}"
-    
-    if gap > 20:
-        pts = 15
-        score += pts
-        signals.append(("Gap", "CALLS", f"Large Gap Up (+{gap:.0f})", pts))
-    elif gap > 10:
-        pts = 10
-        score += pts
-        signals.append(("Gap", "CALLS", f"Gap Up (+{gap:.0f})", pts))
-    elif gap > 5:
-        pts = 5
-        score += pts
-        signals.append(("Gap", "CALLS", f"Small Gap Up (+{gap:.0f})", pts))
-    elif gap < -20:
-        pts = -15
-        score += pts
-        signals.append(("Gap", "PUTS", f"Large Gap Down ({gap:.0f})", pts))
-    elif gap < -10:
-        pts = -10
-        score += pts
-        signals.append(("Gap", "PUTS", f"Gap Down ({gap:.0f})", pts))
-    elif gap < -5:
-        pts = -5
-        score += pts
-        signals.append(("Gap", "PUTS", f"Small Gap Down ({gap:.0f})", pts))
+    Pillar thresholds and points live in FLOW_PILLARS (score_flow_bias()
+    scores whole arrays of days/snapshots the same way).
+    """
+    # Fetch real market flow data - or the stored history for a given date
+    flow_data, source = None, "live"
+    if as_of is not None:
+        flow_data, source = flow_features_asof(load_flow_features(), as_of), "history"
+        if flow_data is None:
+            flow_data = fetch_market_flow_data() if as_of >= date.today() else {
+                "vvix": None, "vvix_change": None, "vix_term_structure": None, "put_call_ratio": None,
+                "breadth_ratio": None, "risk_on_off": None, "data_fresh": False}
+            source = "live" if as_of >= date.today() else "none"
     else:
-        signals.append(("Gap", "NEUTRAL", f"Flat ({gap:+.0f})", 0))
+        flow_data = fetch_market_flow_data()
     
-    # ═══════════════════════════════════════════════════════════════════════════
-    # PILLAR 4: VVIX - Volatility of Volatility (±10 pts)
-    # High VVIX (>100) = uncertainty, usually precedes moves
-    # Low VVIX (<85) = complacency
-    # ═══════════════════════════════════════════════════════════════════════════
-    if flow_data["vvix"] is not None:
-        vvix = flow_data["vvix"]
-        vvix_chg = flow_data["vvix_change"] or 0
-        details["vvix"] = f"{vvix:.1f}"
-        
-        # VVIX rising sharply = fear increasing = bearish
-        # VVIX falling = fear decreasing = bullish
-        if vvix > 110 and vvix_chg > 3:
-            pts = -10
-            score += pts
-            signals.append(("VVIX", "PUTS", f"Spiking ({vvix:.0f}, +{vvix_chg:.1f})", pts))
-        elif vvix > 100:
-            pts = -5
-            score += pts
-            signals.append(("VVIX", "PUTS", f"Elevated ({vvix:.0f})", pts))
-        elif vvix < 85 and vvix_chg < -2:
-            pts = 8
-            score += pts
-            signals.append(("VVIX", "CALLS", f"Calm ({vvix:.0f}, {vvix_chg:.1f})", pts))
-        elif vvix < 90:
-            pts = 5
-            score += pts
-            signals.append(("VVIX", "CALLS", f"Low ({vvix:.0f})", pts))
-        else:
-            signals.append(("VVIX", "NEUTRAL", f"Normal ({vvix:.0f})", 0))
-    
-    # ═══════════════════════════════════════════════════════════════════════════
-    # PILLAR 5: VIX Term Structure (±15 pts)
-    # Contango (VIX3M > VIX) = normal, bullish
-    # Backwardation (VIX > VIX3M) = fear, bearish
-    # ═══════════════════════════════════════════════════════════════════════════
-    if flow_data["vix_term_structure"] is not None:
-        term = flow_data["vix_term_structure"]
-        details["term_structure"] = f"{term:+.2f}"
-        
-        if term > 3:
-            pts = 15
-            score += pts
-            signals.append(("Term Structure", "CALLS", f"Steep Contango (+{term:.1f})", pts))
-        elif term > 0:
-            pts = 8
-            score += pts
-            signals.append(("Term Structure", "CALLS", f"Contango (+{term:.1f})", pts))
-        elif term < -2:
-            pts = -15
-            score += pts
-            signals.append(("Term Structure", "PUTS", f"Backwardation ({term:.1f})", pts))
-        elif term < 0:
-            pts = -8
-            score += pts
-            signals.append(("Term Structure", "PUTS", f"Slight Inversion ({term:.1f})", pts))
-        else:
-            signals.append(("Term Structure", "NEUTRAL", f"Flat ({term:.1f})", 0))
-    
-    # ═══════════════════════════════════════════════════════════════════════════
-    # PILLAR 6: Market Breadth - RSP/SPY Change (±10 pts)
-    # Improving breadth = healthy = bullish
-    # Deteriorating breadth = narrow = bearish
-    # ═══════════════════════════════════════════════════════════════════════════
-    if flow_data["breadth_ratio"] is not None:
-        breadth = flow_data["breadth_ratio"]
-        details["breadth"] = f"{breadth:+.2f}%"
-        
-        if breadth > 0.3:
-            pts = 10
-            score += pts
-            signals.append(("Breadth", "CALLS", f"Improving (+{breadth:.2f}%)", pts))
-        elif breadth > 0.1:
-            pts = 5
-            score += pts
-            signals.append(("Breadth", "CALLS", f"Positive (+{breadth:.2f}%)", pts))
-        elif breadth < -0.3:
-            pts = -10
-            score += pts
-            signals.append(("Breadth", "PUTS", f"Deteriorating ({breadth:.2f}%)", pts))
-        elif breadth < -0.1:
-            pts = -5
-            score += pts
-            signals.append(("Breadth", "PUTS", f"Negative ({breadth:.2f}%)", pts))
-        else:
-            signals.append(("Breadth", "NEUTRAL", f"Flat ({breadth:+.2f}%)", 0))
-    
-    # ═══════════════════════════════════════════════════════════════════════════
-    # PILLAR 7: Risk On/Off Rotation (±10 pts)
-    # Tech > Utilities = Risk On = Bullish
-    # Utilities > Tech = Risk Off = Bearish
-    # ═══════════════════════════════════════════════════════════════════════════
-    if flow_data["risk_on_off"] is not None:
-        risk = flow_data["risk_on_off"]
-        details["risk_rotation"] = f"{risk:+.2f}%"
-        
-        if risk > 1.0:
-            pts = 10
-            score += pts
-            signals.append(("Risk Rotation", "CALLS", f"Risk ON (+{risk:.1f}%)", pts))
-        elif risk > 0.3:
-            pts = 5
-            score += pts
-            signals.append(("Risk Rotation", "CALLS", f"Slight Risk ON (+{risk:.1f}%)", pts))
-        elif risk < -1.0:
-            pts = -10
-            score += pts
-            signals.append(("Risk Rotation", "PUTS", f"Risk OFF ({risk:.1f}%)", pts))
-        elif risk < -0.3:
-            pts = -5
-            score += pts
-            signals.append(("Risk Rotation", "PUTS", f"Slight Risk OFF ({risk:.1f}%)", pts))
-        else:
-            signals.append(("Risk Rotation", "NEUTRAL", f"Balanced ({risk:+.1f}%)", 0))
-    
-    # ═══════════════════════════════════════════════════════════════════════════
-    # PILLAR 8: Put/Call Ratio - CONTRARIAN (±10 pts)
-    # High P/C (>1.0) = bearish sentiment = contrarian BULLISH
-    # Low P/C (<0.7) = bullish sentiment = contrarian BEARISH
-    # ═══════════════════════════════════════════════════════════════════════════
-    if flow_data["put_call_ratio"] is not None:
-        pc = flow_data["put_call_ratio"]
-        details["put_call"] = f"{pc:.2f}"
-        
-        if pc > 1.2:
-            pts = 10  # Contrarian bullish
-            score += pts
-            signals.append(("Put/Call", "CALLS", f"High Fear ({pc:.2f}) - Contrarian Bull", pts))
-        elif pc > 1.0:
-            pts = 5
-            score += pts
-            signals.append(("Put/Call", "CALLS", f"Elevated ({pc:.2f})", pts))
-        elif pc < 0.6:
-            pts = -10  # Contrarian bearish
-            score += pts
-            signals.append(("Put/Call", "PUTS", f"Complacency ({pc:.2f}) - Contrarian Bear", pts))
-        elif pc < 0.75:
-            pts = -5
-            score += pts
-            signals.append(("Put/Call", "PUTS", f"Low ({pc:.2f})", pts))
-        else:
-            signals.append(("Put/Call", "NEUTRAL", f"Normal ({pc:.2f})", 0))
-    
-    # ═══════════════════════════════════════════════════════════════════════════
-    # FINAL BIAS DETERMINATION
-    # ═══════════════════════════════════════════════════════════════════════════
-    # Clamp score to -100 to +100
-    score = max(-100, min(100, score))
-    
-    if score >= 40:
-        bias = "STRONG_CALLS"
-    elif score >= 20:
-        bias = "CALLS"
-    elif score <= -40:
-        bias = "STRONG_PUTS"
-    elif score <= -20:
-        bias = "PUTS"
-    else:
-        bias = "NEUTRAL"
+    feats = flow_feature_arrays(price, on_high, on_low, vix, vix_high, vix_low, prior_close, flow_data)
+    scored = score_flow_bias(feats)
+    signals, details = flow_signal_breakdown(feats, scored, 0)
     
     # Count how many real data sources we used
     real_sources = sum(1 for k in ["vvix", "vix_term_structure", "breadth_ratio", "risk_on_off", "put_call_ratio"] 
                        if flow_data.get(k) is not None)
     
     return {
-        "bias": bias,
-        "score": score,
+        "bias": str(scored["bias"][0]),
+        "score": int(scored["score"][0]),
         "signals": signals,
         "details": details,
         "real_data_sources": real_sources,
-        "data_fresh": flow_data["data_fresh"]
+        "data_fresh": flow_data["data_fresh"],
+        "source": source,
+        "as_of": flow_data.get("as_of")
     }
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -2900,6 +3914,20 @@ def calculate_ema_signals(es_candles,current_price):
     - 8/21 cross: Fast momentum signal for 0DTE entries
     - 200 EMA: Directional filter (above = favor longs, below = favor shorts)
     """
+    if es_candles is None or len(es_candles)<21:
+        return ema_signals_from_values(None,None,None,current_price)
+    
+    close=es_candles['Close']
+    
+    # Calculate EMAs
+    ema8=close.ewm(span=8).mean()
+    ema21=close.ewm(span=21).mean()
+    ema200=close.ewm(span=min(200,len(close))).mean()
+    
+    return ema_signals_from_values(ema8.iloc[-1],ema21.iloc[-1],ema200.iloc[-1],current_price)
+
+def ema_signals_from_values(ema8,ema21,ema200,current_price):
+    """The calculate_ema_signals() result for given latest EMA values (None = not enough bars)"""
     result={
         "cross_signal":"NEUTRAL",
         "filter_signal":"NEUTRAL",
@@ -2908,20 +3936,12 @@ def calculate_ema_signals(es_candles,current_price):
         "above_200":False,"below_200":False,
         "aligned_calls":False,"aligned_puts":False
     }
-    
-    if es_candles is None or len(es_candles)<21:
+    if ema8 is None:
         return result
     
-    close=es_candles['Close']
-    
-    # Calculate EMAs
-    ema8=close.ewm(span=8).mean()
-    ema21=close.ewm(span=21).mean()
-    ema200=close.ewm(span=min(200,len(close))).mean()
-    
-    ema8_val=round(ema8.iloc[-1],2)
-    ema21_val=round(ema21.iloc[-1],2)
-    ema200_val=round(ema200.iloc[-1],2)
+    ema8_val=round(np.float64(ema8),2)
+    ema21_val=round(np.float64(ema21),2)
+    ema200_val=round(np.float64(ema200),2)
     
     result["ema8"]=ema8_val
     result["ema21"]=ema21_val
@@ -2951,12 +3971,389 @@ def calculate_ema_signals(es_candles,current_price):
     
     return result
 
+# ═══════════════════════════════════════════════════════════════════════════════
+# INDICATOR ENGINE - calculate_momentum()/calculate_ema_signals() updated per bar
+# ═══════════════════════════════════════════════════════════════════════════════
+# Each indicator keeps the running state pandas itself keeps (adjusted ewm
+# weights, Kahan-compensated rolling sums), so values match the full-series
+# functions bit for bit while every new bar costs O(1).
+INDICATOR_EMA_SPANS=(8,12,21,26,200)
+
+def _ewm_state(span):
+    return {"alpha":1.0/(1.0+(span-1)/2.0),"avg":None,"old_wt":1.0}
+
+def _ewm_step(state, x):
+    """One step of pandas ewm(span, adjust=True).mean()"""
+    if state["avg"] is None:
+        state["avg"]=x
+        return x
+    state["old_wt"]*=1.0-state["alpha"]
+    if state["avg"]!=x:
+        state["avg"]=(state["old_wt"]*state["avg"]+x)/(state["old_wt"]+1.0)
+    state["old_wt"]+=1.0
+    return state["avg"]
+
+def _rolling_state(window):
+    return {"window":window,"values":[],"sum":0.0,"comp":0.0,"neg":0,"same":0,"prev":None}
+
+def _rolling_step(state, x):
+    """One step of pandas rolling(window).mean(); NaN until the window is full"""
+    if state["prev"] is None:
+        state["prev"]=x
+    vals=state["values"]
+    if len(vals)==state["window"]:
+        old=vals.pop(0)
+        y=-old-state["comp"]
+        t=state["sum"]+y
+        state["comp"]=t-state["sum"]-y
+        state["sum"]=t
+        state["neg"]-=math.copysign(1.0,old)<0
+    vals.append(x)
+    y=x-state["comp"]
+    t=state["sum"]+y
+    state["comp"]=t-state["sum"]-y
+    state["sum"]=t
+    state["neg"]+=math.copysign(1.0,x)<0
+    state["same"]=state["same"]+1 if x==state["prev"] else 1
+    state["prev"]=x
+    n=len(vals)
+    if n<state["window"]:
+        return np.nan
+    if state["same"]>=n:
+        return state["prev"]
+    mean=state["sum"]/n
+    if state["neg"]==0 and mean<0:
+        return 0.0
+    if state["neg"]==n and mean>0:
+        return 0.0
+    return mean
+
+def new_indicator_engine():
+    """Empty engine (plain dict, safe to keep in st.session_state)"""
+    return {
+        "n":0,
+        "last_close":None,
+        "last_time":None,
+        "first_time":None,
+        "closes":[],  # only while n < 200: the 200 EMA is ewm(span=n) until then
+        "ema":{span:_ewm_state(span) for span in INDICATOR_EMA_SPANS},
+        "macd_signal":_ewm_state(9),
+        "gain":_rolling_state(14),
+        "loss":_rolling_state(14),
+        "values":{},
+        "provisional":None
+    }
+
+def indicator_step(engine, close, bar_time=None):
+    """Commit one closed bar"""
+    close=float(close)
+    delta=close-engine["last_close"] if engine["last_close"] is not None else np.nan
+    gain=_rolling_step(engine["gain"],delta if delta>0 else 0.0)
+    loss=_rolling_step(engine["loss"],-(delta if delta<0 else 0.0))
+    emas={span:_ewm_step(st_,close) for span,st_ in engine["ema"].items()}
+    macd=emas[12]-emas[26]
+    signal=_ewm_step(engine["macd_signal"],macd)
+    engine["n"]+=1
+    if engine["n"]<200:
+        engine["closes"].append(close)
+    else:
+        engine["closes"]=[]
+    with np.errstate(divide="ignore",invalid="ignore"):
+        rsi=100-(100/(1+np.float64(gain)/np.float64(loss)))
+    engine["values"]={"rsi":rsi,"macd_hist":macd-signal,"ema8":emas[8],"ema21":emas[21],"ema200":emas[200]}
+    engine["last_close"]=close
+    engine["last_time"]=bar_time
+    if engine["first_time"] is None:
+        engine["first_time"]=bar_time
+    return engine
+
+def seed_indicator_engine(es_candles):
+    """Engine over every bar of es_candles (the one-time full pass)"""
+    engine=new_indicator_engine()
+    for t,close in zip(es_candles.index,es_candles["Close"].to_numpy(dtype=float)):
+        indicator_step(engine,close,t)
+    return engine
+
+def read_es_history(path=ES_HISTORY_FILE):
+    """The local 30m ES history store, or None (duplicate bars keep their last copy)"""
+    if not os.path.exists(path):
+        return None
+    try:
+        df=load_es_candles_csv(path)[['Open','High','Low','Close']]
+    except Exception:
+        return None
+    return df[~df.index.duplicated(keep="last")]
+
+def write_es_history(df, path=ES_HISTORY_FILE, keep_days=ES_HISTORY_DAYS):
+    """Rewrite the history store with df's last keep_days of bars (atomic)"""
+    df=df[['Open','High','Low','Close']]
+    df=df[~df.index.duplicated(keep="last")].sort_index()
+    df=df[df.index>=df.index[-1]-pd.Timedelta(days=keep_days)]
+    tmp=f"{path}.{os.getpid()}.tmp"
+    df.to_csv(tmp)
+    os.replace(tmp,path)
+    return df
+
+def append_es_history(df, path=ES_HISTORY_FILE, keep_days=ES_HISTORY_DAYS):
+    """
+    Append closed bars newer than the store's last one (sessions resumed from
+    the same engine state would otherwise append the same bars twice); the
+    store is rewritten to keep_days once it runs a week past that.
+    """
+    history=read_es_history(path)
+    df=df[['Open','High','Low','Close']]
+    if history is not None and len(history):
+        df=df[df.index>history.index[-1]]
+        if len(df) and df.index[-1]-history.index[0]>pd.Timedelta(days=keep_days+7):
+            return write_es_history(pd.concat([history,df]),path,keep_days)
+    if len(df):
+        df.to_csv(path,mode="a",header=not os.path.exists(path))
+    return df
+
+def seed_es_history(es_candles, path=ES_HISTORY_FILE, keep_days=ES_HISTORY_DAYS, now=None):
+    """
+    One-time backfill of the history store (merged with what it already holds).
+    Bars still forming at `now` are left out. The persisted indicator state is
+    dropped so the next session reseeds its 200 EMA over the new history.
+    """
+    df=es_candles[['Open','High','Low','Close']]
+    now=pd.Timestamp.now(tz=df.index.tz) if now is None else now
+    df=df[df.index+pd.Timedelta(minutes=30)<=now]
+    if df.empty:
+        return None
+    history=read_es_history(path)
+    df=write_es_history(df if history is None else pd.concat([history,df]),path,keep_days)
+    if path==ES_HISTORY_FILE and os.path.exists(INDICATOR_STATE_FILE):
+        os.remove(INDICATOR_STATE_FILE)
+    return df
+
+def load_indicator_engine(path=INDICATOR_STATE_FILE):
+    try:
+        with open(path,"rb") as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+def save_indicator_engine(engine, path=INDICATOR_STATE_FILE):
+    """Persist the committed state (the forming bar is never saved)"""
+    tmp=f"{path}.{os.getpid()}.tmp"
+    with open(tmp,"wb") as f:
+        pickle.dump({**engine,"provisional":None},f,protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp,path)
+
+def sync_indicator_engine(engine, es_candles, history_path=None, persist=False):
+    """
+    Bring a persisted engine up to date with the latest candles
+    Bars after engine["last_time"] are committed, except the newest one,
+    which may still be forming: it is applied to a copy on each rerun
+    (engine["provisional"]). Reseeds when the candles don't continue the
+    engine's series.
+    
+    With history_path, a reseed first runs through the local history bars
+    that precede the candles, so the 200 EMA starts converged instead of
+    warming up over the fetched week. persist=True (live mode) appends each
+    committed bar to that store and saves the state to INDICATOR_STATE_FILE,
+    so the next session continues where this one stopped.
+    """
+    if es_candles is None or es_candles.empty:
+        return None
+    idx=es_candles.index
+    closed=es_candles.iloc[:-1][['Open','High','Low','Close']]
+    reseeded=False
+    if engine is None or engine["last_time"] is None or idx[0]<engine["first_time"] or engine["last_time"] not in idx:
+        base=closed
+        history=read_es_history(history_path) if history_path else None
+        if history is not None and len(closed):
+            older=history[history.index<closed.index[0]]
+            if len(older) and closed.index[0]-older.index[-1]<=pd.Timedelta(days=4):  # contiguous up to a weekend
+                base=pd.concat([older,closed])
+        if persist and history_path and len(base):
+            base=write_es_history(base if history is None else pd.concat([history,base]),history_path)
+        engine=seed_indicator_engine(base)
+        reseeded=True
+    start=idx.searchsorted(engine["last_time"],side="right") if engine["last_time"] is not None else 0
+    closes=es_candles["Close"].to_numpy(dtype=float)
+    for k in range(start,len(idx)-1):
+        indicator_step(engine,closes[k],idx[k])
+    if persist and history_path and not reseeded and start<len(idx)-1:
+        append_es_history(closed.iloc[start:],history_path)
+    if persist and (reseeded or start<len(idx)-1):
+        save_indicator_engine(engine)
+    engine["provisional"]=None
+    if engine["last_time"] is None or idx[-1]>engine["last_time"]:
+        engine["provisional"]=indicator_step(copy.deepcopy({**engine,"provisional":None}),closes[-1],idx[-1])
+    return engine
+
+def _indicator_view(engine):
+    return engine["provisional"] or engine
+
+def engine_momentum(engine):
+    """calculate_momentum() from the engine state"""
+    view=_indicator_view(engine) if engine else None
+    if view is None or view["n"]<26:
+        return {"signal":"NEUTRAL","rsi":50,"macd":0}
+    rsi=view["values"]["rsi"]
+    rsi_val=round(rsi,1) if not pd.isna(rsi) else 50
+    macd_hist=round(np.float64(view["values"]["macd_hist"]),2)
+    if rsi_val>50 and macd_hist>0:signal="BULLISH"
+    elif rsi_val<50 and macd_hist<0:signal="BEARISH"
+    else:signal="NEUTRAL"
+    return {"signal":signal,"rsi":rsi_val,"macd":macd_hist}
+
+def engine_ema_signals(engine, current_price):
+    """calculate_ema_signals() from the engine state"""
+    view=_indicator_view(engine) if engine else None
+    if view is None or view["n"]<21:
+        return ema_signals_from_values(None,None,None,current_price)
+    v=view["values"]
+    ema200=v["ema200"] if view["n"]>=200 else pd.Series(view["closes"]).ewm(span=view["n"]).mean().iloc[-1]
+    return ema_signals_from_values(v["ema8"],v["ema21"],ema200,current_price)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# MULTI-TIMEFRAME INDICATORS - 1h and daily engines over the shared 30m bar store
+# ═══════════════════════════════════════════════════════════════════════════════
+# Higher timeframes are aggregated from the same 30m bars (no extra fetches) and
+# each keeps its own indicator engine, stepped only when one of its bars closes.
+# Values land in a flat dict keyed (instrument, timeframe, indicator, params) so
+# readers never touch the engines: mtf_value(cache,"1h","ema",21).
+MTF_TIMEFRAMES={"1h":pd.Timedelta(hours=1),"1d":pd.Timedelta(hours=23)}  # bar length
+MTF_INDICATORS=(("rsi",14),("macd_hist",(12,26,9)),("ema",8),("ema",21),("ema",200))
+
+def mtf_bucket_start(index, timeframe):
+    """Start (CT) of the timeframe bar each timestamp belongs to"""
+    ct=candles_to_ct(pd.DataFrame(index=index)).index
+    if timeframe=="1h":
+        return ct.floor("h")
+    # Daily bars are Globex sessions: 17:00 CT the evening before → 16:00 CT
+    return (ct+pd.Timedelta(hours=7)).normalize()-pd.Timedelta(hours=7)
+
+def aggregate_closed_bars(bars, timeframe, as_of):
+    """
+    OHLC bars of timeframe built from 30m bars, indexed by bar start (CT)
+    Only bars that have closed by as_of (end of the last closed 30m bar) are
+    returned - the forming one is left out.
+    """
+    start=mtf_bucket_start(bars.index,timeframe)
+    agg=bars.groupby(start).agg({"Open":"first","High":"max","Low":"min","Close":"last"})
+    return agg[agg.index+MTF_TIMEFRAMES[timeframe]<=as_of]
+
+def new_mtf_cache(instrument="ES"):
+    return {"instrument":instrument,"engines":{},"values":{},"bar_time":{}}
+
+def _mtf_publish(cache, timeframe, engine):
+    """Copy an engine's committed values into the flat lookup"""
+    inst=cache["instrument"]
+    for ind,params in MTF_INDICATORS:
+        cache["values"].pop((inst,timeframe,ind,params),None)
+    if engine is None or engine["n"]==0:
+        cache["bar_time"][(inst,timeframe)]=None
+        return
+    cache["bar_time"][(inst,timeframe)]=candles_to_ct(pd.DataFrame(index=pd.DatetimeIndex([engine["last_time"]]))).index[0]
+    v=engine["values"]
+    rsi=v["rsi"]
+    ema200=v["ema200"] if engine["n"]>=200 else pd.Series(engine["closes"]).ewm(span=engine["n"]).mean().iloc[-1]
+    found={("rsi",14):None if pd.isna(rsi) else float(rsi),
+           ("macd_hist",(12,26,9)):float(v["macd_hist"]),
+           ("ema",8):float(v["ema8"]),("ema",21):float(v["ema21"]),("ema",200):float(ema200)}
+    for (ind,params),val in found.items():
+        cache["values"][(inst,timeframe,ind,params)]=val
+
+def sync_mtf_cache(cache, es_candles, engine30=None, history_path=None):
+    """
+    Advance the 1h/daily engines with the bars that closed since the last call
+    The newest 30m candle is treated as forming (same as sync_indicator_engine).
+    A timeframe reseeds - over the local history plus the candles - when its
+    last committed bar is no longer covered by es_candles; otherwise only the
+    30m bars after that bar are aggregated. engine30 is the main 30m engine;
+    its committed values are published under "30m" instead of recomputed.
+    """
+    cache=cache or new_mtf_cache()
+    if es_candles is None or len(es_candles)<2:
+        return cache
+    closed=es_candles.iloc[:-1][['Open','High','Low','Close']]
+    ends=candles_to_ct(pd.DataFrame(index=closed.index[[0,-1]])).index
+    first,as_of=ends[0],ends[1]+pd.Timedelta(minutes=30)
+    history=None
+    for tf,length in MTF_TIMEFRAMES.items():
+        engine=cache["engines"].get(tf)
+        last=engine["last_time"] if engine else None
+        if last is None or last+length<first or last+length>as_of:
+            if history is None and history_path:
+                history=read_es_history(history_path)
+                if history is not None:
+                    history=history[history.index<closed.index[0]]
+                    if history.empty or closed.index[0]-history.index[-1]>pd.Timedelta(days=4):  # contiguous up to a weekend
+                        history=None
+            base=closed if history is None else pd.concat([history,closed])
+            engine=seed_indicator_engine(aggregate_closed_bars(base,tf,as_of))
+        elif last+2*length>as_of:  # the next bar hasn't closed yet
+            continue
+        else:
+            tail=closed.iloc[closed.index.searchsorted(last+length,side="left"):]
+            new=aggregate_closed_bars(tail,tf,as_of)
+            if new.empty:
+                continue
+            for t,close in zip(new.index,new["Close"].to_numpy(dtype=float)):
+                indicator_step(engine,close,t)
+        cache["engines"][tf]=engine
+        _mtf_publish(cache,tf,engine)
+    if engine30 is not None:
+        _mtf_publish(cache,"30m",engine30)
+    return cache
+
+def mtf_value(cache, timeframe, indicator, params, instrument="ES"):
+    """Cached indicator value, or None when not available"""
+    return cache["values"].get((instrument,timeframe,indicator,params)) if cache else None
+
+def mtf_trend(cache, timeframe, instrument="ES"):
+    """BULLISH / BEARISH when the 8/21 EMAs and MACD histogram agree, else NEUTRAL (None if no data)"""
+    ema8=mtf_value(cache,timeframe,"ema",8,instrument)
+    ema21=mtf_value(cache,timeframe,"ema",21,instrument)
+    macd=mtf_value(cache,timeframe,"macd_hist",(12,26,9),instrument)
+    if ema8 is None or ema21 is None or macd is None:
+        return None
+    if ema8>ema21 and macd>0:return "BULLISH"
+    if ema8<ema21 and macd<0:return "BEARISH"
+    return "NEUTRAL"
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # OPTION PRICING
 # ═══════════════════════════════════════════════════════════════════════════════
 def get_strike(entry_level,opt_type):
-    if opt_type=="CALL":return int(round((entry_level+20)/5)*5)
-    return int(round((entry_level-20)/5)*5)
+    """
+    20 pts OTM on the 5-pt grid. Arrays broadcast (opt_type of "CALL"/"PUT"
+    strings or a bool is_call); scalars in → int out.
+    """
+    opt_type=np.asarray(opt_type)
+    is_call=opt_type=="CALL" if opt_type.dtype.kind in "UO" else opt_type.astype(bool)
+    strike=np.round((np.asarray(entry_level,dtype=float)+np.where(is_call,20,-20))/5)*5
+    return int(strike) if strike.ndim==0 else strike
+
+def odte_iv(vix,hours,log_moneyness=None):
+    """
+    0DTE IV from VIX and hours left (arrays broadcast)
+    0DTE IV is elevated but not as extreme as some think:
+    VIX 16 → effective 0DTE IV around 25-35%, floored at 20%
+    Once calibrate-iv has saved IV_CALIBRATION_FILE, its per-hour multiplier
+    (and smile in log_moneyness = ln(K/S), when given) replaces that rule for
+    the hours it covers. The 20% floor belongs to the rule; calibrated IVs
+    only stop at IV_MIN, the lowest IV a quote can calibrate to.
+    """
+    vix,hours=np.asarray(vix,dtype=float),np.asarray(hours,dtype=float)
+    rule=np.maximum((vix/100)*np.where(hours<3,2.0,np.where(hours<5,1.8,1.5)),0.20)
+    cal=iv_calibration()
+    if cal is None:
+        return rule
+    ratio=calibrated_iv_ratio(cal,hours,log_moneyness)
+    return np.where(np.isnan(ratio),rule,np.maximum((vix/100)*ratio,IV_MIN))
+
+def _option_premiums(spx, strike, is_call, hours, iv, r=0.05):
+    """estimate_prices() conventions: T floored at 0.0001 yr, premium floored at 0.05"""
+    T=np.maximum(0.0001,np.asarray(hours,dtype=float)/(365*24))
+    return np.maximum(black_scholes_array(spx,strike,T,r,iv,is_call),0.05)
+
+def _round_premiums(p):
+    return round(float(p),2) if np.ndim(p)==0 else np.round(p,2)
 
 def estimate_prices(entry_level,strike,opt_type,vix,hours):
     """
@@ -2966,65 +4363,445 @@ def estimate_prices(entry_level,strike,opt_type,vix,hours):
     - Typical ATM premiums: $8-15 with 5-6 hours left
     - Typical 20pt OTM premiums: $3-8 with 5-6 hours left
     - Typical 50pt OTM premiums: $1-4 with 5-6 hours left
-    """
-    # 0DTE IV is elevated but not as extreme as some think
-    # VIX 16 → effective 0DTE IV around 25-35%
-    iv_multiplier = 2.0 if hours < 3 else 1.8 if hours < 5 else 1.5
-    iv = (vix / 100) * iv_multiplier
-    
-    # Minimum IV floor for 0DTE
-    iv = max(iv, 0.20)
-    
-    # Time in years
-    T = max(0.0001, hours / (365 * 24))
-    
-    # Risk-free rate
-    r = 0.05
-    
-    entry = black_scholes(entry_level, strike, T, r, iv, opt_type)
-    
-    # Minimum premium
-    entry = max(entry, 0.05)
     
-    return round(entry, 2)
+    Any argument may be an array (opt_type of "CALL"/"PUT"); all of them are
+    priced in one call. Scalars in → float out.
+    """
+    return _round_premiums(_option_premiums(entry_level,strike,opt_type,hours,odte_iv(vix,hours,np.log(np.asarray(strike,dtype=float)/np.asarray(entry_level,dtype=float)))))
+
+def _exit_hour_grid(entry_level,levels,hit_times=None):
+    """Hours from entry to each target's hit, one row of HIT_TIME_QUANTILES per target"""
+    # Each target takes roughly 30-60 mins unless the history says otherwise
+    grid=np.tile((0.5+0.5*np.arange(len(levels)))[:,None],(1,len(HIT_TIME_QUANTILES)))
+    if hit_times and len(levels):
+        hist=hit_time_quantiles(hit_times,np.abs(np.asarray(levels,dtype=float)-entry_level))
+        grid=np.where(np.isnan(hist),grid,hist)
+    return grid
 
-def estimate_exit_prices(entry_level,strike,opt_type,vix,hours,targets):
+def estimate_exit_prices(entry_level,strike,opt_type,vix,hours,targets,hit_times=None):
     """
     Estimate exit prices at each target level with time decay.
+    Entry and every target are priced together, at the IV of the entry.
+    With hit_times (hit_time_model()), each target is priced at every
+    historical hit-time quantile for its distance instead of the fixed steps:
+    "price" is the mean premium, "low"/"high" its range over the quantiles.
     """
-    iv_multiplier = 2.0 if hours < 3 else 1.8 if hours < 5 else 1.5
-    iv = (vix / 100) * iv_multiplier
-    iv = max(iv, 0.20)
-    
-    r = 0.05
-    entry_T = max(0.0001, hours / (365 * 24))
-    entry_price = black_scholes(entry_level, strike, entry_T, r, iv, opt_type)
-    entry_price = max(entry_price, 0.05)
+    targets=targets[:3]
+    q=len(HIT_TIME_QUANTILES)
+    grid=_exit_hour_grid(entry_level,[t["level"] for t in targets],hit_times)
+    levels=np.repeat(np.array([t["level"] for t in targets],dtype=float),q)
+    prices=_option_premiums(np.concatenate([[entry_level],levels]),strike,opt_type,
+                            np.concatenate([[hours],np.maximum(0.1,hours-grid).ravel()]),
+                            odte_iv(vix,hours,math.log(strike/entry_level)))
+    entry_price=prices[0]
+    exits=prices[1:].reshape(len(targets),q)
+    varies=np.ptp(grid,axis=1)>0 if len(targets) else np.zeros(0,dtype=bool)
+    expected=np.where(varies,exits.mean(axis=1),exits[:,0])
     
     results = []
-    for i, tgt in enumerate(targets[:3]):
-        # Each target takes roughly 30-60 mins
-        hours_elapsed = 0.5 + (i * 0.5)
-        exit_hours = max(0.1, hours - hours_elapsed)
-        exit_T = max(0.0001, exit_hours / (365 * 24))
-        
-        exit_price = black_scholes(tgt["level"], strike, exit_T, r, iv, opt_type)
-        exit_price = max(exit_price, 0.05)
-        
+    for i,tgt in enumerate(targets):
+        exit_price=expected[i]
         pct = (exit_price - entry_price) / entry_price * 100 if entry_price > 0.05 else 0
         results.append({
             "target": tgt["name"],
             "level": tgt["level"],
-            "price": round(exit_price, 2),
-            "pct": round(pct, 0)
+            "price": round(float(exit_price), 2),
+            "pct": round(float(pct), 0),
+            "hours": round(float(np.median(grid[i])), 2),
+            "low": round(float(exits[i].min()), 2),
+            "high": round(float(exits[i].max()), 2)
         })
     
-    return results, round(entry_price, 2)
+    return results, round(float(entry_price), 2)
+
+def black_scholes_greeks(S,K,T,r,sigma,is_call):
+    """
+    Delta, gamma, theta ($ per calendar day) and vega ($ per vol point),
+    broadcast like black_scholes_array(). Expired contracts: delta 1/0, rest 0.
+    """
+    S,K,T,r,sigma=[np.asarray(a,dtype=float) for a in (S,K,T,r,sigma)]
+    is_call=np.asarray(is_call)
+    if is_call.dtype.kind in "UO":
+        is_call=is_call=="CALL"
+    live=T>0
+    Tl=np.where(live,T,1.0)
+    sq=np.sqrt(Tl)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        d1=(np.log(S/K)+(r+0.5*sigma**2)*Tl)/(sigma*sq)
+    d2=d1-sigma*sq
+    pdf=norm_pdf_array(d1)
+    disc=K*np.exp(-r*Tl)
+    delta=np.where(is_call,norm_cdf_array(d1),norm_cdf_array(d1)-1.0)
+    theta=-S*pdf*sigma/(2*sq)+np.where(is_call,-r*disc*norm_cdf_array(d2),r*disc*norm_cdf_array(-d2))
+    itm=np.where(is_call,S>K,S<K)
+    return {
+        "delta":np.where(live,delta,np.where(itm,np.where(is_call,1.0,-1.0),0.0)),
+        "gamma":np.where(live,pdf/(S*sigma*sq),0.0),
+        "theta":np.where(live,theta/365,0.0),
+        "vega":np.where(live,S*pdf*sq/100,0.0)
+    }
+
+PNL_SURFACE_PTS=40  # SPX range shown each side of the strike
+PNL_SURFACE_STEP=5
+
+@st.cache_data(max_entries=32,show_spinner=False)
+def option_pnl_surface(strike,opt_type,vix,hours,entry_spx,contracts=1,entry_premium=None):
+    """
+    $ P&L of the trade over SPX price × hours left, priced in one broadcast call
+    Entry is at entry_spx with hours left; IV stays at the entry IV (as in
+    estimate_exit_prices). Cached per (strike, side, vix, hours, entry) -
+    pass hours on a coarse grid so reruns hit the cache, and the premium
+    actually quoted (priced at the exact hours) as entry_premium so the
+    P&L is measured from it rather than from the grid's entry row.
+    """
+    is_call=opt_type=="CALL"
+    iv=float(odte_iv(vix,hours,math.log(strike/entry_spx)))
+    spx=np.arange(strike-PNL_SURFACE_PTS,strike+PNL_SURFACE_PTS+PNL_SURFACE_STEP,PNL_SURFACE_STEP,dtype=float)
+    left=np.round(np.arange(hours,-1e-9,-0.5),2)
+    # Row 0 is the entry; the grid follows (S down the rows, hours left across)
+    S=np.concatenate([[entry_spx],np.repeat(spx[::-1],len(left))])
+    H=np.concatenate([[hours],np.tile(left,len(spx))])
+    T=np.maximum(0.0001,H/(365*24))
+    premium=np.maximum(black_scholes_array(S,strike,T,0.05,iv,is_call),0.05)
+    greeks=black_scholes_greeks(entry_spx,strike,T[0],0.05,iv,is_call)
+    entry=round(float(premium[0] if entry_premium is None else entry_premium),2)
+    grid=premium[1:].reshape(len(spx),len(left))
+    return {
+        "spx":spx[::-1],"hours_left":left,"iv":iv,
+        "entry_premium":entry,
+        "premium":np.round(grid,2),
+        "pnl":np.round((grid-entry)*100*contracts,0),
+        "greeks":{k:float(v) for k,v in greeks.items()}
+    }
+
+def touch_probability(spot,level,sigma,hours):
+    """
+    Chance a driftless lognormal path from spot touches level within hours
+    (reflection principle: 2·P(ending beyond it)), broadcast over arrays
+    """
+    spot,level,sigma,hours=[np.asarray(a,dtype=float) for a in (spot,level,sigma,hours)]
+    T=np.maximum(hours,0.0)/(365*24)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        z=np.abs(np.log(level/spot))/(sigma*np.sqrt(T))
+    return np.where(level==spot,1.0,np.where(T>0,2.0*norm_cdf_array(-z),0.0))
+
+LADDER_PTS=100  # strikes evaluated each side of the entry
+LADDER_STEP=5
+LADDER_MIN_PREMIUM=0.50  # cheaper strikes are left out: a tiny premium makes return per $ meaningless
+
+@st.cache_data(max_entries=32,show_spinner=False)
+def strike_ladder(entry_level,opt_type,vix,hours,targets,hit_times=None):
+    """
+    Every 5-pt strike within ±LADDER_PTS of the entry, ranked by expected return per $ of premium
+    targets: ((name, level), ...) from find_targets(). The position is scaled
+    out in equal legs, one per target: a leg sells at the target's premium
+    (averaged over its estimate_exit_prices() hit times, so hit_time_model()
+    when given) with the touch_probability() of that target before the close,
+    otherwise it expires worth its intrinsic with SPX back at the entry.
+    Each strike is priced at its own IV (smile in ln(K/S), as estimate_prices());
+    entry and every exit go through one kernel call. Strikes under
+    LADDER_MIN_PREMIUM are left out. Cached per (entry, side, vix, hours, targets, model).
+    """
+    is_call=opt_type=="CALL"
+    strikes=np.arange(round(entry_level/5)*5-LADDER_PTS,round(entry_level/5)*5+LADDER_PTS+LADDER_STEP,LADDER_STEP,dtype=float)
+    levels=np.array([l for _,l in targets],dtype=float)
+    n,m=len(strikes),len(levels)
+    q=len(HIT_TIME_QUANTILES)
+    iv=np.broadcast_to(odte_iv(vix,hours,np.log(strikes/entry_level)),strikes.shape)  # the rule alone is a scalar
+    exit_hours=np.maximum(0.1,hours-_exit_hour_grid(entry_level,levels,hit_times)).ravel()
+    # One call: entry per strike, then strikes × targets × hit-time quantiles
+    S=np.concatenate([np.full(n,entry_level),np.tile(np.repeat(levels,q),n)])
+    K=np.concatenate([strikes,np.repeat(strikes,m*q)])
+    H=np.concatenate([np.full(n,hours),np.tile(exit_hours,n)])
+    prices=_option_premiums(S,K,is_call,H,np.concatenate([iv,np.repeat(iv,m*q)]))
+    entry=prices[:n]
+    exits=prices[n:].reshape(n,m,q).mean(axis=2)
+    expire=np.where(is_call,np.maximum(entry_level-strikes,0),np.maximum(strikes-entry_level,0))
+    p=touch_probability(entry_level,levels,float(odte_iv(vix,hours,0.0)),hours) if m else np.zeros(0)
+    expected=(exits*p+expire[:,None]*(1-p)).mean(axis=1) if m else expire
+    ladder=pd.DataFrame({
+        "strike":strikes.astype(int),
+        "otm_pts":np.round(np.where(is_call,strikes-entry_level,entry_level-strikes),2),
+        "premium":np.round(entry,2),
+        **{f"exit {name}":np.round(exits[:,j],2) for j,(name,_) in enumerate(targets)},
+        "expected_exit":np.round(expected,2),
+        "return_per_dollar":np.round(expected/entry-1,4)
+    })[entry>=LADDER_MIN_PREMIUM].sort_values("return_per_dollar",ascending=False,kind="stable").reset_index(drop=True)
+    ladder.attrs["touch_probability"]={name:round(float(pj),4) for (name,_),pj in zip(targets,p)}
+    return ladder
+
+PRICING_TOL=1e-9  # max $ gap between black_scholes_array() and black_scholes() benchmark_pricing() accepts
+
+def _norm_cdf_as7126(x):
+    """The previous Abramowitz-Stegun 7.1.26 norm_cdf, kept as the benchmark baseline"""
+    a1,a2,a3,a4,a5=0.254829592,-0.284496736,1.421413741,-1.453152027,1.061405429
+    x=np.asarray(x,dtype=float)
+    z=np.abs(x)/math.sqrt(2)
+    t=1.0/(1.0+0.3275911*z)
+    y=1.0-(((((a5*t+a4)*t)+a3)*t+a2)*t+a1)*t*np.exp(-z*z)
+    return 0.5*(1.0+np.where(x>=0,1.0,-1.0)*y)
+
+def benchmark_pricing(n=1_000_000, lo=-37.0, hi=8.0, seed=0):
+    """
+    Throughput and accuracy of the pricing kernels, one row per kernel
+    CDFs are scored on n points spread over [lo, hi] against the scalar
+    math.erfc norm_cdf (relative error where the reference is a normal float;
+    "tail" = x < -5). The array Black-Scholes is scored against black_scholes()
+    on random 0DTE-like contracts (scalar reference capped at 200k calls).
+    """
+    def timed(f,*a):
+        t0=time_module.perf_counter()
+        out=f(*a)
+        return out,time_module.perf_counter()-t0
+    
+    x=np.linspace(lo,hi,n)
+    ref,ref_s=timed(lambda v:np.array([norm_cdf(u) for u in v]),x)
+    ok=ref>=np.finfo(float).tiny
+    tail=ok&(x<-5)
+    rows=[{"kernel":"norm_cdf (math.erfc, scalar loop)","evals":n,"m_per_sec":n/ref_s/1e6,"max_rel_err":0.0,"tail_max_rel_err":0.0,"max_abs_err":0.0}]
+    for name,f in [("norm_cdf_array (erfc Chebyshev)",norm_cdf_array),("A&S 7.1.26 (previous)",_norm_cdf_as7126)]:
+        got,s=timed(f,x)
+        rel=np.abs(got-ref)/np.where(ok,ref,1.0)
+        rows.append({"kernel":name,"evals":n,"m_per_sec":n/s/1e6,"max_rel_err":float(rel[ok].max()),
+                     "tail_max_rel_err":float(rel[tail].max()) if tail.any() else np.nan,"max_abs_err":float(np.abs(got-ref).max())})
+    
+    rng=np.random.default_rng(seed)
+    m=min(n,200_000)
+    S=rng.uniform(4000,6000,m)
+    K=np.round((S+rng.uniform(-150,150,m))/5)*5
+    T=rng.uniform(0,8,m)/(365*24)
+    sigma=rng.uniform(0.1,1.0,m)
+    is_call=rng.random(m)<0.5
+    got,s=timed(black_scholes_array,S,K,T,0.05,sigma,is_call)
+    ref=np.array([black_scholes(*a,"CALL" if c else "PUT") for *a,c in zip(S,K,T,np.full(m,0.05),sigma,is_call)])
+    big=ref>=0.05
+    rows.append({"kernel":"black_scholes_array vs black_scholes","evals":m,"m_per_sec":m/s/1e6,
+                 "max_rel_err":float((np.abs(got-ref)[big]/ref[big]).max()),"tail_max_rel_err":np.nan,"max_abs_err":float(np.abs(got-ref).max())})
+    return pd.DataFrame(rows)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# IV CALIBRATION - implied vols from a quote snapshot → per-hour VIX multipliers
+# ═══════════════════════════════════════════════════════════════════════════════
+# Snapshot CSV, one row per quote: spot, strike, type (C/P or CALL/PUT), bid/ask
+# (or mid), hours left (or time as HH:MM CT) and vix (or --vix for the file).
+# Buckets are whole hours left; each gets the median IV/VIX ratio and, with
+# enough strikes, a quadratic smile of that ratio in ln(K/S).
+IV_MIN=0.05
+IV_MAX=5.0
+IV_SMILE_MIN_QUOTES=10
+
+def implied_vol(price,S,K,T,is_call,r=0.05,tol=1e-8,max_iter=100):
+    """
+    Implied vols for arrays of quotes (NaN where price is outside what
+    IV_MIN..IV_MAX can produce). Newton steps on vega, bisection whenever a step
+    leaves the [IV_MIN, IV_MAX] bracket, all quotes advanced together.
+    """
+    price,S,K,T=np.broadcast_arrays(*[np.asarray(a,dtype=float) for a in (price,S,K,T)])
+    is_call=np.broadcast_to(np.asarray(is_call),price.shape)
+    if is_call.dtype.kind in "UO":
+        is_call=is_call=="CALL"
+    lo=np.full(price.shape,IV_MIN)
+    hi=np.full(price.shape,IV_MAX)
+    ok=(T>0)&(black_scholes_array(S,K,T,r,lo,is_call)<price)&(black_scholes_array(S,K,T,r,hi,is_call)>price)
+    sigma=np.full(price.shape,0.3)
+    active=ok.copy()
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        a=np.flatnonzero(active)
+        s=sigma[a]
+        diff=black_scholes_array(S[a],K[a],T[a],r,s,is_call[a])-price[a]
+        # Shrink the bracket, then Newton unless it jumps outside
+        lo[a]=np.where(diff<0,s,lo[a])
+        hi[a]=np.where(diff>0,s,hi[a])
+        vega=black_scholes_greeks(S[a],K[a],T[a],r,s,is_call[a])["vega"]*100
+        with np.errstate(divide="ignore",invalid="ignore"):
+            step=s-diff/vega
+        inside=np.isfinite(step)&(step>lo[a])&(step<hi[a])
+        done=np.abs(diff)<=tol
+        sigma[a]=np.where(done,s,np.where(inside,step,0.5*(lo[a]+hi[a])))
+        active[a]=~done&(hi[a]-lo[a]>tol)
+    return np.where(ok,sigma,np.nan)
+
+def _quote_hours(quotes):
+    if "hours" in quotes:
+        return quotes["hours"].to_numpy(dtype=float)
+    return _hours_to_expiry(quotes["time"].astype(str).str[:5])
+
+def calibrate_iv(quotes, vix=None, r=0.05, max_abs_moneyness=0.05):
+    """
+    Solve every quote's IV and fit the per-hour buckets
+    Uses out-of-the-money quotes with a positive bid (mid ≥ 0.10) within
+    max_abs_moneyness of spot. Returns (calibration dict for
+    save_iv_calibration(), the filtered quotes with their IVs).
+    """
+    q=quotes.rename(columns=str.lower).copy()
+    if "mid" not in q:
+        q["mid"]=(q["bid"]+q["ask"])/2
+    if vix is not None:
+        q["vix"]=vix
+    elif "vix" not in q:
+        raise ValueError("quotes have no vix column - pass vix")
+    q["hours"]=_quote_hours(q)
+    q["is_call"]=q["type"].astype(str).str.upper().str[0]=="C"
+    q["k"]=np.log(q["strike"].to_numpy(dtype=float)/q["spot"].to_numpy(dtype=float))
+    keep=(q["mid"]>=0.10)&(q["hours"]>0)&(q["k"].abs()<=max_abs_moneyness)&(q["is_call"]==(q["k"]>=0))
+    if "bid" in q:
+        keep&=q["bid"]>0
+    q=q[keep].reset_index(drop=True)
+    q["iv"]=implied_vol(q["mid"],q["spot"],q["strike"],q["hours"]/(365*24),q["is_call"].to_numpy(),r)
+    q["ratio"]=q["iv"]/(q["vix"].astype(float)/100)
+    q["bucket"]=np.floor(q["hours"]).astype(int)
+    buckets=[]
+    for b,g in q.dropna(subset=["ratio"]).groupby("bucket"):
+        entry={"hours_lo":int(b),"hours_hi":int(b)+1,"quotes":len(g),"multiplier":round(float(g["ratio"].median()),4),"smile":None}
+        if len(g)>=IV_SMILE_MIN_QUOTES:
+            X=np.column_stack([np.ones(len(g)),g["k"],g["k"]**2])
+            coef,*_=np.linalg.lstsq(X,g["ratio"].to_numpy(),rcond=None)
+            entry["smile"]=[float(c) for c in coef]
+            entry["k_range"]=[float(g["k"].min()),float(g["k"].max())]
+            entry["rmse"]=round(float(np.sqrt(np.mean((X@coef-g["ratio"].to_numpy())**2))),4)
+        buckets.append(entry)
+    return {"created":datetime.now(CT).isoformat(timespec="seconds"),"quotes":int(keep.sum()),
+            "solved":int(q["iv"].notna().sum()),"buckets":buckets},q
+
+def save_iv_calibration(cal, path=IV_CALIBRATION_FILE):
+    tmp=f"{path}.{os.getpid()}.tmp"
+    with open(tmp,"w") as f:
+        json.dump(cal,f,indent=2)
+    os.replace(tmp,path)
+
+@st.cache_data(show_spinner=False)
+def _read_iv_calibration(path, mtime):
+    with open(path) as f:
+        return json.load(f)
+
+def iv_calibration(path=IV_CALIBRATION_FILE):
+    """The saved calibration, or None - read on first use and whenever the file changes"""
+    try:
+        mtime=os.path.getmtime(path)
+        return _read_iv_calibration(path,mtime)
+    except (OSError,ValueError):
+        return None
+
+def calibrated_iv_ratio(cal, hours, log_moneyness=None):
+    """IV/VIX ratio from the calibration for each hours left (NaN where no bucket covers it)"""
+    hours=np.asarray(hours,dtype=float)
+    size=max([b["hours_hi"] for b in cal["buckets"]],default=0)
+    if size==0:
+        return np.full(np.shape(hours),np.nan)
+    mult=np.full(size,np.nan)
+    smile=np.full((size,3),np.nan)
+    k_lo,k_hi=np.zeros(size),np.zeros(size)
+    for b in cal["buckets"]:
+        mult[b["hours_lo"]]=b["multiplier"]
+        if b.get("smile"):
+            smile[b["hours_lo"]]=b["smile"]
+            k_lo[b["hours_lo"]],k_hi[b["hours_lo"]]=b["k_range"]
+    bucket=np.floor(np.where(np.isfinite(hours),hours,-1.0))
+    covered=(bucket>=0)&(bucket<size)
+    idx=np.where(covered,bucket,0).astype(int)
+    ratio=np.where(covered,mult[idx],np.nan)  # uncalibrated hours stay NaN → the rule
+    if log_moneyness is None:
+        return ratio
+    k=np.clip(np.asarray(log_moneyness,dtype=float),k_lo[idx],k_hi[idx])
+    fitted=smile[idx,0]+smile[idx,1]*k+smile[idx,2]*k*k
+    return np.where(np.isnan(fitted)|np.isnan(ratio),ratio,fitted)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# MONTE CARLO - 1-minute GBM paths to the close, simulated in chunks of paths
+# ═══════════════════════════════════════════════════════════════════════════════
+MC_PATHS=20000
+MC_CHUNK=4000  # paths per chunk: ~12 MB of float64 per array at 390 steps
+MC_TIME_BUDGET=2.0  # seconds; later chunks are skipped once it is spent
+
+def simulate_trade_paths(spot, levels, sigma, hours, strike=None, is_call=True, n_paths=MC_PATHS,
+                         chunk=MC_CHUNK, step_minutes=1.0, mu=0.0, seed=None, time_budget=MC_TIME_BUDGET,
+                         option_iv=None, entry_premium=None):
+    """
+    First-passage odds for each level and the option payoff distribution
+    Driftless (mu=0) GBM at sigma from spot to the close, one step per
+    step_minutes. A level counts as hit when a step closes at or beyond it.
+    With a strike: "plan" exits at the first level's premium when it is hit
+    (priced with the time left at the hit), otherwise holds to expiry;
+    "expiry" always holds. Payoffs are $ per contract net of the entry premium.
+    The option legs are priced at option_iv (default sigma - pass the strike's
+    smile IV); entry_premium overrides the priced entry (e.g. the quoted one).
+    Chunks stop early once time_budget seconds are spent ("paths" = paths run).
+    """
+    levels=np.asarray(levels,dtype=float)
+    rng=np.random.default_rng(seed)
+    steps=max(1,int(round(hours*60/step_minutes)))
+    step_hours=hours/steps
+    dt=step_hours/(365*24)
+    barrier=np.log(levels/spot)
+    up=barrier>0
+    hits=np.zeros(len(levels))
+    first_hits=[[] for _ in levels]
+    finals,plan,expiry=[],[],[]
+    option_iv=sigma if option_iv is None else option_iv
+    entry=None
+    if strike is not None:
+        entry=float(_option_premiums(spot,strike,is_call,hours,option_iv) if entry_premium is None else entry_premium)
+    t0=time_module.perf_counter()
+    done=0
+    while done<n_paths:
+        c=min(chunk,n_paths-done)
+        logp=np.cumsum(rng.standard_normal((c,steps))*(sigma*math.sqrt(dt))+(mu-0.5*sigma**2)*dt,axis=1)
+        first=np.full((c,len(levels)),-1)
+        for j,b in enumerate(barrier):
+            crossed=logp>=b if up[j] else logp<=b
+            hit=crossed.any(axis=1)
+            first[hit,j]=crossed[hit].argmax(axis=1)
+            hits[j]+=hit.sum()
+            first_hits[j].append(first[hit,j])
+        final=spot*np.exp(logp[:,-1])
+        finals.append(final)
+        if strike is not None:
+            intrinsic=np.maximum(final-strike,0) if is_call else np.maximum(strike-final,0)
+            expiry.append((intrinsic-entry)*100)
+            value=intrinsic.copy()
+            if len(levels):
+                k=first[:,0]>=0
+                left=hours-(first[k,0]+1)*step_hours
+                value[k]=_option_premiums(levels[0],strike,is_call,left,option_iv)
+            plan.append((value-entry)*100)
+        done+=c
+        if time_budget is not None and time_module.perf_counter()-t0>time_budget:
+            break
+    
+    def dist(x):
+        x=np.concatenate(x)
+        p10,p50,p90=np.percentile(x,[10,50,90])
+        return {"mean":round(float(x.mean()),2),"p10":round(float(p10),2),"p50":round(float(p50),2),
+                "p90":round(float(p90),2),"prob_profit":round(float((x>0).mean()),4)}
+    
+    out={
+        "paths":done,"steps":steps,"sigma":sigma,"elapsed":round(time_module.perf_counter()-t0,3),
+        "touch":np.round(hits/done,4).tolist(),
+        "median_minutes":[round(float((np.median(np.concatenate(f))+1)*step_minutes),1) if sum(map(len,f)) else None for f in first_hits],
+        "final":dict(zip(["p10","p50","p90"],np.round(np.percentile(np.concatenate(finals),[10,50,90]),2).tolist()))
+    }
+    if strike is not None:
+        out.update(entry_premium=round(entry,2),option_iv=option_iv,plan=dist(plan),expiry=dist(expiry))
+    return out
+
+@st.cache_data(max_entries=16,show_spinner=False)
+def monte_carlo_targets(spot,levels,vix,hours,strike,opt_type,entry_premium=None,seed=0):
+    """
+    simulate_trade_paths() on paths at the ATM 0DTE IV, option legs at the
+    strike's ln(K/S) IV as estimate_prices() prices them; cached per
+    (spot, levels, vix, hours, strike, side, premium)
+    """
+    sigma=float(odte_iv(vix,hours,0.0))
+    option_iv=float(odte_iv(vix,hours,math.log(strike/spot)))
+    return simulate_trade_paths(spot,list(levels),sigma,hours,strike,opt_type=="CALL",seed=seed,
+                                option_iv=option_iv,entry_premium=entry_premium)
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # CONFIDENCE
 # ═══════════════════════════════════════════════════════════════════════════════
-def calculate_confidence(channel_type,validation,direction,ema_signals,flow,vix_zone):
+def calculate_confidence(channel_type,validation,direction,ema_signals,flow,vix_zone,mtf=None):
     """
     Confidence scoring:
     - Channel determined: +25
@@ -3034,6 +4811,7 @@ def calculate_confidence(channel_type,validation,direction,ema_signals,flow,vix_
     - Flow bias aligned: +10
     - VIX favorable: +10
     = 100 max
+    With an MTF cache, the 1h and daily trends are listed alongside (not scored)
     """
     score=0
     breakdown=[]
@@ -3102,8 +4880,1068 @@ def calculate_confidence(channel_type,validation,direction,ema_signals,flow,vix_
     else:
         breakdown.append(("VIX","0"))
     
+    # Higher timeframes - context only
+    for tf,label in (("1h","1h Trend"),("1d","Daily Trend")):
+        trend=mtf_trend(mtf,tf)
+        if trend is None:
+            continue
+        aligned=(direction=="CALLS" and trend=="BULLISH") or (direction=="PUTS" and trend=="BEARISH")
+        opposed=(direction=="CALLS" and trend=="BEARISH") or (direction=="PUTS" and trend=="BULLISH")
+        breakdown.append((label,trend.title()+(" ✓" if aligned else " ⚠️" if opposed else "")))
+    
     return {"score":score,"breakdown":breakdown}
 
+# ═══════════════════════════════════════════════════════════════════════════════
+# BACKTEST - headless multi-day runner (python APPA.py backtest ...)
+# ═══════════════════════════════════════════════════════════════════════════════
+def load_es_candles_csv(path):
+    """ES candles saved with DataFrame.to_csv() (e.g. a yfinance download), index parsed tz-aware"""
+    df=pd.read_csv(path,index_col=0)
+    df.index=pd.to_datetime(df.index,utc=True).tz_convert(ET)
+    return df[['Open','High','Low','Close']+(['Volume'] if 'Volume' in df else [])].sort_index()
+
+# Stage graph: each stage reads its deps' outputs plus only the params it lists.
+# A stage's cache key hashes (stage, version, day, upstream keys, its params),
+# so changing break_threshold re-runs entry/outcome but loads sessions/levels.
+BACKTEST_CACHE_DIR=".backtest_cache"
+BACKTEST_REQUIRED=["on_high","on_low","prior_high_wick","prior_low_close","prior_close","candle_830","day_candles"]
+
+def _stage_sessions(day, up, p):
+    return extract_historical_data(up["candles"],day,p["offset"])
+
+def _stage_levels(day, up, p):
+    hist_data=up["sessions"]
+    if not hist_data or any(hist_data.get(k) is None for k in BACKTEST_REQUIRED):
+        return None
+    syd_h=hist_data.get("sydney_high",hist_data["on_high"])
+    syd_l=hist_data.get("sydney_low",hist_data["on_low"])
+    tok_h=hist_data.get("tokyo_high",hist_data["on_high"]-1)
+    tok_l=hist_data.get("tokyo_low",hist_data["on_low"])
+    channel_type,_=determine_channel(syd_h,syd_l,tok_h,tok_l)
+    
+    ref_time=CT.localize(datetime.combine(day,time(p["ref_hr"],p["ref_mn"])))
+    levels=calculate_channel_levels(hist_data["on_high"],hist_data["on_high_time"],hist_data["on_low"],hist_data["on_low_time"],
+                                    ref_time,p["slope"])
+    ceiling_es,floor_es,_,_=get_channel_edges(levels,channel_type)
+    cones_es=calculate_cones(hist_data["prior_high_wick"],hist_data["prior_high_wick_time"],
+                             hist_data["prior_high_close"],hist_data["prior_high_close_time"],
+                             hist_data["prior_low_close"],hist_data["prior_low_close_time"],
+                             hist_data["prior_close"],hist_data["prior_close_time"],ref_time,p["slope"])
+    offset=p["offset"]
+    cones_spx={k:{"anchor_asc":round(v["anchor_asc"]-offset,2),"anchor_desc":round(v["anchor_desc"]-offset,2),
+                  "asc":round(v["asc"]-offset,2),"desc":round(v["desc"]-offset,2)} for k,v in cones_es.items()}
+    return {"channel_type":channel_type,"ceiling_es":ceiling_es,"floor_es":floor_es,"cones_spx":cones_spx}
+
+def _stage_validation(day, up, p):
+    if up["levels"] is None:
+        return None
+    lv=up["levels"]
+    validation=validate_830_candle(up["sessions"]["candle_830"],lv["ceiling_es"],lv["floor_es"])
+    direction=validation["setup"] if validation["setup"] in ("PUTS","CALLS") else "WAIT"
+    entry_edge_es=validation.get("edge")
+    targets=find_targets(round(entry_edge_es-p["offset"],2),lv["cones_spx"],direction) if entry_edge_es else []
+    return {"validation":validation,"direction":direction,"entry_edge_es":entry_edge_es,"targets":targets}
+
+def _stage_entry(day, up, p):
+    v=up["validation"]
+    if v is None or v["direction"]=="WAIT":
+        return None
+    return find_entry_confirmation(up["sessions"]["day_candles"],v["entry_edge_es"],v["direction"],p["offset"],
+                                   p["break_threshold"],"08:00",p["slope"],p["touch_tolerance"],p["setup_cutoff"])
+
+def _stage_outcome(day, up, p):
+    v=up["validation"]
+    if v is None or v["direction"]=="WAIT":
+        return None
+    lv=up["levels"]
+    return analyze_historical_outcome(up["sessions"],v["validation"],lv["ceiling_es"],lv["floor_es"],v["targets"],
+                                      v["direction"],v["entry_edge_es"],p["offset"],
+                                      slope=p["slope"],break_threshold=p["break_threshold"],entry_conf=up["entry"],
+                                      partial_threshold=p["partial_threshold"])
+
+BACKTEST_STAGES={
+    "candles":{"fn":None,"deps":[],"params":[]},  # source: the day's candle window, keyed by content
+    "sessions":{"fn":_stage_sessions,"deps":["candles"],"params":["offset"],"version":1},
+    "levels":{"fn":_stage_levels,"deps":["sessions"],"params":["offset","ref_hr","ref_mn","slope"],"version":1},
+    "validation":{"fn":_stage_validation,"deps":["sessions","levels"],"params":["offset"],"version":1},
+    "entry":{"fn":_stage_entry,"deps":["sessions","validation"],
+             "params":["offset","break_threshold","slope","touch_tolerance","setup_cutoff"],"version":1},
+    "outcome":{"fn":_stage_outcome,"deps":["sessions","levels","validation","entry"],
+               "params":["offset","slope","partial_threshold"],"version":1},
+}
+
+def stage_key(name, day, ctx):
+    """sha1 of (stage, version, day, upstream keys, the params this stage reads) - memoized in ctx"""
+    if name not in ctx["keys"]:
+        stage=BACKTEST_STAGES[name]
+        if name=="candles":
+            payload=["candles",str(day),int(pd.util.hash_pandas_object(ctx["candles"]).sum())]
+        else:
+            payload=[name,stage.get("version",1),str(day),[stage_key(d,day,ctx) for d in stage["deps"]],
+                     {k:ctx["params"][k] for k in stage["params"]}]
+        ctx["keys"][name]=hashlib.sha1(json.dumps(payload,default=str).encode()).hexdigest()
+    return ctx["keys"][name]
+
+def run_stage(name, day, ctx):
+    """
+    Output of one stage for one day: memory → disk cache → compute
+    Upstream stages are only touched when this stage has to be recomputed.
+    """
+    if name in ctx["values"]:
+        return ctx["values"][name]
+    if name=="candles":
+        ctx["values"][name]=ctx["candles"]
+        return ctx["candles"]
+    
+    path=None
+    if ctx["cache_dir"]:
+        path=os.path.join(ctx["cache_dir"],name,stage_key(name,day,ctx)+".pkl")
+        if os.path.exists(path):
+            try:
+                with open(path,"rb") as f:
+                    ctx["values"][name]=pickle.load(f)
+                ctx["stats"][f"{name}_cached"]=ctx["stats"].get(f"{name}_cached",0)+1
+                return ctx["values"][name]
+            except Exception:
+                pass
+    
+    stage=BACKTEST_STAGES[name]
+    up={d:run_stage(d,day,ctx) for d in stage["deps"]}
+    value=stage["fn"](day,up,ctx["params"])
+    ctx["values"][name]=value
+    ctx["stats"][f"{name}_computed"]=ctx["stats"].get(f"{name}_computed",0)+1
+    if path:
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        tmp=f"{path}.{os.getpid()}.tmp"
+        with open(tmp,"wb") as f:
+            pickle.dump(value,f,protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp,path)  # atomic - workers may race on the same key
+    return value
+
+def stage_context(candles, params, cache_dir=None, stats=None):
+    """State for run_stage() on one day: its candle window, full params, key/value memos"""
+    return {"candles":candles,"params":params,"cache_dir":cache_dir,"keys":{},"values":{},
+            "stats":stats if stats is not None else {}}
+
+def day_candle_window(df, day):
+    """The candles one day's pipeline reads: a week of lookback through the day's close (CT index)"""
+    lo=CT.localize(datetime.combine(day-timedelta(days=7),time(0,0)))
+    hi=CT.localize(datetime.combine(day+timedelta(days=1),time(0,0)))
+    return df[(df.index>=lo)&(df.index<hi)]
+
+def backtest_day(es_candles, trading_date, offset=18.0, ref_hr=9, ref_mn=0, slope=None, break_threshold=None,
+                 cache_dir=None, stats=None, touch_tolerance=2.0, setup_cutoff="10:30", partial_threshold=10):
+    """
+    One date through the structural pipeline, no UI:
+    sessions → channel/cones → 8:30 validation → entry confirmation → outcome
+    Returns a flat results row. Days missing overnight, prior RTH or 8:30
+    data come back as NO_DATA instead of falling back to placeholder levels.
+    The EMA conflict filter from main() is not applied - direction is the structure's.
+    With cache_dir, every stage output is cached on disk (see BACKTEST_STAGES).
+    """
+    ctx=stage_context(day_candle_window(candles_to_ct(es_candles),trading_date),{
+        "offset":offset,"ref_hr":ref_hr,"ref_mn":ref_mn,
+        "slope":SLOPE if slope is None else slope,
+        "break_threshold":BREAK_THRESHOLD if break_threshold is None else break_threshold,
+        "touch_tolerance":touch_tolerance,"setup_cutoff":setup_cutoff,"partial_threshold":partial_threshold
+    },cache_dir,stats)
+    row={"date":trading_date,"outcome":"NO_DATA"}
+    v=run_stage("validation",trading_date,ctx)
+    if v is None:
+        return row
+    lv=run_stage("levels",trading_date,ctx)
+    
+    row.update({
+        "channel_type":lv["channel_type"],
+        "ceiling_spx":round(lv["ceiling_es"]-offset,2),
+        "floor_spx":round(lv["floor_es"]-offset,2),
+        "validation":v["validation"]["status"],
+        "direction":v["direction"],
+        "entry_level_spx":round(v["entry_edge_es"]-offset,2) if v["entry_edge_es"] else None,
+        "targets":", ".join(f"{t['name']} {t['level']}" for t in v["targets"]),
+        "targets_json":json.dumps([{"name":t["name"],"level":float(t["level"]),"hit":False,"time":None} for t in v["targets"]]),
+        "outcome":"NO_SETUP",
+        "message":v["validation"]["message"]
+    })
+    if v["direction"]=="WAIT":
+        return row
+    
+    outcome=run_stage("outcome",trading_date,ctx)
+    entry_conf=outcome.get("entry_confirmation") or {}
+    hit={t["name"]:t for t in outcome["targets_hit"]}
+    row.update({
+        "targets_json":json.dumps([_target_json(t,hit.get(t["name"])) for t in v["targets"]]),
+        "outcome":outcome["outcome"],
+        "message":outcome["message"],
+        "setup_time":entry_conf.get("setup_time"),
+        "entry_time":entry_conf.get("entry_time") if entry_conf.get("confirmed") else None,
+        "entry_price_spx":outcome.get("entry_level_at_time"),
+        "max_favorable":round(float(outcome["max_favorable"]),2),
+        "max_adverse":round(float(outcome["max_adverse"]),2),
+        "targets_hit":len(outcome["targets_hit"]),
+        "first_target_time":outcome["targets_hit"][0]["time"] if outcome["targets_hit"] else None,
+        "final_price_spx":outcome["final_price"]
+    })
+    return row
+
+def _backtest_chunk(args):
+    """Process-pool task: a run of dates plus the candle slice that covers them"""
+    es_candles,dates,kwargs=args
+    stats={}
+    rows=[backtest_day(es_candles,d,stats=stats,**kwargs) for d in dates]
+    return rows,stats
+
+def run_backtest(es_candles, start_date, end_date, offset=18.0, ref_hr=9, ref_mn=0, workers=None,
+                 slope=None, break_threshold=None, cache_dir=None, touch_tolerance=2.0, setup_cutoff="10:30",
+                 partial_threshold=10):
+    """
+    backtest_day() for every weekday in [start_date, end_date] that has RTH candles
+    
+    Days are split into one contiguous run per worker; each worker only gets
+    the candle slice for its run (plus a week of lookback for the prior
+    sessions), so nothing big is pickled per day. workers=1 runs inline.
+    Returns a per-day DataFrame sorted by date; attrs["stage_runs"] counts
+    computed vs cached stages.
+    """
+    df=candles_to_ct(es_candles)
+    have=set(df.index[(df.index.hour>=8)&(df.index.hour<15)].date)
+    dates=[d.date() for d in pd.bdate_range(start_date,end_date) if d.date() in have]
+    if not dates:
+        return pd.DataFrame(columns=["date","outcome"])
+    
+    kwargs={"offset":offset,"ref_hr":ref_hr,"ref_mn":ref_mn,"slope":slope,"break_threshold":break_threshold,"cache_dir":cache_dir,
+            "touch_tolerance":touch_tolerance,"setup_cutoff":setup_cutoff,"partial_threshold":partial_threshold}
+    workers=max(1,min(workers or os.cpu_count() or 1,len(dates)))
+    runs=[list(r) for r in np.array_split(np.array(dates,dtype=object),workers) if len(r)]
+    tasks=[]
+    for run in runs:
+        lo=CT.localize(datetime.combine(run[0]-timedelta(days=7),time(0,0)))
+        hi=CT.localize(datetime.combine(run[-1]+timedelta(days=1),time(0,0)))
+        tasks.append((df[(df.index>=lo)&(df.index<hi)],run,kwargs))
+    
+    if workers==1:
+        chunks=[_backtest_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks=list(pool.map(_backtest_chunk,tasks))
+    
+    stage_runs={}
+    for _,stats in chunks:
+        for k,n in stats.items():
+            stage_runs[k]=stage_runs.get(k,0)+n
+    results=pd.DataFrame([r for rows,_ in chunks for r in rows]).sort_values("date").reset_index(drop=True)
+    results.attrs["stage_runs"]=stage_runs
+    return results
+
+def summarize_backtest(results):
+    """Outcome counts and win rate over the days that actually entered"""
+    counts=results["outcome"].value_counts().to_dict()
+    traded=sum(counts.get(k,0) for k in ["WIN","PARTIAL","LOSS"])
+    return {
+        "days":len(results),
+        "counts":counts,
+        "trades":traded,
+        "win_rate":round(counts.get("WIN",0)/traded*100,1) if traded else 0.0
+    }
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# OPTION P&L BACKTEST - premium instead of index points, all trades priced at once
+# ═══════════════════════════════════════════════════════════════════════════════
+OPTION_EXPIRY_CT=15.0  # 0DTE SPX settles at the 15:00 CT close
+
+def _hours_to_expiry(hhmm):
+    """'HH:MM' CT strings → hours left to the close (array)"""
+    t=pd.to_datetime(pd.Series(hhmm,dtype=object),format="%H:%M")
+    return np.maximum(OPTION_EXPIRY_CT-(t.dt.hour+t.dt.minute/60).to_numpy(dtype=float),0.0)
+
+def _hit_target_legs(trades):
+    """targets_json of each trade, exploded to one row per target hit (trade = row position)"""
+    legs=trades["targets_json"].map(json.loads).explode().dropna()
+    legs=pd.DataFrame(legs.tolist(),index=legs.index)
+    if legs.empty:
+        return pd.DataFrame(columns=["trade","name","level","hit","time"])
+    legs=legs[legs["hit"].astype(bool)]
+    return legs.assign(trade=legs.index.to_numpy()).reset_index(drop=True)
+
+def _first_hits(legs):
+    """Earliest hit per trade; ties keep the targets_json order (nearest first)"""
+    return legs.sort_values(["trade","time"],kind="stable").drop_duplicates("trade")
+
+def backtest_option_pnl(results, vix=16.0, contracts=1, r=0.05):
+    """
+    Premium P&L for every traded day of a run_backtest() frame
+    
+    Strike is get_strike() off the SPX entry level, priced at the entry time.
+    Every hit target is priced at its level and hit time (attrs["legs"]); the
+    trade exits at its first target, else settles at intrinsic on the day's
+    final price. IV follows estimate_exit_prices(): one per trade from the hours
+    left at entry. vix may be a scalar or one value per results row.
+    Returns one row per trade with premiums, $ P&L and the equity curve.
+    """
+    columns=["date","direction","strike","entry_time","entry_premium","exit_time","exit_reason","exit_premium","pnl","pnl_pct","equity"]
+    vix=pd.Series(np.broadcast_to(np.asarray(vix,dtype=float),(len(results),)),index=results.index)
+    traded=results["outcome"].isin(["WIN","PARTIAL","LOSS"]) if len(results) else pd.Series([],dtype=bool)
+    trades=results[traded].reset_index(drop=True)
+    vix=vix[traded].to_numpy()
+    if trades.empty:
+        out=pd.DataFrame(columns=columns)
+        out.attrs["legs"]=pd.DataFrame(columns=["trade","name","level","time","premium"])
+        return out
+    
+    is_call=(trades["direction"]=="CALLS").to_numpy()
+    entry=trades["entry_price_spx"].to_numpy(dtype=float)
+    strike=get_strike(entry,is_call)
+    entry_hours=_hours_to_expiry(trades["entry_time"])
+    iv=odte_iv(vix,entry_hours,np.log(strike/entry))
+    entry_premium=_option_premiums(entry,strike,is_call,entry_hours,iv,r)
+    
+    # Hit targets, long format: one row per (trade, target hit)
+    legs=_hit_target_legs(trades)
+    k=legs["trade"].to_numpy(dtype=int)
+    legs["premium"]=np.round(_option_premiums(legs["level"].to_numpy(dtype=float),strike[k],is_call[k],
+                                              _hours_to_expiry(legs["time"]),iv[k],r),2) if len(legs) else []
+    first=_first_hits(legs)
+    
+    # Held to the close: settles at intrinsic (no time value, no premium floor)
+    final=trades["final_price_spx"].to_numpy(dtype=float)
+    exit_premium=np.where(is_call,np.maximum(final-strike,0),np.maximum(strike-final,0))
+    exit_time=np.full(len(trades),f"{int(OPTION_EXPIRY_CT):02d}:00",dtype=object)
+    exit_reason=np.full(len(trades),"CLOSE",dtype=object)
+    k=first["trade"].to_numpy(dtype=int)
+    exit_premium[k]=first["premium"].to_numpy(dtype=float)
+    exit_time[k]=first["time"].to_numpy()
+    exit_reason[k]=("TARGET: "+first["name"]).to_numpy()
+    
+    entry_premium=np.round(entry_premium,2)
+    exit_premium=np.round(exit_premium,2)
+    pnl=np.round((exit_premium-entry_premium)*100*contracts,2)
+    out=pd.DataFrame({
+        "date":trades["date"],"direction":trades["direction"],"strike":strike.astype(int),"entry_time":trades["entry_time"],
+        "entry_premium":entry_premium,"exit_time":exit_time,"exit_reason":exit_reason,"exit_premium":exit_premium,
+        "pnl":pnl,"pnl_pct":np.round((exit_premium-entry_premium)/entry_premium*100,0),"equity":np.round(np.cumsum(pnl),2)
+    })
+    out.attrs["legs"]=legs[["trade","name","level","time","premium"]]
+    return out
+
+def summarize_option_pnl(trades):
+    """Total/average $ P&L, win rate by premium and max drawdown of the equity curve"""
+    if trades.empty:
+        return {"trades":0,"total":0.0,"avg":0.0,"win_rate":0.0,"max_drawdown":0.0}
+    equity=trades["equity"].to_numpy(dtype=float)
+    return {
+        "trades":len(trades),
+        "total":round(float(equity[-1]),2),
+        "avg":round(float(trades["pnl"].mean()),2),
+        "win_rate":round(float((trades["pnl"]>0).mean()*100),1),
+        "max_drawdown":round(float(np.max(np.maximum.accumulate(np.maximum(equity,0))-equity)),2)
+    }
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# OUTCOME DISTRIBUTION - circular block bootstrap over the per-day results
+# ═══════════════════════════════════════════════════════════════════════════════
+def trade_points(results):
+    """
+    SPX points per results row for a trade that exits at its first target,
+    else at the day's final price (day_points() for a results frame).
+    0 for days without an entry.
+    """
+    points=np.zeros(len(results))
+    traded=results["outcome"].isin(["WIN","PARTIAL","LOSS"]).to_numpy() if len(results) else np.zeros(0,dtype=bool)
+    if not traded.any():
+        return points
+    trades=results[traded].reset_index(drop=True)
+    exit_spx=trades["final_price_spx"].to_numpy(dtype=float,copy=True)
+    first=_first_hits(_hit_target_legs(trades))
+    exit_spx[first["trade"].to_numpy(dtype=int)]=first["level"].to_numpy(dtype=float)
+    sign=np.where(trades["direction"]=="CALLS",1.0,-1.0)
+    points[traded]=np.round(sign*(exit_spx-trades["entry_price_spx"].to_numpy(dtype=float)),2)
+    return points
+
+def _block_bootstrap_indices(rng, n, n_resamples, block):
+    """(n_resamples, n) day indices: random block starts, wrapped around the end"""
+    starts=rng.integers(0,n,size=(n_resamples,-(-n//block)))
+    idx=(starts[:,:,None]+np.arange(block))%n
+    return idx.reshape(n_resamples,-1)[:,:n]
+
+def _max_drawdown_rows(pnl):
+    """Max drawdown of each row's cumulative P&L, measured from a flat start"""
+    equity=np.cumsum(pnl,axis=1)
+    peak=np.maximum.accumulate(np.maximum(equity,0),axis=1)
+    return (peak-equity).max(axis=1)
+
+def bootstrap_outcomes(results, pnl=None, n_resamples=20000, block=None, ci=0.95, seed=None, batch=2000):
+    """
+    Confidence intervals for win rate, expectancy and max drawdown
+    
+    Resamples whole days (non-trading days count as 0) in circular blocks of
+    `block` days so streaks survive the resampling; block defaults to ~n^(1/3).
+    pnl is one value per results row - e.g. backtest_option_pnl() P&L mapped
+    back by date - and defaults to trade_points(). All statistics are computed
+    for `batch` resamples at a time as array ops.
+    """
+    n=len(results)
+    traded=results["outcome"].isin(["WIN","PARTIAL","LOSS"]).to_numpy(dtype=float) if n else np.zeros(0)
+    if not traded.sum():
+        return None
+    wins=(results["outcome"]=="WIN").to_numpy(dtype=float)
+    pnl=trade_points(results) if pnl is None else np.nan_to_num(np.asarray(pnl,dtype=float))
+    block=max(1,min(n,int(round(n**(1/3))) if block is None else int(block)))
+    rng=np.random.default_rng(seed)
+    
+    win_rate,expectancy,drawdown=[],[],[]
+    for size in [batch]*(n_resamples//batch)+([n_resamples%batch] if n_resamples%batch else []):
+        idx=_block_bootstrap_indices(rng,n,size,block)
+        n_trades=traded[idx].sum(axis=1)
+        total=pnl[idx]
+        with np.errstate(invalid="ignore",divide="ignore"):
+            win_rate.append(wins[idx].sum(axis=1)/n_trades*100)
+            expectancy.append(total.sum(axis=1)/n_trades)
+        drawdown.append(_max_drawdown_rows(total))
+    
+    lo,hi=(1-ci)/2*100,(1+ci)/2*100
+    def interval(samples, point):
+        samples=np.concatenate(samples)
+        return {"point":round(float(point),2),"lo":round(float(np.nanpercentile(samples,lo)),2),
+                "hi":round(float(np.nanpercentile(samples,hi)),2),"std":round(float(np.nanstd(samples)),2)}
+    return {
+        "days":n,
+        "trades":int(traded.sum()),
+        "resamples":n_resamples,
+        "block":block,
+        "ci":ci,
+        "win_rate":interval(win_rate,wins.sum()/traded.sum()*100),
+        "expectancy":interval(expectancy,pnl.sum()/traded.sum()),
+        "max_drawdown":interval(drawdown,_max_drawdown_rows(pnl[None,:])[0])
+    }
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# WALK-FORWARD OPTIMIZER - fit on rolling in-sample windows, score out-of-sample
+# ═══════════════════════════════════════════════════════════════════════════════
+WF_GRID={
+    "slope":[0.44,0.46,0.48,0.50,0.52],
+    "break_threshold":[4.0,5.0,6.0,7.0,8.0],
+    "touch_tolerance":[1.0,2.0,3.0],
+    "setup_cutoff":["09:30","10:00","10:30"],  # entry-time slopes are only defined through 11:00
+}
+WF_DEFAULTS={"slope":SLOPE,"break_threshold":BREAK_THRESHOLD,"touch_tolerance":2.0,"setup_cutoff":"10:30"}
+
+def day_points(bars, scan, outcomes, targets_list, offset):
+    """
+    SPX points per day for a trade that exits at its first target, else at
+    the day's last close. 0 for days without an entry.
+    """
+    rows=np.arange(len(targets_list))
+    first_hit=outcomes["first_hit"]
+    entry=outcomes["entry_price"]
+    last=np.maximum((~np.isnan(bars["close"])).sum(axis=1)-1,0)
+    pts=direction_sign(scan["direction"])*(bars["close"][rows,last]-offset-entry)
+    if first_hit.shape[1]:
+        levels=np.full(first_hit.shape,np.nan)
+        for i,targets in enumerate(targets_list):
+            levels[i,:len(targets)]=[t["level"] for t in targets]
+        first_target=np.where(first_hit>=0,first_hit,np.iinfo(first_hit.dtype).max).argmin(axis=1)  # ties → target order
+        pts=np.where((first_hit>=0).any(axis=1),np.abs(levels[rows,first_target]-entry),pts)
+    return np.where(outcomes["entry_idx"]>=0,pts,0.0)
+
+def _wf_evaluate(args):
+    """
+    Process-pool task: every grid combo for a group of slopes, over all days
+    Per-day features (sessions, levels, validation) come from the stage cache,
+    and sessions are shared in memory across the group's slopes. Each
+    remaining combo is one batch scan + batch outcome over all days.
+    """
+    df,dates,slopes,grid,base,cache_dir=args
+    windows={d:day_candle_window(df,d) for d in dates}
+    sessions={}
+    combos,pnl,traded,won=[],[],[],[]
+    for slope in slopes:
+        keep,frames,levels,dirs,targets=[],[],[],[],[]
+        for i,d in enumerate(dates):
+            ctx=stage_context(windows[d],{**base,"slope":slope},cache_dir)
+            if d in sessions:
+                ctx["values"]["sessions"]=sessions[d]
+            v=run_stage("validation",d,ctx)
+            if "sessions" in ctx["values"]:
+                sessions[d]=ctx["values"]["sessions"]
+            if v is None or v["direction"]=="WAIT":
+                continue
+            keep.append(i)
+            frames.append(run_stage("sessions",d,ctx)["day_candles"])
+            levels.append(v["entry_edge_es"])
+            dirs.append(v["direction"])
+            targets.append(v["targets"])
+        bars=stack_day_candles(frames) if frames else None
+        
+        for bt,tt,cut in itertools.product(grid["break_threshold"],grid["touch_tolerance"],grid["setup_cutoff"]):
+            combos.append({"slope":slope,"break_threshold":bt,"touch_tolerance":tt,"setup_cutoff":cut})
+            day_pnl=np.zeros(len(dates))
+            day_traded=np.zeros(len(dates),dtype=bool)
+            day_won=np.zeros(len(dates),dtype=bool)
+            if bars is not None:
+                scan=batch_find_entry_confirmation(bars,levels,dirs,base["offset"],bt,"08:00",slope,tt,cut)
+                out=batch_analyze_outcomes(bars,scan,levels,targets,base["offset"],slope,base["partial_threshold"])
+                day_pnl[keep]=day_points(bars,scan,out,targets,base["offset"])
+                day_traded[keep]=out["entry_idx"]>=0
+                day_won[keep]=out["outcome"]=="WIN"
+            pnl.append(day_pnl)
+            traded.append(day_traded)
+            won.append(day_won)
+    return combos,np.array(pnl),np.array(traded),np.array(won)
+
+def walk_forward(es_candles, start_date, end_date, train_days=120, test_days=20, grid=None, offset=18.0,
+                 ref_hr=9, ref_mn=0, partial_threshold=10, min_trades=10, workers=None, cache_dir=BACKTEST_CACHE_DIR):
+    """
+    Walk-forward optimization of slope, break threshold, touch tolerance and setup cutoff
+    
+    1. Every grid combo is scored on every day once (SPX points: first target,
+       else day close - see day_points). Slopes are spread over a process
+       pool; per-day features come from the backtest stage cache.
+    2. Folds slide over the (combo × day) matrices with cumulative sums:
+       pick the best mean points/day on train_days (at least min_trades
+       trades), then score it on the next test_days out-of-sample.
+    
+    partial_threshold only relabels PARTIAL vs LOSS and never moves points,
+    so it is passed through rather than fitted.
+    Returns {"folds": DataFrame, "stability": dict, "summary": dict}.
+    """
+    grid=grid or WF_GRID
+    df=candles_to_ct(es_candles)
+    have=set(df.index[(df.index.hour>=8)&(df.index.hour<15)].date)
+    dates=[d.date() for d in pd.bdate_range(start_date,end_date) if d.date() in have]
+    if len(dates)<=train_days:
+        raise ValueError(f"Need more than {train_days} trading days, got {len(dates)}")
+    
+    base={"offset":offset,"ref_hr":ref_hr,"ref_mn":ref_mn,"break_threshold":BREAK_THRESHOLD,
+          "touch_tolerance":2.0,"setup_cutoff":"10:30","partial_threshold":partial_threshold}
+    workers=max(1,min(workers or os.cpu_count() or 1,len(grid["slope"])))
+    groups=[list(g) for g in np.array_split(np.array(grid["slope"],dtype=float),workers) if len(g)]
+    tasks=[(df,dates,g,grid,base,cache_dir) for g in groups]
+    if workers==1:
+        parts=[_wf_evaluate(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts=list(pool.map(_wf_evaluate,tasks))
+    combos=[c for p in parts for c in p[0]]
+    pnl=np.vstack([p[1] for p in parts])
+    traded=np.vstack([p[2] for p in parts])
+    won=np.vstack([p[3] for p in parts])
+    
+    cum_pnl=np.concatenate([np.zeros((len(combos),1)),np.cumsum(pnl,axis=1)],axis=1)
+    cum_trades=np.concatenate([np.zeros((len(combos),1)),np.cumsum(traded,axis=1)],axis=1)
+    default=next((i for i,c in enumerate(combos) if c==WF_DEFAULTS),None)
+    
+    folds=[]
+    for t0 in range(train_days,len(dates),test_days):
+        t1=min(t0+test_days,len(dates))
+        is_pnl=(cum_pnl[:,t0]-cum_pnl[:,t0-train_days])/train_days
+        is_trades=cum_trades[:,t0]-cum_trades[:,t0-train_days]
+        score=np.where(is_trades>=min_trades,is_pnl,-np.inf)
+        if not np.isfinite(score).any():
+            continue
+        best=int(np.argmax(score))
+        n_trades=int(traded[best,t0:t1].sum())
+        folds.append({
+            "train_start":dates[t0-train_days],"test_start":dates[t0],"test_end":dates[t1-1],
+            **combos[best],
+            "is_pts_per_day":round(float(is_pnl[best]),3),
+            "oos_pts":round(float(pnl[best,t0:t1].sum()),2),
+            "oos_trades":n_trades,
+            "oos_win_rate":round(float(won[best,t0:t1].sum())/n_trades*100,1) if n_trades else 0.0,
+            "default_oos_pts":round(float(pnl[default,t0:t1].sum()),2) if default is not None else None
+        })
+    folds=pd.DataFrame(folds)
+    summary={
+        "days":len(dates),"combos":len(combos),"folds":len(folds),
+        "oos_pts":round(float(folds["oos_pts"].sum()),2) if len(folds) else 0.0,
+        "default_oos_pts":round(float(folds["default_oos_pts"].sum()),2) if len(folds) and default is not None else None
+    }
+    return {"folds":folds,"stability":parameter_stability(folds,grid),"summary":summary}
+
+def parameter_stability(folds, grid):
+    """Per parameter: modal choice, share of folds that picked it, fold-to-fold switches, range"""
+    report={}
+    if folds.empty:
+        return report
+    for name in grid:
+        chosen=folds[name]
+        counts=chosen.value_counts()
+        entry={"mode":counts.index[0],"mode_share":round(counts.iloc[0]/len(chosen),2),
+               "switches":int((chosen!=chosen.shift()).sum()-1)}
+        if pd.api.types.is_numeric_dtype(chosen):
+            entry.update({"min":float(chosen.min()),"max":float(chosen.max()),"std":round(float(chosen.std(ddof=0)),3)})
+        report[name]=entry
+    return report
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# RESULTS STORE - SQLite, one row per (date, parameter set, strategy version)
+# ═══════════════════════════════════════════════════════════════════════════════
+RESULTS_COLUMNS=["trade_date","param_hash","strategy_version","params_json","channel_type","vix_zone",
+                 "validation_status","direction","outcome","entry_time","entry_level_spx","max_favorable",
+                 "max_adverse","targets_hit","targets_total","targets_json","message","updated_at"]
+RESULTS_GROUPS=["channel_type","vix_zone","validation_status","direction","outcome"]
+TRADED_OUTCOMES="('WIN','PARTIAL','LOSS')"
+
+def open_results_db(path=RESULTS_DB):
+    """Connection with the results table and its indexes in place"""
+    con=sqlite3.connect(path,timeout=30)
+    con.executescript("""
+        CREATE TABLE IF NOT EXISTS results(
+            trade_date TEXT NOT NULL,
+            param_hash TEXT NOT NULL,
+            strategy_version TEXT NOT NULL,
+            params_json TEXT,
+            channel_type TEXT,
+            vix_zone TEXT,
+            validation_status TEXT,
+            direction TEXT,
+            outcome TEXT,
+            entry_time TEXT,
+            entry_level_spx REAL,
+            max_favorable REAL,
+            max_adverse REAL,
+            targets_hit INTEGER,
+            targets_total INTEGER,
+            targets_json TEXT,
+            message TEXT,
+            updated_at TEXT,
+            PRIMARY KEY(trade_date,param_hash,strategy_version)
+        );
+        CREATE INDEX IF NOT EXISTS idx_results_date ON results(trade_date);
+        CREATE INDEX IF NOT EXISTS idx_results_channel ON results(channel_type);
+        CREATE INDEX IF NOT EXISTS idx_results_vix ON results(vix_zone);
+        CREATE INDEX IF NOT EXISTS idx_results_validation ON results(validation_status);
+        CREATE INDEX IF NOT EXISTS idx_results_outcome ON results(outcome);
+    """)
+    return con
+
+def params_hash(params):
+    """Stable short hash of a parameter dict"""
+    return hashlib.sha1(json.dumps(params,sort_keys=True,default=str).encode()).hexdigest()[:16]
+
+def save_results(rows, params, path=RESULTS_DB, strategy_version=STRATEGY_VERSION):
+    """
+    Upsert per-day result rows (backtest_day() / outcome_result_row() format)
+    One transaction, one executemany; INSERT OR REPLACE on the primary key
+    makes re-running the same dates with the same params idempotent. Rows
+    identical to the stored ones are skipped, so the file (and everything
+    cached on its mtime) only changes when a result does. Returns rows written.
+    """
+    key=params_hash(params)
+    params_json=json.dumps(params,sort_keys=True,default=str)
+    now=datetime.now().isoformat(timespec="seconds")
+    records=[]
+    for row in rows:
+        targets_json=row.get("targets_json")
+        records.append((
+            str(row["date"]),key,strategy_version,params_json,row.get("channel_type"),row.get("vix_zone"),
+            row.get("validation"),row.get("direction"),row.get("outcome"),row.get("entry_time"),
+            row.get("entry_price_spx"),row.get("max_favorable"),row.get("max_adverse"),
+            row.get("targets_hit"),len(json.loads(targets_json)) if targets_json else 0,targets_json,
+            row.get("message"),now
+        ))
+    con=open_results_db(path)
+    try:
+        stored={r[0]:r for r in con.execute(f"SELECT {','.join(RESULTS_COLUMNS[:-1])} FROM results WHERE param_hash=? AND strategy_version=?",
+                                            (key,strategy_version))}
+        records=[r for r in records if stored.get(r[0])!=r[:-1]]
+        if not records:
+            return 0
+        with con:
+            con.executemany(f"INSERT OR REPLACE INTO results ({','.join(RESULTS_COLUMNS)}) VALUES ({','.join('?'*len(RESULTS_COLUMNS))})",records)
+    finally:
+        con.close()
+    return len(records)
+
+def _results_where(param_hash=None, start_date=None, end_date=None, strategy_version=None):
+    clauses,args=[],[]
+    for column,op,value in [("param_hash","=",param_hash),("trade_date",">=",start_date),
+                            ("trade_date","<=",end_date),("strategy_version","=",strategy_version)]:
+        if value is not None:
+            clauses.append(f"{column} {op} ?")
+            args.append(str(value))
+    return (" WHERE "+" AND ".join(clauses) if clauses else ""),args
+
+def query_result_aggregates(group_by=None, param_hash=None, start_date=None, end_date=None,
+                            strategy_version=None, path=RESULTS_DB):
+    """
+    Win rate, average max favorable/adverse (traded days) and target hit rate,
+    overall or per RESULTS_GROUPS column. Runs on the indexes - no recompute.
+    """
+    if group_by is not None and group_by not in RESULTS_GROUPS:
+        raise ValueError(f"group_by must be one of {RESULTS_GROUPS}")
+    where,args=_results_where(param_hash,start_date,end_date,strategy_version)
+    group=group_by or "'ALL'"
+    sql=f"""
+        SELECT {group} AS grp,
+               COUNT(*) AS days,
+               SUM(outcome IN {TRADED_OUTCOMES}) AS trades,
+               SUM(outcome='WIN') AS wins,
+               ROUND(100.0*SUM(outcome='WIN')/NULLIF(SUM(outcome IN {TRADED_OUTCOMES}),0),1) AS win_rate,
+               ROUND(AVG(CASE WHEN outcome IN {TRADED_OUTCOMES} THEN max_favorable END),2) AS avg_favorable,
+               ROUND(AVG(CASE WHEN outcome IN {TRADED_OUTCOMES} THEN max_adverse END),2) AS avg_adverse,
+               ROUND(100.0*SUM(CASE WHEN outcome IN {TRADED_OUTCOMES} THEN targets_hit END)
+                     /NULLIF(SUM(CASE WHEN outcome IN {TRADED_OUTCOMES} THEN targets_total END),0),1) AS target_hit_rate
+        FROM results{where}
+        GROUP BY grp ORDER BY days DESC"""
+    con=open_results_db(path)
+    try:
+        return pd.read_sql_query(sql,con,params=args)
+    finally:
+        con.close()
+
+def query_target_hit_rates(param_hash=None, start_date=None, end_date=None, strategy_version=None, path=RESULTS_DB):
+    """Per target name (e.g. "CLOSE Desc"): how often it was offered on a traded day and how often it was hit"""
+    where,args=_results_where(param_hash,start_date,end_date,strategy_version)
+    where=(where+" AND " if where else " WHERE ")+f"outcome IN {TRADED_OUTCOMES}"
+    sql=f"""
+        SELECT json_extract(t.value,'$.name') AS target,
+               COUNT(*) AS offered,
+               SUM(json_extract(t.value,'$.hit')) AS hits,
+               ROUND(100.0*SUM(json_extract(t.value,'$.hit'))/COUNT(*),1) AS hit_rate
+        FROM results, json_each(results.targets_json) AS t{where}
+        GROUP BY target ORDER BY offered DESC"""
+    con=open_results_db(path)
+    try:
+        return pd.read_sql_query(sql,con,params=args)
+    finally:
+        con.close()
+
+def _target_json(target, hit=None):
+    """targets_json entry; resolution is the bar the hit time is stamped with (e.g. "30m", "1m")"""
+    return {"name":target["name"],"level":float(target["level"]),"hit":hit is not None,
+            "time":hit["time"] if hit else None,"resolution":hit.get("resolution","30m") if hit else None}
+
+def outcome_result_row(trade_date, outcome, validation, channel_type, targets, vix_zone=None):
+    """The app's historical outcome in the same row format as backtest_day()"""
+    entry_conf=outcome.get("entry_confirmation") or {}
+    hit={t["name"]:t for t in outcome.get("targets_hit",[])}
+    return {
+        "date":trade_date,
+        "outcome":outcome["outcome"],
+        "channel_type":channel_type,
+        "vix_zone":vix_zone,
+        "validation":validation["status"],
+        "direction":outcome.get("direction"),
+        "entry_time":entry_conf.get("entry_time") if entry_conf.get("confirmed") else None,
+        "entry_price_spx":outcome.get("entry_level_at_time"),
+        "max_favorable":round(float(outcome.get("max_favorable",0)),2),
+        "max_adverse":round(float(outcome.get("max_adverse",0)),2),
+        "targets_hit":len(hit),
+        "targets_json":json.dumps([_target_json(t,hit.get(t["name"])) for t in targets]),
+        "message":outcome.get("message")
+    }
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# HIT-TIME MODEL - how long targets took to hit, by distance, from the results store
+# ═══════════════════════════════════════════════════════════════════════════════
+# Hits are timed from the entry bar's close to the middle of the bar the hit is
+# stamped with: ±15 min for 30m bars, much less for intrabar-resolved hits.
+# Misses are left out: these are times given a hit.
+HIT_TIME_DISTANCES=(0,10,20,30,45,70)  # bucket lower edges, SPX pts from the entry
+HIT_TIME_QUANTILES=np.linspace(0.1,0.9,9)
+HIT_TIME_MIN_HITS=5
+
+def _clock_hours(hhmm):
+    t=pd.to_datetime(pd.Series(hhmm,dtype=object),format="%H:%M")
+    return (t.dt.hour+t.dt.minute/60).to_numpy(dtype=float)
+
+def load_target_hits(param_hash=None, strategy_version=None, path=RESULTS_DB):
+    """One row per target offered on a traded day: distance, hit, hours to the hit (NaN if missed)"""
+    where,args=_results_where(param_hash,None,None,strategy_version)
+    where=(where+" AND " if where else " WHERE ")+f"outcome IN {TRADED_OUTCOMES} AND entry_time IS NOT NULL"
+    sql=f"""
+        SELECT entry_time, entry_level_spx,
+               json_extract(t.value,'$.level') AS level,
+               json_extract(t.value,'$.hit') AS hit,
+               json_extract(t.value,'$.time') AS hit_time,
+               json_extract(t.value,'$.resolution') AS resolution
+        FROM results, json_each(results.targets_json) AS t{where}"""
+    con=open_results_db(path)
+    try:
+        rows=pd.read_sql_query(sql,con,params=args)
+    finally:
+        con.close()
+    rows=rows.dropna(subset=["entry_level_spx","level"])
+    hours=np.full(len(rows),np.nan)
+    hit=rows["hit"].fillna(0).astype(bool).to_numpy()&rows["hit_time"].notna().to_numpy()
+    if hit.any():
+        # Rows stored before resolution was recorded are 30m bar stamps
+        bar_minutes=rows["resolution"][hit].fillna("30m").str.extract(r"(\d+)m",expand=False).astype(float).fillna(30).to_numpy()
+        hours[hit]=np.maximum(_clock_hours(rows["hit_time"][hit])+bar_minutes/120-(_clock_hours(rows["entry_time"][hit])+0.5),0.1)
+    return pd.DataFrame({"distance":(rows["level"]-rows["entry_level_spx"]).abs().to_numpy(),"hit":hit,"hours":hours})
+
+def fit_hit_times(hits):
+    """Per distance bucket: offered, hit rate and the HIT_TIME_QUANTILES of hours to the hit"""
+    bucket=np.searchsorted(HIT_TIME_DISTANCES,hits["distance"].to_numpy(),side="right")-1
+    buckets=[]
+    for b,lo in enumerate(HIT_TIME_DISTANCES):
+        rows=hits[bucket==b]
+        times=rows["hours"].dropna().to_numpy()
+        buckets.append({
+            "lo":lo,"hi":HIT_TIME_DISTANCES[b+1] if b+1<len(HIT_TIME_DISTANCES) else None,
+            "offered":len(rows),"hits":len(times),
+            "hit_rate":round(len(times)/len(rows),4) if len(rows) else None,
+            "quantiles":np.quantile(times,HIT_TIME_QUANTILES).round(3).tolist() if len(times)>=HIT_TIME_MIN_HITS else None
+        })
+    return {"buckets":buckets}
+
+@st.cache_data(show_spinner=False)
+def _hit_time_model(path, mtime, param_hash, strategy_version):
+    return fit_hit_times(load_target_hits(param_hash,strategy_version,path))
+
+def hit_time_model(param_hash=None, strategy_version=STRATEGY_VERSION, path=RESULTS_DB):
+    """
+    fit_hit_times() over the stored results of one parameter set (param_hash,
+    None = all), refit only when the database changes; None without one
+    """
+    try:
+        return _hit_time_model(path,os.path.getmtime(path),param_hash,strategy_version)
+    except (OSError,sqlite3.Error):
+        return None
+
+def hit_time_quantiles(model, distances):
+    """Hours-to-hit quantiles for each distance, shape (len(distances), len(HIT_TIME_QUANTILES)); NaN rows where the bucket has too few hits"""
+    table=np.array([b["quantiles"] or [np.nan]*len(HIT_TIME_QUANTILES) for b in model["buckets"]],dtype=float)
+    bucket=np.searchsorted(HIT_TIME_DISTANCES,np.asarray(distances,dtype=float),side="right")-1
+    return table[np.clip(bucket,0,len(table)-1)]
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# REPLAY - a past day through the live setup machine, one closed bar at a time
+# ═══════════════════════════════════════════════════════════════════════════════
+def replay_day(es_candles, trading_date, offset=18.0, ref_hr=9, ref_mn=0, vix=16.0, speed=None, flow=None,
+               slope=None, break_threshold=None, subscriber=None):
+    """
+    Generator: trading_date's 30m ES bars through the 15:00 close, pushed one by one into on_bar_close(),
+    the live path feed_closed_bars() uses, yielding a step per bar:
+    {"time","candle","events","state","confidence","flow","machine","elapsed_ms"}
+    
+    Levels come from the prior sessions only, as in backtest_day(). Only the
+    new bar is processed per step; the machine carries everything else.
+    speed = bars per second (None = as fast as possible, for load tests).
+    flow defaults to one calculate_flow_bias() off the day's 8:00 open, as of the day.
+    """
+    df=day_candle_window(candles_to_ct(es_candles),trading_date)
+    hist_data=extract_historical_data(df,trading_date,offset)
+    levels=_stage_levels(trading_date,{"sessions":hist_data},{"offset":offset,"ref_hr":ref_hr,"ref_mn":ref_mn,
+                                                             "slope":SLOPE if slope is None else slope})
+    if levels is None:
+        return
+    ref_time=CT.localize(datetime.combine(trading_date,time(ref_hr,ref_mn)))
+    machine=new_setup_machine(trading_date,levels["ceiling_es"],levels["floor_es"],levels["channel_type"],levels["cones_spx"],
+                              offset,ref_time,slope,break_threshold)
+    if subscriber:
+        subscribe_setup_machine(machine,subscriber)
+    
+    start=df.index.searchsorted(CT.localize(datetime.combine(trading_date,time(0,0))))
+    end=df.index.searchsorted(CT.localize(datetime.combine(trading_date,time(15,0))),side="right")
+    if flow is None:
+        first=df.index.searchsorted(CT.localize(datetime.combine(trading_date,time(8,0))))
+        flow_price=float(df["Open"].iloc[min(first,len(df)-1)])
+        flow=calculate_flow_bias(flow_price,hist_data["on_high"],hist_data["on_low"],vix,vix,vix,hist_data["prior_close"],as_of=trading_date)
+    vix_zone=get_vix_zone(vix)
+    ohlc=df[["Open","High","Low","Close"]].to_numpy(dtype=float)
+    indicators=seed_indicator_engine(df.iloc[:start])
+    
+    for k in range(start,end):
+        t0=time_module.perf_counter()
+        bar_time=df.index[k]
+        candle={"open":ohlc[k,0],"high":ohlc[k,1],"low":ohlc[k,2],"close":ohlc[k,3]}
+        events=on_bar_close(machine,bar_time,candle)
+        ema_signals=engine_ema_signals(indicator_step(indicators,candle["close"],bar_time),candle["close"])
+        confidence=calculate_confidence(levels["channel_type"],machine["validation"] or {"status":"AWAITING"},
+                                        machine["direction"] or "WAIT",ema_signals,flow,vix_zone)
+        elapsed=time_module.perf_counter()-t0
+        yield {"time":bar_time,"candle":candle,"events":events,"state":machine["state"],"confidence":confidence,
+               "flow":flow,"machine":machine,"elapsed_ms":round(elapsed*1000,3)}
+        if speed:
+            time_module.sleep(max(0.0,1.0/speed-(time_module.perf_counter()-t0)))
+
+def run_cli(argv):
+    """Headless entry point: python APPA.py backtest --start 2024-01-02 --end 2024-12-31 [--csv es_30m.csv]"""
+    parser=argparse.ArgumentParser(prog="APPA.py")
+    sub=parser.add_subparsers(dest="command",required=True)
+    bt=sub.add_parser("backtest",help="Run the structural strategy over a date range")
+    bt.add_argument("--start",required=True,type=date.fromisoformat)
+    bt.add_argument("--end",required=True,type=date.fromisoformat)
+    bt.add_argument("--csv",help="30m ES candles CSV (default: fetch from Yahoo, ~60 days back max)")
+    bt.add_argument("--offset",type=float,default=18.0)
+    bt.add_argument("--ref",default="09:00",help="Reference time HH:MM CT")
+    bt.add_argument("--workers",type=int,default=None)
+    bt.add_argument("--slope",type=float,default=SLOPE)
+    bt.add_argument("--break-threshold",type=float,default=BREAK_THRESHOLD)
+    bt.add_argument("--cache",default=BACKTEST_CACHE_DIR,help="Stage cache directory ('' to disable)")
+    bt.add_argument("--out",default="backtest_results.csv")
+    bt.add_argument("--db",default=RESULTS_DB,help="Results database ('' to skip)")
+    bt.add_argument("--vix",type=float,default=16.0,help="VIX used to price the option P&L")
+    bt.add_argument("--options-out",default="backtest_options.csv")
+    bt.add_argument("--resamples",type=int,default=20000,help="Block-bootstrap resamples for the confidence intervals (0 to skip)")
+    bt.add_argument("--block",type=int,default=None,help="Bootstrap block length in days (default ~n^(1/3))")
+    rp=sub.add_parser("replay",help="Replay a past day bar by bar through the live setup machine")
+    rp.add_argument("--date",required=True,type=date.fromisoformat)
+    rp.add_argument("--csv",help="30m ES candles CSV (default: fetch from Yahoo, ~60 days back max)")
+    rp.add_argument("--offset",type=float,default=18.0)
+    rp.add_argument("--ref",default="09:00",help="Reference time HH:MM CT")
+    rp.add_argument("--vix",type=float,default=16.0)
+    rp.add_argument("--speed",type=float,default=None,help="Bars per second (default: as fast as possible)")
+    rp.add_argument("--repeat",type=int,default=1,help="Replay the day N times (load test)")
+    ff=sub.add_parser("flow-features",help="Build/extend the historical flow feature table")
+    ff.add_argument("--start",type=date.fromisoformat,default=date(2020,1,1))
+    ff.add_argument("--end",type=date.fromisoformat,default=None)
+    ff.add_argument("--out",default=FLOW_FEATURES_FILE)
+    bp=sub.add_parser("bench-pricing",help="Throughput/accuracy of the normal CDF and Black-Scholes kernels")
+    bp.add_argument("--n",type=int,default=1_000_000,help="CDF evaluation points")
+    iv=sub.add_parser("calibrate-iv",help="Fit the 0DTE IV/VIX multipliers from an option quote snapshot")
+    iv.add_argument("--quotes",required=True,help="Quote snapshot CSV (spot, strike, type, bid/ask or mid, hours or time, vix)")
+    iv.add_argument("--vix",type=float,default=None,help="VIX for every quote (default: the file's vix column)")
+    sh=sub.add_parser("seed-history",help="Backfill the local 30m ES history store the indicators warm up from")
+    sh.add_argument("--csv",help="30m ES candles CSV (default: fetch the last --days from Yahoo)")
+    sh.add_argument("--days",type=int,default=59,help="Days to fetch without --csv (Yahoo keeps ~60 days of 30m bars)")
+    sh.add_argument("--offset",type=float,default=18.0)
+    sh.add_argument("--out",default=ES_HISTORY_FILE)
+    opt=sub.add_parser("optimize",help="Walk-forward parameter optimization")
+    opt.add_argument("--start",required=True,type=date.fromisoformat)
+    opt.add_argument("--end",required=True,type=date.fromisoformat)
+    opt.add_argument("--csv",help="30m ES candles CSV (default: fetch from Yahoo, ~60 days back max)")
+    opt.add_argument("--offset",type=float,default=18.0)
+    opt.add_argument("--ref",default="09:00",help="Reference time HH:MM CT")
+    opt.add_argument("--train",type=int,default=120,help="In-sample trading days per fold")
+    opt.add_argument("--test",type=int,default=20,help="Out-of-sample trading days per fold")
+    opt.add_argument("--min-trades",type=int,default=10)
+    opt.add_argument("--workers",type=int,default=None)
+    opt.add_argument("--cache",default=BACKTEST_CACHE_DIR,help="Stage cache directory ('' to disable)")
+    opt.add_argument("--out",default="walk_forward_folds.csv")
+    args=parser.parse_args(argv)
+    
+    if args.command=="backtest":
+        if args.csv:
+            es_candles=load_es_candles_csv(args.csv)
+        else:
+            es_candles=fetch_es_candles_range(args.start-timedelta(days=7),args.end,"30m",args.offset)
+        if es_candles is None or es_candles.empty:
+            print("No ES candles available for that range")
+            return 1
+        ref_hr,ref_mn=[int(x) for x in args.ref.split(":")]
+        t0=time_module.perf_counter()
+        results=run_backtest(es_candles,args.start,args.end,args.offset,ref_hr,ref_mn,args.workers,
+                             args.slope,args.break_threshold,args.cache or None)
+        results.to_csv(args.out,index=False)
+        if args.db:
+            params={"offset":args.offset,"ref_hr":ref_hr,"ref_mn":ref_mn,"slope":args.slope,"break_threshold":args.break_threshold,
+                    "touch_tolerance":2.0,"setup_cutoff":"10:30","partial_threshold":10}
+            saved=save_results(results.replace({np.nan:None}).to_dict("records"),params,args.db)
+            print(f"Saved {saved} rows to {args.db} (params {params_hash(params)})")
+        summary=summarize_backtest(results)
+        print(f"{summary['days']} days in {time_module.perf_counter()-t0:.1f}s → {args.out}")
+        print(f"Outcomes: {summary['counts']} | Win rate {summary['win_rate']}% of {summary['trades']} trades")
+        if results.attrs.get("stage_runs"):
+            print("Stages: "+", ".join(f"{k} {n}" for k,n in sorted(results.attrs["stage_runs"].items())))
+        options=backtest_option_pnl(results,args.vix)
+        options.to_csv(args.options_out,index=False)
+        opt_summary=summarize_option_pnl(options)
+        print(f"Options (VIX {args.vix:g}, 1 contract): {opt_summary['trades']} trades, total ${opt_summary['total']:,.2f}, "
+              f"avg ${opt_summary['avg']:,.2f}, {opt_summary['win_rate']}% green, max drawdown ${opt_summary['max_drawdown']:,.2f} → {args.options_out}")
+        if args.resamples:
+            day_pnl=results["date"].map(options.set_index("date")["pnl"]).fillna(0).to_numpy() if len(options) else None
+            for label,pnl,unit in [("Points",None,"pts"),("Options",day_pnl,"$")]:
+                boot=bootstrap_outcomes(results,pnl,args.resamples,args.block)
+                if boot is None:
+                    break
+                print(f"{label} {boot['ci']:.0%} CI ({boot['resamples']:,} resamples, {boot['block']}-day blocks): "
+                      +" | ".join(f"{k.replace('_',' ')} {boot[k]['point']:g}{'%' if k=='win_rate' else ' '+unit} [{boot[k]['lo']:g}, {boot[k]['hi']:g}]"
+                                  for k in ["win_rate","expectancy","max_drawdown"]))
+    
+    if args.command=="replay":
+        if args.csv:
+            es_candles=load_es_candles_csv(args.csv)
+        else:
+            es_candles=fetch_es_candles_range(args.date-timedelta(days=7),args.date,"30m",args.offset)
+        if es_candles is None or es_candles.empty:
+            print("No ES candles available for that date")
+            return 1
+        ref_hr,ref_mn=[int(x) for x in args.ref.split(":")]
+        flow=None
+        bars,t0=0,time_module.perf_counter()
+        for n in range(args.repeat):
+            for step in replay_day(es_candles,args.date,args.offset,ref_hr,ref_mn,args.vix,args.speed,flow):
+                flow=step["flow"]  # fetched once, reused by the repeats
+                bars+=1
+                if n==0:
+                    for e in step["events"]:
+                        print(f"{e['time']}  {e['type']:<16} {e.get('message',e.get('name',''))}")
+        if not bars:
+            print(f"No levels for {args.date} (missing overnight/prior session data)")
+            return 1
+        elapsed=time_module.perf_counter()-t0
+        print(f"Final state {step['state']} · confidence {step['confidence']['score']} · "
+              f"{bars} bars in {elapsed:.2f}s ({bars/elapsed:,.0f} bars/s)")
+    
+    if args.command=="flow-features":
+        features=build_flow_features(args.start,args.end,args.out)
+        if features is None or features.empty:
+            print("No flow history downloaded")
+            return 1
+        print(f"{len(features)} sessions {features.index[0].date()} → {features.index[-1].date()} in {args.out}")
+    
+    if args.command=="bench-pricing":
+        bench=benchmark_pricing(args.n)
+        with pd.option_context("display.width",160,"display.float_format","{:.3g}".format):
+            print(bench.to_string(index=False))
+        bs_err=bench["max_abs_err"].iloc[-1]
+        print(f"black_scholes_array within {PRICING_TOL:g} of black_scholes: {'yes' if bs_err<=PRICING_TOL else 'NO'}")
+        if bs_err>PRICING_TOL:
+            return 1
+    
+    if args.command=="calibrate-iv":
+        try:
+            cal,solved=calibrate_iv(pd.read_csv(args.quotes),args.vix)
+        except (OSError,ValueError,KeyError) as e:
+            print(f"Cannot calibrate from {args.quotes}: {e}")
+            return 1
+        if not cal["buckets"]:
+            print(f"No usable quotes in {args.quotes} ({cal['quotes']} after filtering, {cal['solved']} solved)")
+            return 1
+        save_iv_calibration(cal)
+        print(f"{cal['solved']}/{cal['quotes']} quotes solved → {IV_CALIBRATION_FILE}")
+        for b in cal["buckets"]:
+            smile=f"smile {b['smile'][0]:.3f} {b['smile'][1]:+.2f}k {b['smile'][2]:+.1f}k² (rmse {b['rmse']})" if b["smile"] else "no smile"
+            print(f"  {b['hours_lo']}-{b['hours_hi']}h: ×{b['multiplier']:.3f} from {b['quotes']} quotes, {smile}")
+    
+    if args.command=="seed-history":
+        if args.csv:
+            es_candles=load_es_candles_csv(args.csv)
+        else:
+            today=now_ct().date()
+            es_candles=fetch_es_candles_range(today-timedelta(days=args.days),today,"30m",args.offset)
+        if es_candles is None or es_candles.empty:
+            print("No ES candles available to seed from")
+            return 1
+        history=seed_es_history(es_candles,args.out)
+        if history is None:
+            print("No closed bars to seed from")
+            return 1
+        print(f"{len(history)} bars {history.index[0]:%Y-%m-%d %H:%M} → {history.index[-1]:%Y-%m-%d %H:%M} in {args.out}")
+    
+    if args.command=="optimize":
+        if args.csv:
+            es_candles=load_es_candles_csv(args.csv)
+        else:
+            es_candles=fetch_es_candles_range(args.start-timedelta(days=7),args.end,"30m",args.offset)
+        if es_candles is None or es_candles.empty:
+            print("No ES candles available for that range")
+            return 1
+        ref_hr,ref_mn=[int(x) for x in args.ref.split(":")]
+        t0=time_module.perf_counter()
+        wf=walk_forward(es_candles,args.start,args.end,args.train,args.test,offset=args.offset,ref_hr=ref_hr,ref_mn=ref_mn,
+                        min_trades=args.min_trades,workers=args.workers,cache_dir=args.cache or None)
+        wf["folds"].to_csv(args.out,index=False)
+        summary=wf["summary"]
+        print(f"{summary['days']} days × {summary['combos']} combos, {summary['folds']} folds in {time_module.perf_counter()-t0:.1f}s → {args.out}")
+        print(f"Out-of-sample: {summary['oos_pts']} pts (defaults: {summary['default_oos_pts']} pts)")
+        for name,entry in wf["stability"].items():
+            print(f"  {name}: {entry['mode']} in {entry['mode_share']*100:.0f}% of folds, {entry['switches']} switches"
+                  +(f", range {entry['min']:g}-{entry['max']:g}" if "min" in entry else ""))
+    return 0
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # SIDEBAR
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -3253,6 +6091,9 @@ def render_sidebar():
         # ─────────────────────────────────────────────────────────────────────
         auto_refresh=st.checkbox("🔄 Auto Refresh (30s)",value=False) if not (is_historical or is_planning) else False
         debug=st.checkbox("🔧 Debug Mode",value=False)
+        intrabar=st.checkbox("🔬 Intrabar Resolution",value=False,
+                             help=f"Order target hits vs adverse moves inside 30m candles using 1m/5m bars ({INTRABAR_DIR}/ or Yahoo)") if is_historical else False
+        adverse_limit=st.number_input("🛑 Stop (SPX pts, 0 = off)",value=0.0,min_value=0.0,step=1.0) if intrabar else 0.0
         
         col1, col2 = st.columns(2)
         with col1:
@@ -3298,7 +6139,8 @@ def render_sidebar():
         "prior_close_time":(prior_close_hr,prior_close_mn) if override_prior else None,
         # Other
         "ref_hr":ref_hr,"ref_mn":ref_mn,
-        "auto_refresh":auto_refresh,"debug":debug
+        "auto_refresh":auto_refresh,"debug":debug,
+        "intrabar":intrabar,"adverse_limit":adverse_limit or None
     }
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -3790,15 +6632,24 @@ def main():
     else:
         flow_price = current_es
     
-    flow=calculate_flow_bias(flow_price,on_high,on_low,vix,vix_high,vix_low,prior_close)
+    flow=calculate_flow_bias(flow_price,on_high,on_low,vix,vix_high,vix_low,prior_close,
+                             as_of=inputs["trading_date"] if inputs["is_historical"] or inputs["is_planning"] else None)
     
     # Debug: Show what prior_close is being used for gap (only if debug enabled)
     if inputs.get("debug") and inputs.get("is_planning"):
         gap_used = flow_price - prior_close if prior_close else 0
         st.caption(f"💡 Flow Calc: flow_price={flow_price:.1f}, prior_close={prior_close:.1f}, GAP = {gap_used:+.1f} pts")
     
-    momentum=calculate_momentum(es_candles)
-    ema_signals=calculate_ema_signals(es_candles,current_es)
+    # Indicators advance only by the bars that arrived since the last rerun; live
+    # mode resumes the saved state and warms up from the local 30m history
+    live_mode=not inputs["is_historical"] and not inputs["is_planning"]
+    indicator_engine=st.session_state.get("indicator_engine") or (load_indicator_engine() if live_mode else None)
+    indicator_engine=sync_indicator_engine(indicator_engine,es_candles,ES_HISTORY_FILE,persist=live_mode)
+    st.session_state["indicator_engine"]=indicator_engine
+    mtf_cache=sync_mtf_cache(st.session_state.get("mtf_cache"),es_candles,indicator_engine,ES_HISTORY_FILE)
+    st.session_state["mtf_cache"]=mtf_cache
+    momentum=engine_momentum(indicator_engine)
+    ema_signals=engine_ema_signals(indicator_engine,current_es)
     vix_zone=get_vix_zone(vix)
     
     # ─────────────────────────────────────────────────────────────────────────
@@ -3826,14 +6677,42 @@ def main():
             validation["message"] = f"⚠️ CONFLICT: Structure suggests PUTS but EMA favors CALLS"
             validation["conflict"] = True
     
-    confidence=calculate_confidence(channel_type,validation,direction,ema_signals,flow,vix_zone)
+    confidence=calculate_confidence(channel_type,validation,direction,ema_signals,flow,vix_zone,mtf_cache)
     
     # Historical outcome
     if inputs["is_historical"] and hist_data and entry_edge_es:
-        outcome=analyze_historical_outcome(hist_data,validation,ceiling_es,floor_es,targets,direction,entry_edge_es,offset)
+        outcome=analyze_historical_outcome(hist_data,validation,ceiling_es,floor_es,targets,direction,entry_edge_es,offset,
+                                           get_intrabar_loader() if inputs.get("intrabar") else None,inputs.get("adverse_limit"))
     else:
         outcome=None
     
+    # Store the day's result - same params as a default CLI backtest share its param_hash.
+    # Overridden pivots/prior RTH give a different channel under the same hash, so those runs are not stored.
+    levels_overridden=(inputs["override_on"] and inputs["on_high"] is not None) or \
+                      (inputs["override_prior"] and inputs["prior_high"] is not None) or \
+                      bool(inputs.get("override_on") and inputs.get("on_prior_close"))
+    results_params={"offset":offset,"ref_hr":inputs["ref_hr"],"ref_mn":inputs["ref_mn"],"slope":SLOPE,"break_threshold":BREAK_THRESHOLD,
+                    "touch_tolerance":2.0,"setup_cutoff":"10:30","partial_threshold":10}
+    if inputs.get("intrabar"):
+        results_params.update({"intrabar":True,"adverse_limit":inputs.get("adverse_limit")})
+    if outcome and not levels_overridden:
+        try:
+            save_results([outcome_result_row(inputs["trading_date"],outcome,validation,channel_type,targets,vix_zone)],results_params)
+        except sqlite3.Error:
+            pass
+    
+    # Live setup state machine - one per day, advanced only by bars closed since the last rerun
+    setup_machine=None
+    if not inputs["is_historical"] and not inputs["is_planning"] and ceiling_es and floor_es:
+        machine_key=(inputs["trading_date"],ceiling_es,floor_es,channel_type,offset,ref_time)
+        cached=st.session_state.get("setup_machine")
+        if not cached or cached[0]!=machine_key:
+            cached=(machine_key,new_setup_machine(inputs["trading_date"],ceiling_es,floor_es,channel_type,cones_spx,offset,ref_time))
+            subscribe_setup_machine(cached[1],notify_setup_event)
+            st.session_state["setup_machine"]=cached
+        setup_machine=cached[1]
+        feed_closed_bars(setup_machine,es_candles,now)
+    
     # ═══════════════════════════════════════════════════════════════════════════
     # BRAND HEADER - Leveraged Alpha Style
     # ═══════════════════════════════════════════════════════════════════════════
@@ -4115,6 +6994,13 @@ def main():
 {f'<div class="timeline" style="margin-top:12px">{timeline_html}</div>' if timeline_html else ""}
 </div>''',unsafe_allow_html=True)
         
+        intrabar_info = outcome.get("intrabar")
+        if intrabar_info:
+            ambiguous = ", ".join(intrabar_info["ambiguous_candles"]) or "none"
+            resolved = ", ".join(intrabar_info["resolved_candles"]) or "none"
+            hits = " · ".join(f"{h['name']} {h['time']} ({h['resolution']}, -{h['adverse_before']:.1f} before)" for h in intrabar_info["targets_hit"])
+            st.caption(f"🔬 Ambiguous candles: {ambiguous} | resolved intrabar: {resolved}" + (f" | {hits}" if hits else ""))
+        
         # Debug expander to show candle-by-candle evaluation
         debug_info = entry_conf.get("debug", [])
         if debug_info:
@@ -4276,7 +7162,8 @@ def main():
             # Get targets - recalculate if needed
             if not targets:
                 targets = find_targets(entry_spx, cones_spx, direction) if entry_spx else []
-            exits, _ = estimate_exit_prices(entry_spx, strike, "PUT" if direction == "PUTS" else "CALL", vix, hours_to_expiry, targets)
+            exits, _ = estimate_exit_prices(entry_spx, strike, "PUT" if direction == "PUTS" else "CALL", vix, hours_to_expiry, targets,
+                                            hit_time_model(params_hash(results_params)) if os.path.exists(RESULTS_DB) else None)
             
             setup_class = "puts" if direction == "PUTS" else "calls"
             setup_icon = "▼" if direction == "PUTS" else "▲"
@@ -4302,7 +7189,7 @@ def main():
                 targets_html += f'''<div class="target-row">
 <span class="target-name">{t["target"]}</span>
 <span class="target-level">@ {t["level"]}</span>
-<span class="target-price">${t["price"]} ({t["pct"]:+.0f}%)</span>
+<span class="target-price">${t["price"]} ({t["pct"]:+.0f}%){f' <span style="opacity:0.6;font-size:0.85em">${t["low"]}–{t["high"]}</span>' if t["high"] > t["low"] else ""}</span>
 </div>'''
             
             # Add projected badge styling
@@ -4364,12 +7251,13 @@ def main():
         
         conflict_msg = validation.get("message", "O/N trading inside channel")
         
-        # Calculate strikes and premiums for both setups
+        # Calculate strikes and premiums for both setups (one pricing call)
         puts_strike = get_strike(floor_spx, "PUT") if floor_spx else 0
-        puts_premium = estimate_prices(floor_spx, puts_strike, "PUT", vix, hours_to_expiry) if floor_spx else 0
-        
         calls_strike = get_strike(ceiling_spx, "CALL") if ceiling_spx else 0
-        calls_premium = estimate_prices(ceiling_spx, calls_strike, "CALL", vix, hours_to_expiry) if ceiling_spx else 0
+        puts_premium, calls_premium = estimate_prices(np.array([floor_spx or np.nan, ceiling_spx or np.nan]),
+                                                      [puts_strike, calls_strike], ["PUT", "CALL"], vix, hours_to_expiry).tolist()
+        puts_premium = puts_premium if floor_spx else 0
+        calls_premium = calls_premium if ceiling_spx else 0
         
         cmd_html += f'''
 <div style="margin-top:16px">
@@ -4433,6 +7321,52 @@ def main():
     cmd_html += "</div></div>"
     st.markdown(cmd_html, unsafe_allow_html=True)
     
+    if direction in ["PUTS", "CALLS"] and entry_edge_es:
+        with st.expander("📈 Greeks & P&L Surface"):
+            # Hours rounded up to the quarter hour so live reruns reuse the cached surface
+            surface=option_pnl_surface(strike,"PUT" if direction == "PUTS" else "CALL",float(vix),math.ceil(hours_to_expiry*4)/4,float(entry_spx),
+                                       entry_premium=float(entry_price))
+            g=surface["greeks"]
+            st.caption(f"{strike} {'P' if direction == 'PUTS' else 'C'} @ ${surface['entry_premium']:.2f} · IV {surface['iv']*100:.0f}% · "
+                       f"Δ {g['delta']:+.2f} · Γ {g['gamma']:.4f} · Θ ${g['theta']*100/24:,.0f}/hr · Vega ${g['vega']*100:,.0f}/pt (per contract)")
+            scale=max(float(np.abs(surface["pnl"]).max()),1.0)
+            clock=[(datetime.combine(inputs["trading_date"],time(15,0))-timedelta(hours=float(h))).strftime("%H:%M") for h in surface["hours_left"]]
+            head="".join(f'<th style="padding:3px 6px;font-weight:500;color:rgba(255,255,255,0.5)">{c}</th>' for c in clock)
+            body=""
+            for px,row in zip(surface["spx"],surface["pnl"]):
+                cells="".join(f'<td style="padding:3px 6px;text-align:right;background:rgba({"0,212,170" if v>=0 else "255,71,87"},{0.08+0.6*abs(v)/scale:.2f})">{v:+,.0f}</td>' for v in row)
+                body+=f'<tr><td style="padding:3px 6px;color:rgba(255,255,255,0.5)">{px:.0f}</td>{cells}</tr>'
+            st.markdown(f'<div class="card" style="overflow-x:auto"><table style="border-collapse:collapse;font-family:IBM Plex Mono,monospace;font-size:11px">'
+                        f'<tr><th style="padding:3px 6px;color:rgba(255,255,255,0.5)">SPX / CT</th>{head}</tr>{body}</table></div>',unsafe_allow_html=True)
+        
+        with st.expander("🪜 Strike Ladder"):
+            ladder=strike_ladder(float(entry_spx),"PUT" if direction == "PUTS" else "CALL",float(vix),math.ceil(hours_to_expiry*4)/4,
+                                 tuple((t["name"],float(t["level"])) for t in targets),
+                                 hit_time_model(params_hash(results_params)) if os.path.exists(RESULTS_DB) else None)
+            if ladder.empty:
+                st.caption("No priceable strikes")
+            else:
+                pick=np.flatnonzero(ladder["strike"].to_numpy()==strike)
+                touch=", ".join(f"{n} {p*100:.0f}%" for n,p in ladder.attrs["touch_probability"].items())
+                st.caption((f"Default strike {strike} ranks #{pick[0]+1} of {len(ladder)}" if len(pick) else f"Default strike {strike} not priceable")
+                           +(f" · touch odds: {touch}" if touch else " · no targets in range"))
+                st.dataframe(ladder.head(15),hide_index=True,use_container_width=True)
+        
+        with st.expander("🎲 Monte Carlo Targets"):
+            mc=monte_carlo_targets(float(entry_spx),tuple(float(t["level"]) for t in targets),float(vix),math.ceil(hours_to_expiry*4)/4,
+                                   strike,"PUT" if direction == "PUTS" else "CALL",float(entry_price))
+            st.caption(f"{mc['paths']:,} paths × {mc['steps']} one-minute steps from SPX {entry_spx} at IV {mc['sigma']*100:.0f}% "
+                       f"(option legs {mc['option_iv']*100:.0f}%) · "
+                       f"close p10/p50/p90 {mc['final']['p10']:.0f} / {mc['final']['p50']:.0f} / {mc['final']['p90']:.0f}")
+            mc_html="".join([f'<div class="pillar"><span>{t["name"]} @ {t["level"]}</span><span>{p*100:.0f}% hit'
+                             +(f' · median {m:.0f} min' if m is not None else "")+'</span></div>'
+                             for t,p,m in zip(targets,mc["touch"],mc["median_minutes"])])
+            for label,key in [("Exit at first target, else expiry","plan"),("Hold to expiry","expiry")]:
+                d=mc[key]
+                mc_html+=(f'<div class="pillar"><span>{label}</span><span>avg ${d["mean"]:+,.0f} · p10/p50/p90 ${d["p10"]:+,.0f} / ${d["p50"]:+,.0f} / ${d["p90"]:+,.0f}'
+                          f' · {d["prob_profit"]*100:.0f}% profitable</span></div>')
+            st.markdown(f'<div class="card">{mc_html}</div>',unsafe_allow_html=True)
+    
     # ═══════════════════════════════════════════════════════════════════════════
     # ANALYSIS GRID - 2x2 Layout with Equal Height Cards
     # ═══════════════════════════════════════════════════════════════════════════
@@ -4543,7 +7477,7 @@ def main():
 <div style="display:flex;align-items:center;gap:12px">
 <div style="width:44px;height:44px;background:rgba(34,211,238,0.15);border-radius:12px;display:flex;align-items:center;justify-content:center;font-size:20px">🌊</div>
 <div><div style="font-family:Space Grotesk,sans-serif;font-size:15px;font-weight:600">Flow Bias</div>
-<div style="font-size:11px;color:rgba(255,255,255,0.5)">{flow.get("real_data_sources", 0)} live sources</div></div>
+<div style="font-size:11px;color:rgba(255,255,255,0.5)">{flow.get("real_data_sources", 0)} {"sources as of "+flow["as_of"].strftime("%b %d") if flow.get("as_of") else "live sources"}</div></div>
 </div>
 <div style="text-align:right">
 <div style="font-family:IBM Plex Mono,monospace;font-size:28px;font-weight:700;color:{flow_color}">{flow["score"]:+d}</div>
@@ -4600,7 +7534,95 @@ def main():
         all_lvls.sort(key=lambda x:x[1],reverse=True)
         lvl_html="".join([f'<div class="pillar"><span>{n}</span><span>ES {l} → SPX {round(l-offset,2)}</span></div>' for n,l in all_lvls])
         st.markdown(f'<div class="card">{lvl_html}</div>',unsafe_allow_html=True)
-    
+
+    with st.expander("🧭 Swing Pivot Rails (±30 pts)"):
+        pivot_levels=build_pivot_levels(es_candles,ref_time)
+        near=query_levels(pivot_levels,current_es-30,current_es+30)
+        if near:
+            piv_html="".join([f'<div class="pillar"><span>{p["name"]} ({p["anchor_time"].strftime("%a %H:%M")})</span><span>ES {p["level"]} → SPX {round(p["level"]-offset,2)}</span></div>' for p in reversed(near)])
+            st.markdown(f'<div class="card">{piv_html}</div>',unsafe_allow_html=True)
+        else:
+            st.caption("No swing pivot rails within 30 pts of current price")
+
+    with st.expander("🎯 Level Confluence"):
+        conf_tol=st.slider("Cluster tolerance (pts)",1.0,10.0,3.0,0.5,key="conf_tol")
+        active_levels=collect_active_levels(channel_type,on_high,on_high_time,on_low,on_low_time,
+                                            prior_high_wick,prior_high_wick_time,prior_high_close,prior_high_close_time,
+                                            prior_low_close,prior_low_close_time,prior_close,prior_close_time)
+        # Anchors rarely change between reruns - only re-project when ref time moves
+        conf_key=(tuple((l["name"],l["anchor"],str(l["anchor_time"])) for l in active_levels),conf_tol)
+        cached=st.session_state.get("confluence_index")
+        if cached and cached[0]==conf_key:
+            conf_index=update_confluence_ref_time(cached[1],ref_time)
+        else:
+            conf_index=build_confluence_index(active_levels,ref_time,conf_tol)
+        st.session_state["confluence_index"]=(conf_key,conf_index)
+
+        nearest=find_confluence(conf_index,current_es)
+        if nearest:
+            side="above" if nearest["distance"]>0 else "below"
+            st.caption(f"Price is {abs(nearest['distance']):.1f} pts {side} the nearest cluster (SPX {round(nearest['center']-offset,2)})")
+            clusters=sorted([confluence_cluster(conf_index,k) for k in conf_index["multi"]],key=lambda c:c["score"],reverse=True)
+            conf_html="".join([f'<div class="pillar"><span>SPX {round(c["center"]-offset,2)} · {c["count"]} levels · score {c["score"]}</span><span>{", ".join(n for n,_ in c["members"])}</span></div>' for c in clusters])
+            st.markdown(f'<div class="card">{conf_html}</div>',unsafe_allow_html=True)
+        else:
+            st.caption(f"No levels within {conf_tol:.1f} pts of each other")
+
+    with st.expander("🕐 Multi-Timeframe Indicators"):
+        fmt=lambda v,d=2:"—" if v is None else f"{v:.{d}f}"
+        mtf_rows=[]
+        for tf in ["30m"]+list(MTF_TIMEFRAMES):
+            bar=mtf_cache["bar_time"].get(("ES",tf))
+            if bar is None:
+                continue
+            mtf_rows.append({"Timeframe":tf,"Last bar":bar.strftime("%a %H:%M CT") if tf!="1d" else (bar+pd.Timedelta(hours=7)).strftime("%a %b %d"),
+                             "Trend":mtf_trend(mtf_cache,tf) or "—","RSI":fmt(mtf_value(mtf_cache,tf,"rsi",14),1),
+                             "MACD hist":fmt(mtf_value(mtf_cache,tf,"macd_hist",(12,26,9))),
+                             "EMA 8":fmt(mtf_value(mtf_cache,tf,"ema",8)),"EMA 21":fmt(mtf_value(mtf_cache,tf,"ema",21)),
+                             "EMA 200":fmt(mtf_value(mtf_cache,tf,"ema",200))})
+        if mtf_rows:
+            st.dataframe(pd.DataFrame(mtf_rows),hide_index=True,use_container_width=True)
+        else:
+            st.caption("No closed bars yet")
+
+    if os.path.exists(RESULTS_DB):
+        with st.expander("🗄️ Results History"):
+            scope=st.radio("Parameter set",["Current","All"],horizontal=True,key="results_scope")
+            group=st.selectbox("Group by",["—"]+RESULTS_GROUPS,key="results_group")
+            try:
+                scope_hash=params_hash(results_params) if scope=="Current" else None
+                agg=query_result_aggregates(None if group=="—" else group,scope_hash,strategy_version=STRATEGY_VERSION)
+                if agg.empty:
+                    st.caption("No stored results for this parameter set yet")
+                else:
+                    st.dataframe(agg,hide_index=True,use_container_width=True)
+                    st.dataframe(query_target_hit_rates(scope_hash,strategy_version=STRATEGY_VERSION),hide_index=True,use_container_width=True)
+            except sqlite3.Error as e:
+                st.caption(f"Results store unavailable: {e}")
+
+    if inputs["is_historical"] and hist_data:
+        with st.expander("⏯️ Replay"):
+            speed=st.slider("Speed (bars/sec)",1,50,4,key="replay_speed")
+            if st.button("▶️ Replay this day through the live engine",use_container_width=True):
+                replay_box=st.empty()
+                step=None
+                for step in replay_day(es_candles,inputs["trading_date"],offset,inputs["ref_hr"],inputs["ref_mn"],vix,speed,flow):
+                    m=step["machine"]
+                    events_html="".join([f'<div class="pillar"><span>{e["time"]} · {e["type"].replace("_"," ")}</span><span>{e.get("message",e.get("name",""))}</span></div>' for e in m["events"][-6:]])
+                    replay_box.markdown(f'<div class="card"><div class="pillar"><span>{step["time"].strftime("%H:%M")} · {step["state"].replace("_"," ")}</span>'
+                                        f'<span>ES {step["candle"]["close"]:.2f} · Confidence {step["confidence"]["score"]}</span></div>{events_html}</div>',unsafe_allow_html=True)
+                if step is None:
+                    st.caption("Not enough prior-session data to replay this day")
+
+    if setup_machine:
+        with st.expander(f"🤖 Setup State: {setup_machine['state'].replace('_',' ')}"):
+            if setup_machine["direction"]:
+                st.caption(f"{setup_machine['direction']} from SPX {round(setup_machine['entry_level_es']-offset,2)}"
+                           +(f" · entered {setup_machine['entry']['time']} @ {setup_machine['entry']['price']}" if setup_machine["entry"] else "")
+                           +(f" · +{setup_machine['max_favorable']:.1f} / -{setup_machine['max_adverse']:.1f}" if setup_machine["entry"] else ""))
+            events_html="".join([f'<div class="pillar"><span>{e["time"]} · {e["type"].replace("_"," ")}</span><span>{e.get("message",e.get("name",""))}</span></div>' for e in setup_machine["events"]])
+            st.markdown(f'<div class="card">{events_html or "Waiting for the first closed bar"}</div>',unsafe_allow_html=True)
+
     # ═══════════════════════════════════════════════════════════════════════════
     # DEBUG
     # ═══════════════════════════════════════════════════════════════════════════
@@ -4671,5 +7693,9 @@ Setup Window: 8:00-10:30 AM | Entry Window: 8:30-11:00 AM | Slope: {SLOPE} pts/b
         time_module.sleep(30)
         st.rerun()
 
+CLI_COMMANDS=["backtest","optimize","replay","flow-features","bench-pricing","calibrate-iv","seed-history"]
+
 if __name__=="__main__":
+    if len(sys.argv)>1 and sys.argv[1] in CLI_COMMANDS:
+        sys.exit(run_cli(sys.argv[1:]))
     main()
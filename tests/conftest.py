@@ -0,0 +1,47 @@
+import logging
+import os
+import sys
+from datetime import date, datetime, time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import APPA  # noqa: E402
+
+
+def make_candles(start, days, seed=0, px=5000.0):
+    """Synthetic 30m ES candles on the CME session calendar (index in ET, like yfinance)"""
+    rng=np.random.default_rng(seed)
+    idx=pd.date_range(APPA.CT.localize(datetime.combine(start,time(0,0))),periods=days*48,freq="30min")
+    hour=idx.hour+idx.minute/60
+    closed=(idx.weekday==5)|((idx.weekday==6)&(hour<17))|((idx.weekday==4)&(hour>=16))|((hour>=16)&(hour<17))
+    idx=idx[~closed]
+    n=len(idx)
+    close=px+np.cumsum(rng.normal(0,4,n))
+    open_=np.r_[px,close[:-1]]+rng.normal(0,0.5,n)
+    high=np.maximum(open_,close)+np.abs(rng.normal(0,3,n))
+    low=np.minimum(open_,close)-np.abs(rng.normal(0,3,n))
+    return pd.DataFrame({"Open":open_.round(2),"High":high.round(2),"Low":low.round(2),"Close":close.round(2)},
+                        index=idx.tz_convert(APPA.ET))
+
+
+def day_frames(es_candles):
+    """8:00-15:00 CT candles of every session day, as find_entry_confirmation() takes them"""
+    ct=APPA.candles_to_ct(es_candles)
+    frames=[]
+    for d in sorted(set(ct.index.date)):
+        s=APPA.CT.localize(datetime.combine(d,time(8,0)))
+        e=APPA.CT.localize(datetime.combine(d,time(15,0)))
+        day=ct[(ct.index>=s)&(ct.index<=e)]
+        if not day.empty:
+            frames.append(day)
+    return frames
+
+
+@pytest.fixture(scope="session")
+def es_candles():
+    return make_candles(date(2024,1,1),400,seed=5)
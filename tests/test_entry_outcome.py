@@ -0,0 +1,50 @@
+"""Batch entry scan / outcome tracker against the per-day scalar paths"""
+import numpy as np
+import pytest
+
+import APPA
+from conftest import day_frames
+
+
+@pytest.fixture(scope="module")
+def days(es_candles):
+    rng=np.random.default_rng(2)
+    frames=day_frames(es_candles)
+    directions=rng.choice(["CALLS","PUTS","WAIT"],size=len(frames),p=[.45,.45,.1]).tolist()
+    levels=[float(f["Close"].iloc[rng.integers(0,4)])+rng.normal(0,5) for f in frames]
+    targets=[]
+    for f,d,lv in zip(frames,directions,levels):
+        sign=-1 if d=="PUTS" else 1
+        targets.append([{"name":f"T{k}","level":round(lv-18+sign*rng.uniform(2,40),2)} for k in range(rng.integers(0,4))])
+    return frames,directions,levels,targets
+
+
+def test_batch_entry_scan_matches_scalar(days):
+    frames,directions,levels,_=days
+    bars=APPA.stack_day_candles(frames)
+    scan=APPA.batch_find_entry_confirmation(bars,levels,directions,18.0)
+    assert len(frames)>250
+    for i,day in enumerate(frames):
+        scalar=APPA.find_entry_confirmation(day,levels[i],directions[i],18.0,6.0,"08:00",0.48)
+        scalar.pop("debug",None)
+        assert APPA.entry_scan_result(scan,bars,i)==scalar,day.index[0].date()
+
+
+def test_batch_outcomes_match_scalar(days):
+    frames,directions,levels,targets=days
+    traded=[i for i,d in enumerate(directions) if d!="WAIT"]
+    frames=[frames[i] for i in traded]
+    directions=[directions[i] for i in traded]
+    levels=[levels[i] for i in traded]
+    targets=[targets[i] for i in traded]
+    bars=APPA.stack_day_candles(frames)
+    scan=APPA.batch_find_entry_confirmation(bars,levels,directions,18.0)
+    batch=APPA.batch_analyze_outcomes(bars,scan,levels,targets,18.0)
+    for i,day in enumerate(frames):
+        hist_data={"day_candles":day,"day_close":float(day["Close"].iloc[-1])}
+        scalar=APPA.analyze_historical_outcome(hist_data,{"status":"VALID"},None,None,targets[i],directions[i],levels[i],18.0)
+        assert batch["outcome"][i]==scalar["outcome"],day.index[0].date()
+        assert batch["max_favorable"][i]==pytest.approx(scalar["max_favorable"],abs=1e-9)
+        assert batch["max_adverse"][i]==pytest.approx(scalar["max_adverse"],abs=1e-9)
+        hit={t["name"] for t in scalar["targets_hit"]}
+        assert {t["name"] for t,k in zip(targets[i],batch["first_hit"][i]) if k>=0}==hit
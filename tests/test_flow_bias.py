@@ -0,0 +1,311 @@
+"""Table-driven flow bias (FLOW_PILLARS) against the if/elif ladder it replaced"""
+import numpy as np
+
+import APPA
+
+
+def ladder_flow_bias(price, on_high, on_low, vix, vix_high, vix_low, prior_close, flow_data):
+    """calculate_flow_bias() as it was before FLOW_PILLARS, kept as the reference"""
+    signals = []
+    score = 0
+    details = {}
+    
+    # ═══════════════════════════════════════════════════════════════════════════
+    # PILLAR 1: Price Position in Overnight Range (±20 pts)
+    # ═══════════════════════════════════════════════════════════════════════════
+    on_range = on_high - on_low
+    if on_range > 0:
+        price_pos = (price - on_low) / on_range * 100
+        details["price_pos"] = f"{price_pos:.0f}%"
+        
+        if price > on_high:
+            pts = 20
+            score += pts
+            signals.append(("O/N Position", "CALLS", f"Above High (+{price-on_high:.0f})", pts))
+        elif price < on_low:
+            pts = -20
+            score += pts
+            signals.append(("O/N Position", "PUTS", f"Below Low ({price-on_low:.0f})", pts))
+        elif price_pos > 75:
+            pts = 12
+            score += pts
+            signals.append(("O/N Position", "CALLS", f"Upper 25% ({price_pos:.0f}%)", pts))
+        elif price_pos < 25:
+            pts = -12
+            score += pts
+            signals.append(("O/N Position", "PUTS", f"Lower 25% ({price_pos:.0f}%)", pts))
+        else:
+            signals.append(("O/N Position", "NEUTRAL", f"Mid-Range ({price_pos:.0f}%)", 0))
+    
+    # ═══════════════════════════════════════════════════════════════════════════
+    # PILLAR 2: VIX Level (±15 pts)
+    # ═══════════════════════════════════════════════════════════════════════════
+    vix_range = vix_high - vix_low if vix_high and vix_low else 0
+    if vix_range > 0:
+        vix_pos = (vix - vix_low) / vix_range * 100
+        details["vix_pos"] = f"{vix_pos:.0f}%"
+        
+        if vix > vix_high:
+            pts = -15
+            score += pts
+            signals.append(("VIX Level", "PUTS", f"Elevated ({vix:.1f})", pts))
+        elif vix < vix_low:
+            pts = 15
+            score += pts
+            signals.append(("VIX Level", "CALLS", f"Compressed ({vix:.1f})", pts))
+        elif vix_pos > 70:
+            pts = -8
+            score += pts
+            signals.append(("VIX Level", "PUTS", f"High ({vix:.1f})", pts))
+        elif vix_pos < 30:
+            pts = 8
+            score += pts
+            signals.append(("VIX Level", "CALLS", f"Low ({vix:.1f})", pts))
+        else:
+            signals.append(("VIX Level", "NEUTRAL", f"Normal ({vix:.1f})", 0))
+    
+    # ═══════════════════════════════════════════════════════════════════════════
+    # PILLAR 3: Gap from Prior Close (±15 pts)
+    # Gap = Current Price - Prior RTH Close
+    # This is the classic "gap up" or "gap down" measure
+    # ═══════════════════════════════════════════════════════════════════════════
+    
+    gap = price - prior_close if prior_close else 0
+    details["gap"] = f"{gap:+.1f}"
+    
+    if gap > 20:
+        pts = 15
+        score += pts
+        signals.append(("Gap", "CALLS", f"Large Gap Up (+{gap:.0f})", pts))
+    elif gap > 10:
+        pts = 10
+        score += pts
+        signals.append(("Gap", "CALLS", f"Gap Up (+{gap:.0f})", pts))
+    elif gap > 5:
+        pts = 5
+        score += pts
+        signals.append(("Gap", "CALLS", f"Small Gap Up (+{gap:.0f})", pts))
+    elif gap < -20:
+        pts = -15
+        score += pts
+        signals.append(("Gap", "PUTS", f"Large Gap Down ({gap:.0f})", pts))
+    elif gap < -10:
+        pts = -10
+        score += pts
+        signals.append(("Gap", "PUTS", f"Gap Down ({gap:.0f})", pts))
+    elif gap < -5:
+        pts = -5
+        score += pts
+        signals.append(("Gap", "PUTS", f"Small Gap Down ({gap:.0f})", pts))
+    else:
+        signals.append(("Gap", "NEUTRAL", f"Flat ({gap:+.0f})", 0))
+    
+    # ═══════════════════════════════════════════════════════════════════════════
+    # PILLAR 4: VVIX - Volatility of Volatility (±10 pts)
+    # High VVIX (>100) = uncertainty, usually precedes moves
+    # Low VVIX (<85) = complacency
+    # ═══════════════════════════════════════════════════════════════════════════
+    if flow_data["vvix"] is not None:
+        vvix = flow_data["vvix"]
+        vvix_chg = flow_data["vvix_change"] or 0
+        details["vvix"] = f"{vvix:.1f}"
+        
+        # VVIX rising sharply = fear increasing = bearish
+        # VVIX falling = fear decreasing = bullish
+        if vvix > 110 and vvix_chg > 3:
+            pts = -10
+            score += pts
+            signals.append(("VVIX", "PUTS", f"Spiking ({vvix:.0f}, +{vvix_chg:.1f})", pts))
+        elif vvix > 100:
+            pts = -5
+            score += pts
+            signals.append(("VVIX", "PUTS", f"Elevated ({vvix:.0f})", pts))
+        elif vvix < 85 and vvix_chg < -2:
+            pts = 8
+            score += pts
+            signals.append(("VVIX", "CALLS", f"Calm ({vvix:.0f}, {vvix_chg:.1f})", pts))
+        elif vvix < 90:
+            pts = 5
+            score += pts
+            signals.append(("VVIX", "CALLS", f"Low ({vvix:.0f})", pts))
+        else:
+            signals.append(("VVIX", "NEUTRAL", f"Normal ({vvix:.0f})", 0))
+    
+    # ═══════════════════════════════════════════════════════════════════════════
+    # PILLAR 5: VIX Term Structure (±15 pts)
+    # Contango (VIX3M > VIX) = normal, bullish
+    # Backwardation (VIX > VIX3M) = fear, bearish
+    # ═══════════════════════════════════════════════════════════════════════════
+    if flow_data["vix_term_structure"] is not None:
+        term = flow_data["vix_term_structure"]
+        details["term_structure"] = f"{term:+.2f}"
+        
+        if term > 3:
+            pts = 15
+            score += pts
+            signals.append(("Term Structure", "CALLS", f"Steep Contango (+{term:.1f})", pts))
+        elif term > 0:
+            pts = 8
+            score += pts
+            signals.append(("Term Structure", "CALLS", f"Contango (+{term:.1f})", pts))
+        elif term < -2:
+            pts = -15
+            score += pts
+            signals.append(("Term Structure", "PUTS", f"Backwardation ({term:.1f})", pts))
+        elif term < 0:
+            pts = -8
+            score += pts
+            signals.append(("Term Structure", "PUTS", f"Slight Inversion ({term:.1f})", pts))
+        else:
+            signals.append(("Term Structure", "NEUTRAL", f"Flat ({term:.1f})", 0))
+    
+    # ═══════════════════════════════════════════════════════════════════════════
+    # PILLAR 6: Market Breadth - RSP/SPY Change (±10 pts)
+    # Improving breadth = healthy = bullish
+    # Deteriorating breadth = narrow = bearish
+    # ═══════════════════════════════════════════════════════════════════════════
+    if flow_data["breadth_ratio"] is not None:
+        breadth = flow_data["breadth_ratio"]
+        details["breadth"] = f"{breadth:+.2f}%"
+        
+        if breadth > 0.3:
+            pts = 10
+            score += pts
+            signals.append(("Breadth", "CALLS", f"Improving (+{breadth:.2f}%)", pts))
+        elif breadth > 0.1:
+            pts = 5
+            score += pts
+            signals.append(("Breadth", "CALLS", f"Positive (+{breadth:.2f}%)", pts))
+        elif breadth < -0.3:
+            pts = -10
+            score += pts
+            signals.append(("Breadth", "PUTS", f"Deteriorating ({breadth:.2f}%)", pts))
+        elif breadth < -0.1:
+            pts = -5
+            score += pts
+            signals.append(("Breadth", "PUTS", f"Negative ({breadth:.2f}%)", pts))
+        else:
+            signals.append(("Breadth", "NEUTRAL", f"Flat ({breadth:+.2f}%)", 0))
+    
+    # ═══════════════════════════════════════════════════════════════════════════
+    # PILLAR 7: Risk On/Off Rotation (±10 pts)
+    # Tech > Utilities = Risk On = Bullish
+    # Utilities > Tech = Risk Off = Bearish
+    # ═══════════════════════════════════════════════════════════════════════════
+    if flow_data["risk_on_off"] is not None:
+        risk = flow_data["risk_on_off"]
+        details["risk_rotation"] = f"{risk:+.2f}%"
+        
+        if risk > 1.0:
+            pts = 10
+            score += pts
+            signals.append(("Risk Rotation", "CALLS", f"Risk ON (+{risk:.1f}%)", pts))
+        elif risk > 0.3:
+            pts = 5
+            score += pts
+            signals.append(("Risk Rotation", "CALLS", f"Slight Risk ON (+{risk:.1f}%)", pts))
+        elif risk < -1.0:
+            pts = -10
+            score += pts
+            signals.append(("Risk Rotation", "PUTS", f"Risk OFF ({risk:.1f}%)", pts))
+        elif risk < -0.3:
+            pts = -5
+            score += pts
+            signals.append(("Risk Rotation", "PUTS", f"Slight Risk OFF ({risk:.1f}%)", pts))
+        else:
+            signals.append(("Risk Rotation", "NEUTRAL", f"Balanced ({risk:+.1f}%)", 0))
+    
+    # ═══════════════════════════════════════════════════════════════════════════
+    # PILLAR 8: Put/Call Ratio - CONTRARIAN (±10 pts)
+    # High P/C (>1.0) = bearish sentiment = contrarian BULLISH
+    # Low P/C (<0.7) = bullish sentiment = contrarian BEARISH
+    # ═══════════════════════════════════════════════════════════════════════════
+    if flow_data["put_call_ratio"] is not None:
+        pc = flow_data["put_call_ratio"]
+        details["put_call"] = f"{pc:.2f}"
+        
+        if pc > 1.2:
+            pts = 10  # Contrarian bullish
+            score += pts
+            signals.append(("Put/Call", "CALLS", f"High Fear ({pc:.2f}) - Contrarian Bull", pts))
+        elif pc > 1.0:
+            pts = 5
+            score += pts
+            signals.append(("Put/Call", "CALLS", f"Elevated ({pc:.2f})", pts))
+        elif pc < 0.6:
+            pts = -10  # Contrarian bearish
+            score += pts
+            signals.append(("Put/Call", "PUTS", f"Complacency ({pc:.2f}) - Contrarian Bear", pts))
+        elif pc < 0.75:
+            pts = -5
+            score += pts
+            signals.append(("Put/Call", "PUTS", f"Low ({pc:.2f})", pts))
+        else:
+            signals.append(("Put/Call", "NEUTRAL", f"Normal ({pc:.2f})", 0))
+    
+    # ═══════════════════════════════════════════════════════════════════════════
+    # FINAL BIAS DETERMINATION
+    # ═══════════════════════════════════════════════════════════════════════════
+    # Clamp score to -100 to +100
+    score = max(-100, min(100, score))
+    
+    if score >= 40:
+        bias = "STRONG_CALLS"
+    elif score >= 20:
+        bias = "CALLS"
+    elif score <= -40:
+        bias = "STRONG_PUTS"
+    elif score <= -20:
+        bias = "PUTS"
+    else:
+        bias = "NEUTRAL"
+    
+    return {"bias": bias, "score": score, "signals": signals, "details": details}
+
+
+def _pick(rng, specials, value):
+    """A threshold value 40% of the time, so every boundary gets exercised"""
+    return specials[rng.integers(len(specials))] if rng.random()<.4 else value
+
+
+def _case(rng):
+    flow_data={
+        "vvix":_pick(rng,[None,110.0,100.0,85.0,90.0],round(rng.uniform(70,130),2)),
+        "vvix_change":_pick(rng,[None,3.0,-2.0,0.0],round(rng.normal(0,4),2)),
+        "vix_term_structure":_pick(rng,[None,3.0,0.0,-2.0],round(rng.normal(0,3),2)),
+        "put_call_ratio":_pick(rng,[None,1.2,1.0,0.6,0.75],round(rng.uniform(.4,1.5),2)),
+        "breadth_ratio":_pick(rng,[None,0.3,0.1,-0.3,-0.1,0.0],round(rng.normal(0,.4),3)),
+        "risk_on_off":_pick(rng,[None,1.0,0.3,-1.0,-0.3],round(rng.normal(0,1.2),2)),
+        "data_fresh":True
+    }
+    on_low=round(rng.uniform(4900,5000),2)
+    on_high=_pick(rng,[on_low],on_low+round(rng.uniform(0,60),2))
+    price=_pick(rng,[on_high,on_low,on_low+(on_high-on_low)*.75,on_low+(on_high-on_low)*.25],round(rng.uniform(on_low-40,on_high+40),2))
+    vix_low=_pick(rng,[None,0],round(rng.uniform(12,18),2))
+    vix_high=_pick(rng,[None,vix_low],round((vix_low or 14)+rng.uniform(0,5),2))
+    vix=_pick(rng,[vix_high,vix_low],round(rng.uniform(10,25),2))
+    vix=15.0 if vix is None else vix
+    prior_close=_pick(rng,[None,0,price-20,price-10,price-5,price+5,price+10,price+20,price],round(price+rng.normal(0,15),2))
+    return (price,on_high,on_low,vix,vix_high,vix_low,prior_close),flow_data
+
+
+def test_table_matches_ladder(monkeypatch):
+    rng=np.random.default_rng(7)
+    for _ in range(5000):
+        args,flow_data=_case(rng)
+        monkeypatch.setattr(APPA,"fetch_market_flow_data",lambda flow_data=flow_data:dict(flow_data))
+        got=APPA.calculate_flow_bias(*args)
+        assert {k:got[k] for k in ("bias","score","signals","details")}==ladder_flow_bias(*args,flow_data),args
+
+
+def test_score_flow_bias_rows_match_single_calls():
+    rng=np.random.default_rng(11)
+    n=500
+    flow_data={"vvix":rng.uniform(70,130,n),"vvix_change":rng.normal(0,4,n),"vix_term_structure":rng.normal(0,3,n),
+               "put_call_ratio":rng.uniform(.4,1.5,n),"breadth_ratio":rng.normal(0,.4,n),"risk_on_off":rng.normal(0,1.2,n)}
+    price=rng.uniform(4900,5100,n)
+    scored=APPA.score_flow_bias(APPA.flow_feature_arrays(price,5050,4950,15,18,12,5000,flow_data))
+    for i in range(n):
+        one={k:float(v[i]) for k,v in flow_data.items()}
+        ref=ladder_flow_bias(float(price[i]),5050,4950,15,18,12,5000,one)
+        assert (int(scored["score"][i]),str(scored["bias"][i]))==(ref["score"],ref["bias"])
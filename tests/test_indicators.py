@@ -0,0 +1,30 @@
+"""Incremental indicator engine against the pandas calculate_momentum() / calculate_ema_signals()"""
+import numpy as np
+
+import APPA
+
+
+def test_engine_matches_pandas_on_every_prefix(es_candles):
+    rng=np.random.default_rng(3)
+    bars=es_candles.iloc[:400].copy()
+    bars.iloc[100:120,bars.columns.get_loc("Close")]=bars["Close"].iloc[100]  # flat run: zero gains and losses
+    engine=APPA.new_indicator_engine()
+    for k in range(len(bars)):
+        APPA.indicator_step(engine,bars["Close"].iloc[k],bars.index[k])
+        prefix=bars.iloc[:k+1]
+        price=float(bars["Close"].iloc[k])+rng.normal(0,3)
+        assert APPA.engine_momentum(engine)==APPA.calculate_momentum(prefix),k
+        assert APPA.engine_ema_signals(engine,price)==APPA.calculate_ema_signals(prefix,price),k
+
+
+def test_sync_commits_closed_bars_and_previews_the_forming_one(es_candles):
+    rng=np.random.default_rng(4)
+    engine=None
+    for end in range(300,700):
+        window=es_candles.iloc[end-250:end].copy()
+        window.iloc[-1,window.columns.get_loc("Close")]+=rng.normal(0,2)  # the forming bar moves between reruns
+        engine=APPA.sync_indicator_engine(engine,window)
+        full=es_candles.iloc[50:end].copy()  # the engine's series starts at the first window
+        full.iloc[-1]=window.iloc[-1]
+        assert APPA.engine_momentum(engine)==APPA.calculate_momentum(full),end
+        assert APPA.engine_ema_signals(engine,5000)==APPA.calculate_ema_signals(full,5000),end
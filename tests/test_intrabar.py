@@ -0,0 +1,17 @@
+"""Local intrabar store timestamps"""
+from datetime import date
+
+import pandas as pd
+
+import APPA
+
+
+def test_load_intrabar_csv_reads_naive_times_as_ct(tmp_path):
+    idx=pd.date_range("2024-07-10 08:00","2024-07-10 08:55",freq="5min")
+    bars=pd.DataFrame({"Open":1.0,"High":2.0,"Low":0.5,"Close":1.5},index=idx)
+    bars.to_csv(tmp_path/"ES_5m_2024-07-10.csv")
+    bars.set_axis(idx.tz_localize("UTC")).to_csv(tmp_path/"ES_5m_2024-07-11.csv")
+    naive=APPA.load_intrabar_csv(date(2024,7,10),"5m",str(tmp_path))
+    aware=APPA.load_intrabar_csv(date(2024,7,11),"5m",str(tmp_path))
+    assert naive.index[0]==APPA.CT.localize(idx[0].to_pydatetime())
+    assert aware.index[0]==pd.Timestamp("2024-07-10 08:00",tz="UTC")
@@ -0,0 +1,46 @@
+"""Broadcast Black-Scholes kernels against the scalar black_scholes()"""
+import numpy as np
+import pytest
+
+import APPA
+
+
+@pytest.fixture(scope="module")
+def inputs():
+    rng=np.random.default_rng(1)
+    n=20000
+    S=rng.uniform(4000,6000,n)
+    return {"S":S,"K":np.round(S+rng.uniform(-100,100,n)),"T":rng.uniform(0,0.01,n),"sigma":rng.uniform(.1,1,n),
+            "is_call":rng.random(n)<.5,"vix":rng.uniform(10,40,n),"hours":rng.uniform(0,7,n)}
+
+
+def test_black_scholes_array_matches_scalar(inputs):
+    got=APPA.black_scholes_array(inputs["S"],inputs["K"],inputs["T"],0.05,inputs["sigma"],inputs["is_call"])
+    ref=[APPA.black_scholes(S,K,T,0.05,sigma,"CALL" if c else "PUT")
+         for S,K,T,sigma,c in zip(inputs["S"],inputs["K"],inputs["T"],inputs["sigma"],inputs["is_call"])]
+    assert np.abs(got-ref).max()<=APPA.PRICING_TOL
+
+
+def test_black_scholes_grid_matches_array():
+    S,K,T,sigma=np.linspace(5000,5100,5),np.arange(4950,5150,25),np.linspace(1e-4,6/8760,4),np.linspace(.1,.6,3)
+    grid=APPA.black_scholes_grid(S,K,T,sigma,is_call=False)
+    mesh=np.meshgrid(S,K,T,sigma,indexing="ij")
+    np.testing.assert_array_equal(grid,APPA.black_scholes_array(*mesh[:3],0.05,mesh[3],False))
+
+
+def test_estimate_prices_array_matches_scalar_calls(inputs):
+    n=2000
+    S,K,vix,hours=(inputs[k][:n] for k in ("S","K","vix","hours"))
+    opt_type=np.where(inputs["is_call"][:n],"CALL","PUT")
+    batch=APPA.estimate_prices(S,K,opt_type,vix,hours)
+    scalar=[APPA.estimate_prices(*a) for a in zip(S.tolist(),K.tolist(),opt_type.tolist(),vix.tolist(),hours.tolist())]
+    assert isinstance(scalar[0],float)
+    np.testing.assert_array_equal(batch,scalar)
+
+
+def test_get_strike_array_matches_scalar(inputs):
+    S,is_call=inputs["S"][:500],inputs["is_call"][:500]
+    scalar=[APPA.get_strike(s,"CALL" if c else "PUT") for s,c in zip(S.tolist(),is_call.tolist())]
+    assert isinstance(scalar[0],int)
+    np.testing.assert_array_equal(APPA.get_strike(S,is_call),scalar)
+    np.testing.assert_array_equal(APPA.get_strike(S,np.where(is_call,"CALL","PUT")),scalar)
@@ -0,0 +1,33 @@
+"""Live setup state machine"""
+from datetime import date, datetime, time
+
+import APPA
+
+DAY=date(2024,7,10)
+CONES={n:{"asc":5200,"desc":4900} for n in ("HIGH","LOW","CLOSE")}
+
+
+def _feed(machine, bars):
+    events=[]
+    for (h,m),(o,hi,lo,c) in bars:
+        events+=APPA.on_bar_close(machine,APPA.CT.localize(datetime.combine(DAY,time(h,m))),
+                                  {"open":o,"high":hi,"low":lo,"close":c})
+    return events
+
+
+def test_nine_am_revalidation_does_not_enter_off_earlier_bars():
+    machine=APPA.new_setup_machine(DAY,5100,5000,"RISING",CONES,18.0,APPA.CT.localize(datetime.combine(DAY,time(9,0))))
+    events=_feed(machine,[((8,0),(5105,5108,5099,5101)),    # bearish rejection of the ceiling
+                          ((8,30),(5101,5103,5094,5096)),   # 8:30 candle → WAIT_9AM
+                          ((9,0),(5096,5112,5095,5110)),    # closes above: CALLS from 9:00
+                          ((9,30),(5110,5125,5105,5120))])
+    assert [e["status"] for e in events if e["type"]=="VALIDATION"]==["WAIT_9AM","VALID"]
+    assert not any(e["type"] in ("SETUP_CONFIRMED","ENTERED") and e["time"]<"09:00" for e in events)
+
+
+def test_nine_am_edges_slide_back_for_a_later_ref_time():
+    # Ref 9:30 puts the 9:00 ceiling one block lower (rising rail): 5099.52
+    machine=APPA.new_setup_machine(DAY,5100,5000,"RISING",CONES,18.0,APPA.CT.localize(datetime.combine(DAY,time(9,30))))
+    events=_feed(machine,[((8,0),(5105,5108,5099,5101)),((8,30),(5101,5103,5094,5096)),((9,0),(5096,5104,5095,5099.8))])
+    assert [e["status"] for e in events if e["type"]=="VALIDATION"][-1]!="WAIT_9AM"
+    assert machine["validation"]["edge"]==5100